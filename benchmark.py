@@ -0,0 +1,226 @@
+"""
+Benchmarks of the tracker components.
+
+Subcommands:
+    solvers     Time the linear assignment solvers on cost matrices recorded
+                with `python track.py --record-costs costs.npz`, or on
+                synthetic problems, and compare their total cost with the
+                exact solver. Recorded problems are reported separately for
+                the full cost matrices of the association stages and for
+                their connected components, which the tracker solves.
+    tracks      Time the tracker on a synthetic scene with many false
+                detections, which create and delete short-lived tracks every
+                frame, with and without recycling track records, and count
+                the garbage collections.
+
+Usage:
+    $ python track.py --source vid.mp4 --record-costs runs/costs.npz
+    $ python benchmark.py solvers --costs runs/costs.npz
+    $ python benchmark.py solvers --size 1000 --density 0.01 0.05 0.2
+    $ python benchmark.py tracks --objects 200 --clutter 300
+"""
+
+import argparse
+import gc
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # yolov5 strongsort root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'yolov5') not in sys.path:
+    sys.path.append(str(ROOT / 'yolov5'))  # add yolov5 ROOT to PATH
+
+from yolov5.utils.general import LOGGER, colorstr, print_args
+from strong_sort.sort.detection import DetectionBatch
+from strong_sort.sort.nn_matching import NearestNeighborDistanceMetric
+from strong_sort.sort.solvers import SOLVERS, build_solver, load_cost_matrices
+from strong_sort.sort.tracker import Tracker
+
+
+def synthetic_problems(size=1000, density=0.01, count=10, max_distance=0.7, seed=0):
+    """Tracking-like assignment problems: `size` tracks at random positions,
+    each detected once with some localization noise, and a cost proportional
+    to the track/detection distance that is feasible within a gating radius
+    chosen such that about `density` of the pairs are feasible."""
+    rng = np.random.default_rng(seed)
+    radius = np.sqrt(density / np.pi)  # on the unit square
+    problems = []
+    for _ in range(count):
+        tracks = rng.uniform(0, 1, (size, 2))
+        detections = tracks[rng.permutation(size)] + rng.normal(0, radius / 8, (size, 2))
+        distance = np.linalg.norm(tracks[:, None] - detections[None], axis=2)
+        cost = distance / radius * max_distance
+        cost[cost > max_distance] = max_distance + 1e-5
+        problems.append((cost, max_distance))
+    return problems
+
+
+def _objective(cost_matrix, max_distance, rows, cols):
+    # Number of feasible matches and their total cost
+    cost = cost_matrix[rows, cols]
+    cost = cost[cost <= max_distance]
+    return len(cost), cost.sum()
+
+
+def benchmark_solvers(problems, methods, prefix=colorstr('Solvers:')):
+    """Solve every problem with every solver.
+
+    Returns
+    -------
+    dict
+        For every method the mean and maximum time in ms, the number of
+        matches and the total cost of the matches relative to the exact
+        solver. The exact solver matches as many pairs as possible at the
+        lowest total cost, so that fewer matches or a higher cost is worse.
+    """
+    exact = [_objective(c, d, *SOLVERS['hungarian'](c.copy(), d)) for c, d in problems]
+    results = {}
+    for method in methods:
+        solver = build_solver(method)
+        dt, matches, cost = [], 0, 0.
+        for (cost_matrix, max_distance), (n_exact, cost_exact) in zip(problems, exact):
+            c = cost_matrix.copy()
+            t = time.perf_counter()
+            rows, cols = solver(c, max_distance)
+            dt.append(time.perf_counter() - t)
+            n, total = _objective(cost_matrix, max_distance, rows, cols)
+            matches += n - n_exact
+            cost += total - cost_exact
+        results[method] = {
+            'ms_mean': np.mean(dt) * 1E3,
+            'ms_max': np.max(dt) * 1E3,
+            'matches_vs_exact': matches,
+            'cost_vs_exact': cost}
+        LOGGER.info(f"{prefix} {method:>10s}: {results[method]['ms_mean']:8.2f}ms mean, "
+                    f"{results[method]['ms_max']:8.2f}ms max, {matches:+d} matches, {cost:+.3f} cost vs exact")
+    return results
+
+
+def run_solvers(
+        costs=None,  # .npz files recorded by track.py --record-costs
+        methods=('hungarian', 'auction', 'greedy', 'auto'),  # solvers to compare
+        size=1000,  # synthetic: tracks and detections per problem
+        density=(0.01,),  # synthetic: fractions of feasible pairs
+        count=10,  # synthetic: problems per density
+        min_size=0,  # skip recorded problems with fewer rows and columns
+):
+    if costs:
+        results = {}
+        for kind in ('full', 'component'):
+            problems = [p for f in costs for p in load_cost_matrices(f, kind) if max(p[0].shape) >= min_size]
+            if not problems:
+                continue
+            shapes = np.array([p[0].shape for p in problems])
+            LOGGER.info(f'\n{len(problems)} recorded {kind} problems, up to {shapes[:, 0].max()}x{shapes[:, 1].max()}')
+            results[kind] = benchmark_solvers(problems, methods)
+        assert results, f'No assignment problems with at least {min_size} rows or columns in {costs}'
+        return results
+    results = {}
+    for d in density:
+        LOGGER.info(f'\n{count} synthetic {size}x{size} problems, density {d}')
+        results[d] = benchmark_solvers(synthetic_problems(size, d, count), methods)
+    return results
+
+
+def churn_scene(objects=200, clutter=300, frames=200, size=(1920, 1080), dim=64, seed=0):
+    """`objects` targets moving at constant velocity, detected every frame with
+    a consistent appearance, plus `clutter` false detections at random
+    positions with random appearance in every frame."""
+    rng = np.random.default_rng(seed)
+    size = np.array(size)
+    pos = rng.uniform(0, 1, (objects, 2)) * size
+    wh = rng.uniform([20, 50], [40, 100], (objects, 2))
+    vel = rng.normal(0, 2, (objects, 2))
+    appearance = rng.normal(size=(objects, dim))
+    scene = []
+    for _ in range(frames):
+        pos += vel
+        false = np.c_[rng.uniform(0, 1, (clutter, 2)) * size, rng.uniform(20, 60, (clutter, 2))]
+        tlwh = np.r_[np.c_[pos - wh / 2, wh], false]
+        features = np.r_[appearance + rng.normal(0, 0.1, appearance.shape), rng.normal(size=(clutter, dim))]
+        scene.append(DetectionBatch(tlwh, np.full(len(tlwh), 0.8), features, np.zeros(len(tlwh))))
+    return scene
+
+
+def benchmark_tracks(scene, prefix=colorstr('Tracks:'), **kwargs):
+    """Run a tracker over `scene` and return the mean time per frame in ms,
+    the number of garbage collections per generation and the time spent in
+    them in ms. Keyword arguments are passed to `Tracker`."""
+    tracker = Tracker(NearestNeighborDistanceMetric('cosine', 0.2, 100), max_iou_distance=0.7, max_age=30,
+                      n_init=3, **kwargs)
+    gc_time, gc_start = [0.], [0.]
+
+    def on_gc(phase, info):
+        if phase == 'start':
+            gc_start[0] = time.perf_counter()
+        else:
+            gc_time[0] += time.perf_counter() - gc_start[0]
+
+    gc.collect()
+    collections = [s['collections'] for s in gc.get_stats()]
+    gc.callbacks.append(on_gc)
+    try:
+        t = time.perf_counter()
+        for detections in scene:
+            tracker.predict()
+            tracker.update(detections)
+        dt = time.perf_counter() - t
+    finally:
+        gc.callbacks.remove(on_gc)
+    collections = [s['collections'] - c for s, c in zip(gc.get_stats(), collections)]
+    result = {
+        'ms_per_frame': dt / len(scene) * 1E3,
+        'tracks_created': tracker._next_id - 1,
+        'gc_collections': collections,
+        'gc_ms': gc_time[0] * 1E3}
+    LOGGER.info(f"{prefix} {kwargs}: {result['ms_per_frame']:.2f}ms per frame, "
+                f"{result['tracks_created']} tracks created, gc collections per generation {collections} "
+                f"taking {result['gc_ms']:.1f}ms")
+    return result
+
+
+def run_tracks(
+        objects=200,  # true targets
+        clutter=300,  # false detections per frame
+        frames=200,  # frames
+        seed=0,  # random seed of the scene
+):
+    scene = churn_scene(objects, clutter, frames, seed=seed)
+    LOGGER.info(f'{objects} objects and {clutter} false detections per frame, {frames} frames')
+    return {pool: benchmark_tracks(scene, track_pool=pool) for pool in (False, True)}
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    solvers = subparsers.add_parser('solvers', help='benchmark the linear assignment solvers')
+    solvers.add_argument('--costs', nargs='+', type=str, default=None, help='.npz files recorded by track.py --record-costs')
+    solvers.add_argument('--methods', nargs='+', type=str, default=['hungarian', 'auction', 'greedy', 'auto'], help='solvers to compare')
+    solvers.add_argument('--size', type=int, default=1000, help='synthetic: tracks and detections per problem')
+    solvers.add_argument('--density', nargs='+', type=float, default=[0.01], help='synthetic: fractions of feasible pairs')
+    solvers.add_argument('--count', type=int, default=10, help='synthetic: problems per density')
+    solvers.add_argument('--min-size', type=int, default=0, help='skip recorded problems with fewer rows and columns')
+    tracks = subparsers.add_parser('tracks', help='benchmark track creation and deletion at high detection churn')
+    tracks.add_argument('--objects', type=int, default=200, help='true targets')
+    tracks.add_argument('--clutter', type=int, default=300, help='false detections per frame')
+    tracks.add_argument('--frames', type=int, default=200, help='frames')
+    tracks.add_argument('--seed', type=int, default=0, help='random seed of the scene')
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    commands = {'solvers': run_solvers, 'tracks': run_tracks}
+    kwargs = vars(opt)
+    commands[kwargs.pop('command')](**kwargs)
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
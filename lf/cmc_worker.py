@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+
+
+class CMCWorker:
+    """
+    Runs the camera motion estimation of every video source on a background
+    thread, so that it overlaps with detector inference. A frame is submitted
+    as soon as it has been decoded and the warp is joined just before the
+    tracker of its source is updated.
+
+    Parameters
+    ----------
+    max_pending : int
+        Maximum number of submitted but not yet joined estimations. `submit`
+        blocks while the queue is full.
+    workers : int
+        Number of worker threads. Every source has its own CMC backend, so
+        different sources can be estimated concurrently.
+
+    Attributes
+    ----------
+    elapsed : Dict[int, float]
+        Time in seconds the worker spent estimating the last frame of each
+        source.
+    waited : Dict[int, float]
+        Time in seconds the main thread was blocked joining the last frame of
+        each source, i.e. the camera motion latency that was not hidden.
+    """
+
+    def __init__(self, max_pending=1, workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cmc')
+        self.queue = BoundedSemaphore(max(1, max_pending))
+        self.pending = {}
+        self.elapsed = {}
+        self.waited = {}
+
+    def _run(self, cmc, img, estimate):
+        try:
+            return cmc.apply(img, estimate), cmc.elapsed
+        finally:
+            self.queue.release()
+
+    def submit(self, source, tracker, img):
+        """Start the camera motion estimation of a new frame of `source`. The
+        previous frame of the source must have been joined.
+        """
+        assert source not in self.pending, f'camera motion of source {source} has not been joined'
+        self.queue.acquire()
+        # The track set cannot change before the frame is joined, so deciding
+        # here whether a warp is needed is equivalent to Tracker.camera_update.
+        self.pending[source] = self.executor.submit(
+            self._run, tracker.cmc, img, len(tracker.tracks) > 0)
+
+    def join(self, source):
+        """Wait for the camera motion estimation of `source` and return the
+        warp matrix, or None if no warp has been estimated.
+        """
+        future = self.pending.pop(source, None)
+        if future is None:
+            return None
+        t0 = time.time()
+        matrix, self.elapsed[source] = future.result()
+        self.waited[source] = time.time() - t0
+        return matrix
+
+    def close(self):
+        for source in list(self.pending):
+            self.join(source)
+        self.executor.shutdown()
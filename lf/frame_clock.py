@@ -0,0 +1,47 @@
+class FrameClock:
+    """
+    Measures the time between the Kalman filter steps of one video source in
+    frames, which is the unit of the tracker's motion model. Frames may be
+    dropped (`--frame_mod`), skipped by the detector, or arrive irregularly
+    from a live stream.
+
+    Parameters
+    ----------
+    fps : Optional[float]
+        Nominal frame rate of the source. Required to convert timestamps to
+        frames.
+
+    Attributes
+    ----------
+    last_frame : Optional[int]
+        Index of the frame of the last step.
+    last_timestamp : Optional[float]
+        Capture time in seconds of the frame of the last step.
+    """
+
+    def __init__(self, fps=None):
+        self.fps = fps if fps and fps > 0 else None
+        self.last_frame = None
+        self.last_timestamp = None
+
+    def elapsed(self, frame_idx, timestamp=None):
+        """Return the time from the previous step to frame `frame_idx`,
+        captured at `timestamp` seconds if known, in frames. Timestamps are
+        used if both frames have one and the frame rate is known, the
+        difference of the frame indices otherwise. Before the first step, this
+        is one frame.
+        """
+        if self.last_frame is None:
+            dt = 1.
+        elif timestamp is not None and self.last_timestamp is not None and self.fps:
+            dt = (timestamp - self.last_timestamp) * self.fps
+        else:
+            dt = float(frame_idx - self.last_frame)
+        # a repeated or out of order timestamp still advances the tracks
+        return dt if dt > 0 else 1.
+
+    def tick(self, frame_idx, timestamp=None):
+        """Register a step on frame `frame_idx` and return `elapsed`."""
+        dt = self.elapsed(frame_idx, timestamp)
+        self.last_frame, self.last_timestamp = frame_idx, timestamp
+        return dt
@@ -0,0 +1,85 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """
+    Decides whether the detector has to run on a frame of a static camera.
+    The frame is downscaled to a small grayscale image and compared with the
+    one of the last frame the detector ran on; if few pixels have changed and
+    no track is active, the detector pass can be skipped. Comparing with the
+    last detector frame instead of the previous frame also catches slow
+    changes, and a pass is forced after `max_interval` skipped frames.
+
+    A track counts as active if it was detected on the last detector frame,
+    whether it moves or not. The gate therefore only skips frames of an empty
+    scene, or one whose tracks are all lost: a single object standing in view
+    keeps the detector running on every frame.
+
+    Parameters
+    ----------
+    size : int
+        Width of the downscaled frame in pixels.
+    threshold : int
+        Minimum gray value difference of a changed pixel.
+    min_changed : float
+        Fraction of changed pixels above which the scene counts as changed.
+    max_interval : int
+        Maximum number of consecutive frames skipped.
+
+    Attributes
+    ----------
+    frames : int
+        Number of frames checked.
+    skipped : int
+        Number of checked frames the detector did not run on.
+    """
+
+    def __init__(self, size=64, threshold=25, min_changed=0.002, max_interval=30):
+        self.size = size
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.max_interval = max_interval
+        self.reference = None
+        self.current = None
+        self.since_detection = 0
+        self.frames = 0
+        self.skipped = 0
+
+    def _downscale(self, frame):
+        # subsample first, area averaging of a 4K frame costs more than the
+        # check can save on a small detector
+        step = max(frame.shape[1] // (8 * self.size), 1)
+        frame = frame[::step, ::step]
+        height, width = frame.shape[:2]
+        size = (self.size, max(round(height * self.size / width), 1))
+        gray = cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        return gray.astype(np.int16)
+
+    def score(self, frame):
+        """Fraction of pixels of `frame` changed since the last detector
+        frame, 1 if there is none yet."""
+        self.current = self._downscale(frame)
+        if self.reference is None or self.reference.shape != self.current.shape:
+            return 1.
+        return float(np.mean(np.abs(self.current - self.reference) > self.threshold))
+
+    def needs_detection(self, frame, tracker):
+        """Whether the detector has to run on `frame`, given the `tracker` of
+        the source. Call `record` once it is known whether it did."""
+        self.frames += 1
+        active = any(track.time_since_update == 0 for track in tracker.tracks)
+        changed = self.score(frame) > self.min_changed
+        return active or changed or self.since_detection >= self.max_interval
+
+    def record(self, detected):
+        """Register whether the detector ran on the last checked frame. If it
+        did, the frame becomes the reference of the following checks. The
+        detector runs on the frames of all sources at once, so it may run on
+        a frame that this gate did not need it for."""
+        if detected:
+            self.reference = self.current
+            self.since_detection = 0
+        else:
+            self.since_detection += 1
+            self.skipped += 1
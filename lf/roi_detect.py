@@ -0,0 +1,127 @@
+import numpy as np
+import torch
+from scipy.sparse.csgraph import connected_components
+
+from lf.tiling import detect_regions, merge_detections
+
+
+def predicted_boxes(tracker, dt=1.):
+    """Boxes `(x1, y1, x2, y2)` of all tracks of `tracker` extrapolated `dt`
+    frames ahead by their Kalman velocity, without changing the tracks."""
+    if not tracker.tracks:
+        return np.zeros((0, 4))
+    mean = tracker.store.mean[[t.slot for t in tracker.tracks]]
+    xyah = mean[:, :4] + dt * mean[:, 4:]
+    w, h = xyah[:, 2] * xyah[:, 3], xyah[:, 3]
+    return np.stack([xyah[:, 0] - w / 2, xyah[:, 1] - h / 2, xyah[:, 0] + w / 2, xyah[:, 1] + h / 2], axis=1)
+
+
+def merge_regions(boxes):
+    """Replace overlapping rectangles `(x1, y1, x2, y2)` by their bounding
+    rectangle until no two rectangles overlap."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    while len(boxes) > 1:
+        overlap = ((boxes[:, None, 0] < boxes[None, :, 2]) & (boxes[None, :, 0] < boxes[:, None, 2])
+                   & (boxes[:, None, 1] < boxes[None, :, 3]) & (boxes[None, :, 1] < boxes[:, None, 3]))
+        n, labels = connected_components(overlap, directed=False)
+        if n == len(boxes):
+            break
+        merged = np.empty((n, 4))
+        merged[:, :2] = np.inf
+        merged[:, 2:] = -np.inf
+        np.minimum.at(merged[:, :2], labels, boxes[:, :2])
+        np.maximum.at(merged[:, 2:], labels, boxes[:, 2:])
+        boxes = merged
+    return boxes
+
+
+class ROIDetector:
+    """
+    Runs the detector only on regions around the predicted boxes of the
+    tracks, between full-frame passes. The predicted boxes are enlarged by a
+    margin, overlapping regions are merged into a few tiles, all tiles of all
+    sources are letterboxed to `imgsz` and run as one batch, and the
+    detections are mapped back to frame coordinates.
+
+    Objects that enter the scene are only found by full-frame passes, which
+    the caller still has to run periodically.
+
+    Parameters
+    ----------
+    model : DetectMultiBackend
+        The detector.
+    imgsz : int
+        Input size of the tiles.
+    margin : float
+        Margin around each predicted box, relative to its larger side.
+    min_size : int
+        Minimum side of a region in pixels.
+    max_area : float
+        If the tiles would cover more than this fraction of the frames, a
+        full-frame pass is cheaper and `plan` returns None.
+    conf_thres, iou_thres, classes, agnostic, max_det
+        Non-maximum suppression settings, as for the full-frame pass.
+
+    Attributes
+    ----------
+    passes : int
+        Number of ROI passes run.
+    tiles : int
+        Number of tiles run.
+    """
+
+    def __init__(self, model, imgsz=320, margin=0.5, min_size=64, max_area=0.5,
+                 conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, max_det=1000):
+        self.model = model
+        self.imgsz = imgsz
+        self.margin = margin
+        self.min_size = min_size
+        self.max_area = max_area
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.classes = classes
+        self.agnostic = agnostic
+        self.max_det = max_det
+        self.passes = 0
+        self.tiles = 0
+
+    def regions(self, tracker, frame_shape, dt=1.):
+        """The merged integer regions `(x1, y1, x2, y2)` to detect in for the
+        tracks of `tracker`, in a frame of shape `frame_shape`."""
+        height, width = frame_shape[:2]
+        boxes = predicted_boxes(tracker, dt)
+        if len(boxes) == 0:
+            return np.zeros((0, 4), dtype=int)
+        size = boxes[:, 2:] - boxes[:, :2]
+        pad = self.margin * size.max(axis=1, keepdims=True)
+        pad = np.maximum(pad, (self.min_size - size) / 2)
+        boxes = np.c_[boxes[:, :2] - pad, boxes[:, 2:] + pad]
+        boxes = np.clip(boxes, 0, [width, height, width, height])
+        boxes = boxes[(boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])]
+        boxes = merge_regions(boxes)
+        return np.c_[np.floor(boxes[:, :2]), np.ceil(boxes[:, 2:])].astype(int)
+
+    def plan(self, frames, trackers, dts):
+        """The regions of every source, or None if they cover so much of the
+        frames that a full-frame pass should be run instead."""
+        regions = [self.regions(t, f.shape, dt) for f, t, dt in zip(frames, trackers, dts)]
+        area = sum(np.prod(r[:, 2:] - r[:, :2], axis=1).sum() for r in regions)
+        if area > self.max_area * sum(f.shape[0] * f.shape[1] for f in frames):
+            return None
+        return regions
+
+    def detect(self, frames, regions):
+        """Detect in the `regions` of every frame.
+
+        Returns
+        -------
+        List[torch.Tensor]
+            Per frame, an Nx6 tensor of detections `(x1, y1, x2, y2, conf,
+            cls)` in frame coordinates.
+        """
+        self.passes += 1
+        self.tiles += sum(len(r) for r in regions)
+        per_frame = detect_regions(self.model, frames, regions, self.imgsz, self.conf_thres, self.iou_thres,
+                                   self.classes, self.agnostic, self.max_det)
+        return [merge_detections(torch.cat(d), self.iou_thres, self.agnostic, self.max_det) if d
+                else torch.zeros((0, 6), device=self.model.device) for d in per_frame]
@@ -0,0 +1,173 @@
+import numpy as np
+import torch
+import torchvision
+
+from yolov5.utils.augmentations import letterbox
+from yolov5.utils.general import non_max_suppression, scale_coords
+
+
+def tile_grid(height, width, tile_size=640, overlap=128):
+    """Integer tiles `(x1, y1, x2, y2)` of at most `tile_size` pixels that
+    cover a frame, with neighbouring tiles overlapping by at least `overlap`
+    pixels. The last row and column are aligned with the frame border."""
+    def starts(length):
+        if length <= tile_size:
+            return np.zeros(1, dtype=int)
+        step = max(tile_size - overlap, 1)
+        n = int(np.ceil((length - tile_size) / step)) + 1
+        return np.round(np.linspace(0, length - tile_size, n)).astype(int)
+
+    x, y = np.meshgrid(starts(width), starts(height))
+    x, y = x.ravel(), y.ravel()
+    return np.stack([x, y, np.minimum(x + tile_size, width), np.minimum(y + tile_size, height)], axis=1)
+
+
+def merge_detections(det, iou_thres=0.45, agnostic=False, max_det=1000):
+    """Remove duplicate detections `(x1, y1, x2, y2, conf, cls)` in frame
+    coordinates, e.g. of an object seen by several tiles, with one batched
+    NMS over all of them."""
+    if len(det) < 2:
+        return det
+    keep = torchvision.ops.batched_nms(
+        det[:, :4], det[:, 4], torch.zeros_like(det[:, 5]) if agnostic else det[:, 5], iou_thres)
+    return det[keep[:max_det]]
+
+
+def detect_regions(model, frames, regions, imgsz, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False,
+                   max_det=1000):
+    """Run the detector on regions of the frames.
+
+    The regions of all frames are cropped, letterboxed to `imgsz` and run as
+    one batch, or one at a time for exported models, which may have a fixed
+    batch size of one.
+
+    Parameters
+    ----------
+    model : DetectMultiBackend
+        The detector.
+    frames : List[ndarray]
+        The original BGR frames.
+    regions : List[ndarray]
+        Per frame, a Kx4 integer array of regions `(x1, y1, x2, y2)`.
+    imgsz : int
+        Input size of the detector.
+
+    Returns
+    -------
+    List[List[torch.Tensor]]
+        Per frame and region, an Nx6 tensor of detections `(x1, y1, x2, y2,
+        conf, cls)` in frame coordinates.
+    """
+    crops = [frame[y1:y2, x1:x2] for frame, boxes in zip(frames, regions) for x1, y1, x2, y2 in boxes]
+    if not crops:
+        return [[] for _ in frames]
+    im = np.stack([letterbox(c, imgsz, stride=model.stride, auto=False)[0] for c in crops])
+    im = np.ascontiguousarray(im.transpose((0, 3, 1, 2))[:, ::-1])  # BHWC BGR to BCHW RGB
+    im = torch.from_numpy(im).to(model.device)
+    im = im.half() if model.fp16 else im.float()
+    im /= 255.0
+    batches = [im] if model.pt else [im[k:k + 1] for k in range(len(im))]
+    pred = [det for batch in batches for det in non_max_suppression(
+        model(batch), conf_thres, iou_thres, classes, agnostic, max_det=max_det)]
+
+    dets, k = [], 0
+    for boxes in regions:
+        dets.append([])
+        for x1, y1 in boxes[:, :2]:
+            det, crop = pred[k], crops[k]
+            if len(det):
+                det[:, :4] = scale_coords(im.shape[2:], det[:, :4], crop.shape).round()
+                det[:, [0, 2]] += x1
+                det[:, [1, 3]] += y1
+            dets[-1].append(det)
+            k += 1
+    return dets
+
+
+class TiledDetector:
+    """
+    Detects in high resolution frames by splitting them into overlapping
+    tiles, so that small objects keep their resolution without letterboxing
+    the whole frame to a large input size. The tiles of all frames run as one
+    batch, and the detections of an object seen by several tiles are merged
+    by NMS in frame coordinates.
+
+    An optional global pass runs the whole frame at `global_imgsz` as well,
+    to find objects larger than the tile overlap. It then replaces the
+    detections that a tile has cut off at an inner tile border.
+
+    Parameters
+    ----------
+    model : DetectMultiBackend
+        The detector.
+    tile_size : int
+        Tile size in frame pixels, also the input size of the tiles.
+    overlap : int
+        Minimum overlap of neighbouring tiles in frame pixels. Objects up to
+        this size are seen completely by at least one tile.
+    global_imgsz : int
+        Input size of the global pass over the whole frame, 0 to disable it.
+    conf_thres, iou_thres, classes, agnostic, max_det
+        Non-maximum suppression settings.
+
+    Attributes
+    ----------
+    frames : int
+        Number of frames detected in.
+    tiles : int
+        Number of tiles run.
+    """
+
+    def __init__(self, model, tile_size=640, overlap=128, global_imgsz=0,
+                 conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, max_det=1000):
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.global_imgsz = global_imgsz
+        self.nms = dict(conf_thres=conf_thres, iou_thres=iou_thres, classes=classes, agnostic=agnostic,
+                        max_det=max_det)
+        self.frames = 0
+        self.tiles = 0
+
+    def detect(self, frames):
+        """Detect in every frame.
+
+        Returns
+        -------
+        List[torch.Tensor]
+            Per frame, an Nx6 tensor of detections `(x1, y1, x2, y2, conf,
+            cls)` in frame coordinates.
+        """
+        regions = [tile_grid(f.shape[0], f.shape[1], self.tile_size, self.overlap) for f in frames]
+        self.frames += len(frames)
+        self.tiles += sum(len(r) for r in regions)
+        tiled = detect_regions(self.model, frames, regions, self.tile_size, **self.nms)
+        if self.global_imgsz:
+            full = [np.array([[0, 0, f.shape[1], f.shape[0]]]) for f in frames]
+            whole = detect_regions(self.model, frames, full, self.global_imgsz, **self.nms)
+
+        dets = []
+        for i, (frame, boxes) in enumerate(zip(frames, regions)):
+            d = tiled[i]
+            if self.global_imgsz:
+                # the global pass sees the objects that the tiles cut off
+                d = [det[~self._cut_off(det, box, frame.shape)] for det, box in zip(d, boxes)] + whole[i]
+            d = torch.cat(d) if d else torch.zeros((0, 6), device=self.model.device)
+            dets.append(merge_detections(d, self.nms['iou_thres'], self.nms['agnostic'], self.nms['max_det']))
+        return dets
+
+    @staticmethod
+    def _cut_off(det, box, shape, tol=2):
+        # Detections touching a tile border that is not a frame border
+        height, width = shape[:2]
+        x1, y1, x2, y2 = (int(v) for v in box)
+        cut = torch.zeros(len(det), dtype=torch.bool, device=det.device)
+        if x1 > 0:
+            cut |= det[:, 0] <= x1 + tol
+        if y1 > 0:
+            cut |= det[:, 1] <= y1 + tol
+        if x2 < width:
+            cut |= det[:, 2] >= x2 - tol
+        if y2 < height:
+            cut |= det[:, 3] >= y2 - tol
+        return cut
@@ -0,0 +1,229 @@
+"""
+Regression checks of the tracker and of the ReID input.
+
+Runs the tracker on deterministic synthetic scenes and compares every track
+after every frame with the reference: its state, age and hit count, and its
+Kalman mean and covariance diagonal. Track IDs may be assigned in a different
+order, but every reference track has to map to the same track in every frame.
+The tracker is run with every association setting that has to give the same
+results, e.g. with and without the spatial index.
+
+The ReID crops of the same boxes are also compared between the two ways of
+cropping them: from the BGR frame (`CropBatcher.batch`) and with ROI-align
+from the letterboxed RGB detector input (`CropBatcher.roi_align`, used with
+`--reid-roi-align`). With `--reid-weights`, their embeddings are compared as
+well.
+
+Usage:
+    $ python regression.py
+    $ python regression.py --reid-weights strong_sort/deep/checkpoint/osnet_x0_25_msmt17.pth
+    $ python regression.py --save fixtures/tracker_reference.npz  # after an intended change of the results
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # yolov5 strongsort root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'yolov5') not in sys.path:
+    sys.path.append(str(ROOT / 'yolov5'))  # add yolov5 ROOT to PATH
+
+from yolov5.utils.augmentations import letterbox
+from yolov5.utils.general import LOGGER, colorstr, print_args
+from strong_sort.deep.crop_batcher import CropBatcher
+from strong_sort.deep.reid_service import ReIDService
+from strong_sort.sort.detection import DetectionBatch
+from strong_sort.sort.nn_matching import NearestNeighborDistanceMetric
+from strong_sort.sort.tracker import Tracker
+
+# Tracker settings of strong_sort/configs/strong_sort.yaml
+TRACKER = dict(max_iou_distance=0.7, max_age=30, n_init=3)
+MAX_DIST, NN_BUDGET = 0.2, 100
+
+# Settings that must not change the results
+VARIANTS = {
+    'default': {},
+    'spatial_index': dict(spatial_index=True),
+    'no_track_pool': dict(track_pool=False),
+    'hungarian': dict(solver='hungarian'),
+}
+
+# Limits of the difference between frame and ROI-align crops: mean absolute
+# difference of the normalized crops, minimum cosine similarity of embeddings.
+# Crops with swapped channels differ by about 1.6.
+ROI_CROP_DIFF, ROI_EMBEDDING_SIMILARITY = 0.1, 0.9
+
+# Columns of a snapshot row: frame, track id, state, time since update, hits,
+# Kalman mean, Kalman covariance diagonal
+SNAPSHOT_COLUMNS = 21
+
+
+def synthetic_scene(seed, frames=60, objects=25, clutter=3, dim=16, dropout=0.1):
+    """Objects that appear and disappear during the scene and move at
+    constant velocity, so that some of them cross, detected with noise and
+    occasional misses, plus `clutter` false detections per frame. Uses the
+    legacy `RandomState` generator, whose streams are frozen.
+
+    Returns
+    -------
+    List[Tuple[ndarray, ndarray, ndarray, ndarray]]
+        Per frame the detections as `tlwh`, confidences, classes and
+        appearance features.
+    """
+    rng = np.random.RandomState(seed)
+    pos = rng.uniform([100, 100], [1800, 1000], (objects, 2))
+    vel = rng.normal(0, 4, (objects, 2))
+    wh = rng.uniform([20, 50], [60, 150], (objects, 2))
+    cls = rng.randint(0, 2, objects)
+    appearance = rng.normal(size=(objects, dim))
+    start = rng.randint(0, frames // 2, objects)
+    end = start + rng.randint(frames // 4, frames, objects)
+    scene = []
+    for f in range(frames):
+        pos += vel
+        visible = (start <= f) & (f < end) & (rng.rand(objects) > dropout)
+        n = visible.sum()
+        xy = pos[visible] + rng.normal(0, 1, (n, 2))
+        size = wh[visible] * rng.uniform(0.97, 1.03, (n, 2))
+        false = np.c_[rng.uniform([0, 0], [1900, 1000], (clutter, 2)), rng.uniform(20, 80, (clutter, 2))]
+        tlwh = np.r_[np.c_[xy - size / 2, size], false]
+        confidences = np.r_[rng.uniform(0.5, 1, n), rng.uniform(0.3, 0.6, clutter)]
+        classes = np.r_[cls[visible], rng.randint(0, 2, clutter)]
+        features = np.r_[appearance[visible] + rng.normal(0, 0.2, (n, dim)), rng.normal(size=(clutter, dim))]
+        scene.append((tlwh, confidences, classes, features.astype(np.float32)))
+    return scene
+
+
+def track_scene(scene, **kwargs):
+    """Run a tracker on `scene` and return an array with one
+    `SNAPSHOT_COLUMNS` row per track and frame."""
+    tracker = Tracker(NearestNeighborDistanceMetric('cosine', MAX_DIST, NN_BUDGET), **TRACKER, **kwargs)
+    rows = []
+    for frame, (tlwh, confidences, classes, features) in enumerate(scene):
+        tracker.predict()
+        tracker.update(DetectionBatch(tlwh, confidences, features, classes))
+        for track in tracker.tracks:
+            rows.append(np.r_[frame, track.track_id, track.state, track.time_since_update, track.hits,
+                              track.mean, np.diag(track.covariance)])
+    return np.array(rows).reshape(-1, SNAPSHOT_COLUMNS)
+
+
+def compare(reference, result, atol=1e-4, rtol=1e-6):
+    """Compare two snapshot arrays of the same scene. Tracks are paired by
+    their order in x and y within each frame, and their IDs by the first
+    frame they are paired in.
+
+    Returns
+    -------
+    Optional[str]
+        The first difference, None if there is none.
+    """
+    ids = {}
+    for frame in np.unique(np.r_[reference[:, 0], result[:, 0]]):
+        a, b = reference[reference[:, 0] == frame], result[result[:, 0] == frame]
+        if len(a) != len(b):
+            return f'frame {frame:.0f}: {len(b)} tracks, {len(a)} in the reference'
+        a, b = a[np.lexsort((a[:, 6], a[:, 5]))], b[np.lexsort((b[:, 6], b[:, 5]))]
+        for x, y in zip(a, b):
+            if ids.setdefault(x[1], y[1]) != y[1]:
+                return f'frame {frame:.0f}: reference track {x[1]:.0f} is track {y[1]:.0f}, was {ids[x[1]]:.0f}'
+            if not np.array_equal(x[2:5], y[2:5]):
+                return f'frame {frame:.0f}: track {y[1]:.0f} state, age or hits {y[2:5]}, {x[2:5]} in the reference'
+            if not np.allclose(x[5:], y[5:], rtol=rtol, atol=atol):
+                return f'frame {frame:.0f}: track {y[1]:.0f} Kalman state differs by {np.abs(x[5:] - y[5:]).max():g}'
+    if len(set(ids.values())) != len(ids):
+        return 'two reference tracks map to the same track'
+    return None
+
+
+def synthetic_frame(seed=0, shape=(1080, 1920)):
+    """A smooth BGR frame whose channels differ, so that crops with swapped
+    channels do not look alike."""
+    rng = np.random.RandomState(seed)
+    frame = cv2.GaussianBlur(rng.randint(0, 256, (*shape, 3)).astype(np.uint8), (0, 0), 8)
+    frame = cv2.normalize(frame, None, 0, 255, cv2.NORM_MINMAX).astype(int)
+    return np.clip(frame + np.array([60, 120, 200]) - 128, 0, 255).astype(np.uint8)
+
+
+def compare_roi_align(reid_weights=None, imgsz=640):
+    """Crop the same boxes of a frame from the frame and with ROI-align from
+    its letterboxed detector input, as track.py prepares it.
+
+    Returns
+    -------
+    Optional[str]
+        The difference if it is above the limits, None otherwise.
+    """
+    frame = synthetic_frame()
+    boxes = np.array([[100, 200, 300, 700], [900, 100, 1100, 500], [1500, 600, 1650, 1000]])
+    img, (r, _), (dw, dh) = letterbox(frame, imgsz, auto=False)
+    im = torch.from_numpy(np.ascontiguousarray(img.transpose((2, 0, 1))[::-1]))[None].float() / 255.0  # BGR to RGB
+    roi_boxes = [torch.from_numpy(boxes * r + [dw, dh, dw, dh]).float()]
+
+    batcher = CropBatcher()
+    diff = (batcher.batch([frame], [boxes]).clone() - batcher.roi_align(im, roi_boxes)).abs().mean().item()
+    LOGGER.info(f"{colorstr('Regression:')} ROI-align crops: mean difference {diff:.3f}")
+    if diff > ROI_CROP_DIFF:
+        return f'ROI-align crops differ from the frame crops by {diff:.3f}'
+    if reid_weights:
+        reid = ReIDService(reid_weights, 'cpu')
+        a, b = reid.extract([frame], [boxes])[0], reid.extract_roi(im, roi_boxes)[0]
+        similarity = torch.nn.functional.cosine_similarity(
+            torch.as_tensor(a).float(), torch.as_tensor(b).float()).min().item()
+        LOGGER.info(f"{colorstr('Regression:')} ROI-align embeddings: minimum cosine similarity {similarity:.3f}")
+        if similarity < ROI_EMBEDDING_SIMILARITY:
+            return f'ROI-align embeddings have a cosine similarity of {similarity:.3f} to the frame crop ones'
+    return None
+
+
+def run(
+        reference=ROOT / 'fixtures' / 'tracker_reference.npz',  # reference results
+        seeds=(0, 1, 2),  # synthetic scenes
+        save=None,  # write the results of this tree as the new reference instead
+        reid_weights=None,  # also compare the embeddings of frame and ROI-align crops with this ReID model
+):
+    if save:
+        np.savez_compressed(save, **{f'seed_{s}': track_scene(synthetic_scene(s)) for s in seeds})
+        LOGGER.info(f'Reference results of {len(seeds)} scenes saved to {colorstr("bold", save)}')
+        return []
+    expected = np.load(reference)
+    failures = []
+    for seed in seeds:
+        scene = synthetic_scene(seed)
+        for name, kwargs in VARIANTS.items():
+            error = compare(expected[f'seed_{seed}'], track_scene(scene, **kwargs))
+            LOGGER.info(f"{colorstr('Regression:')} scene {seed} {name:>14s}: {error or 'ok'}")
+            if error:
+                failures.append((seed, name, error))
+    error = compare_roi_align(reid_weights)
+    if error:
+        failures.append((None, 'roi_align', error))
+    return failures
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reference', type=Path, default=ROOT / 'fixtures' / 'tracker_reference.npz', help='reference results')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1, 2], help='synthetic scenes')
+    parser.add_argument('--save', type=Path, help='write the results of this tree as the new reference instead')
+    parser.add_argument('--reid-weights', type=Path, help='also compare the embeddings of frame and ROI-align crops with this ReID model')
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    if run(**vars(opt)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,210 @@
+"""
+Export a torchreid ReID checkpoint to the formats `ReIDDetectMultiBackend`
+can run, and check that the exported models produce the same embeddings.
+
+Format       | `--include`   | Model
+---          | ---           | ---
+PyTorch      | -             | osnet_x0_25_msmt17.pth
+TorchScript  | `torchscript` | osnet_x0_25_msmt17.torchscript
+ONNX         | `onnx`        | osnet_x0_25_msmt17.onnx
+OpenVINO     | `openvino`    | osnet_x0_25_msmt17.xml
+
+Usage:
+    $ python reid_export.py --weights strong_sort/deep/checkpoint/osnet_x0_25_msmt17.pth --include onnx openvino
+    $ python track.py --strong-sort-weights strong_sort/deep/checkpoint/osnet_x0_25_msmt17.onnx
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # yolov5 strongsort root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'yolov5') not in sys.path:
+    sys.path.append(str(ROOT / 'yolov5'))  # add yolov5 ROOT to PATH
+
+from yolov5.utils.general import LOGGER, check_requirements, colorstr, file_size, print_args
+from yolov5.utils.torch_utils import select_device
+from strong_sort.deep.reid_multibackend import ReIDDetectMultiBackend
+
+
+def export_torchscript(model, im, file, prefix=colorstr('TorchScript:')):
+    try:
+        LOGGER.info(f'\n{prefix} starting export with torch {torch.__version__}...')
+        f = file.with_suffix('.torchscript')
+        ts = torch.jit.trace(model, im, strict=False)
+        ts.save(str(f))
+        LOGGER.info(f'{prefix} export success, saved as {f} ({file_size(f):.1f} MB)')
+        return f
+    except Exception as e:
+        LOGGER.info(f'{prefix} export failure: {e}')
+
+
+def export_onnx(model, im, file, opset, dynamic, simplify, prefix=colorstr('ONNX:')):
+    try:
+        check_requirements(('onnx',))
+        import onnx
+
+        LOGGER.info(f'\n{prefix} starting export with onnx {onnx.__version__}...')
+        f = file.with_suffix('.onnx')
+        torch.onnx.export(
+            model.cpu() if dynamic else model,  # --dynamic only compatible with cpu
+            im.cpu() if dynamic else im,
+            f,
+            verbose=False,
+            opset_version=opset,
+            do_constant_folding=True,
+            input_names=['images'],
+            output_names=['output'],
+            dynamic_axes={'images': {0: 'batch'}, 'output': {0: 'batch'}} if dynamic else None)
+
+        # Checks
+        model_onnx = onnx.load(f)  # load onnx model
+        onnx.checker.check_model(model_onnx)  # check onnx model
+
+        # Simplify
+        if simplify:
+            try:
+                check_requirements(('onnx-simplifier',))
+                import onnxsim
+
+                LOGGER.info(f'{prefix} simplifying with onnx-simplifier {onnxsim.__version__}...')
+                model_onnx, check = onnxsim.simplify(model_onnx)
+                assert check, 'assert check failed'
+                onnx.save(model_onnx, f)
+            except Exception as e:
+                LOGGER.info(f'{prefix} simplifier failure: {e}')
+        LOGGER.info(f'{prefix} export success, saved as {f} ({file_size(f):.1f} MB)')
+        return f
+    except Exception as e:
+        LOGGER.info(f'{prefix} export failure: {e}')
+
+
+def export_openvino(file, half, prefix=colorstr('OpenVINO:')):
+    # OpenVINO export, converts the ONNX model that has to be exported first
+    try:
+        check_requirements(('openvino',))
+        import openvino as ov
+
+        LOGGER.info(f'\n{prefix} starting export with openvino {ov.__version__}...')
+        f = file.with_suffix('.xml')
+        ov.save_model(ov.convert_model(str(file.with_suffix('.onnx'))), str(f), compress_to_fp16=half)
+        LOGGER.info(f'{prefix} export success, saved as {f} ({file_size(f.with_suffix(".bin")):.1f} MB)')
+        return f
+    except Exception as e:
+        LOGGER.info(f'{prefix} export failure: {e}')
+
+
+def check_parity(reference, model, im, atol=1e-3, prefix=colorstr('Parity:')):
+    """Compare the embeddings of an exported model with those of the PyTorch
+    reference on the same crop batch.
+
+    Returns
+    -------
+    (float, float, bool)
+        The maximum absolute embedding difference, the minimum cosine
+        similarity between reference and exported embeddings, and whether the
+        difference is within `atol`.
+    """
+    y_ref = reference(im)
+    t = time.time()
+    y = model(im)
+    dt = time.time() - t
+    max_diff = (y - y_ref).abs().max().item()
+    cos = torch.nn.functional.cosine_similarity(y, y_ref, dim=1).min().item()
+    ok = max_diff <= atol
+    LOGGER.info(f"{prefix} {'PASS' if ok else 'FAIL'} {Path(model.weights).name}: "
+                f'max abs diff {max_diff:.2e}, min cosine similarity {cos:.6f}, {dt * 1E3:.1f}ms per batch')
+    return max_diff, cos, ok
+
+
+@torch.no_grad()
+def run(
+        weights=ROOT / 'strong_sort/deep/checkpoint/osnet_x0_25_msmt17.pth',  # torchreid checkpoint path
+        imgsz=(256, 128),  # ReID input size (height, width)
+        batch_size=1,  # batch size
+        device='cpu',  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+        include=('torchscript', 'onnx'),  # include formats
+        half=False,  # FP16 half-precision export
+        dynamic=False,  # ONNX: dynamic batch axis
+        simplify=False,  # ONNX: simplify model
+        opset=12,  # ONNX: opset version
+        check=True,  # compare the embeddings of the exported models with PyTorch
+        atol=1e-3,  # parity check: maximum absolute embedding difference
+):
+    t = time.time()
+    include = [x.lower() for x in include]
+    formats = ('torchscript', 'onnx', 'openvino')
+    assert all(x in formats for x in include), f'--include {include} invalid, valid arguments are {formats}'
+    file = Path(weights)
+
+    # Load PyTorch model
+    device = select_device(device)
+    assert not (device.type == 'cpu' and half), '--half only compatible with GPU export, i.e. use --device 0'
+    model = ReIDDetectMultiBackend(weights, device).model.eval()
+    im = torch.zeros(batch_size, 3, *imgsz).to(device)  # dummy image
+    if half:
+        im, model = im.half(), model.half()  # to FP16
+    for _ in range(2):
+        y = model(im)  # dry runs
+    LOGGER.info(f"\n{colorstr('PyTorch:')} starting from {file} with output shape {tuple(y.shape)} "
+                f"({file_size(file):.1f} MB)")
+
+    # Exports
+    f = []
+    if 'torchscript' in include:
+        f.append(export_torchscript(model, im, file))
+    if 'onnx' in include or 'openvino' in include:  # OpenVINO requires ONNX
+        f.append(export_onnx(model, im, file, opset, dynamic, simplify))
+    if 'openvino' in include:
+        f.append(export_openvino(file, half))
+    f = [x for x in f if x]  # filter out failed exports
+
+    # Parity check of the exported embeddings on random crops
+    if check and f:
+        reference = ReIDDetectMultiBackend(weights, device, fp16=half)
+        g = torch.Generator().manual_seed(0)
+        crops = torch.randn(max(batch_size, 8) if dynamic else batch_size, 3, *imgsz, generator=g).to(device)
+        for w in f:
+            check_parity(reference, ReIDDetectMultiBackend(w, device, fp16=half), crops, atol)
+
+    if f:
+        LOGGER.info(f'\nExport complete ({time.time() - t:.2f}s)'
+                    f"\nResults saved to {colorstr('bold', file.parent.resolve())}"
+                    f"\nUsage:                python track.py --strong-sort-weights {f[-1]}")
+    return f
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default=ROOT / 'strong_sort/deep/checkpoint/osnet_x0_25_msmt17.pth', help='torchreid checkpoint path')
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs=2, type=int, default=[256, 128], help='ReID input size h w')
+    parser.add_argument('--batch-size', type=int, default=1, help='batch size')
+    parser.add_argument('--device', default='cpu', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
+    parser.add_argument('--half', action='store_true', help='FP16 half-precision export')
+    parser.add_argument('--dynamic', action='store_true', help='ONNX: dynamic batch axis')
+    parser.add_argument('--simplify', action='store_true', help='ONNX: simplify model')
+    parser.add_argument('--opset', type=int, default=12, help='ONNX: opset version')
+    parser.add_argument('--no-check', dest='check', action='store_false', help='skip the embedding parity check')
+    parser.add_argument('--atol', type=float, default=1e-3, help='parity check: maximum absolute embedding difference')
+    parser.add_argument('--include',
+                        nargs='+',
+                        default=['torchscript', 'onnx'],
+                        help='torchscript, onnx, openvino')
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
@@ -0,0 +1,249 @@
+"""
+Post-training INT8 quantization of a ReID model with ONNX Runtime, guarded by
+an embedding accuracy check.
+
+The fp32 model is exported to ONNX first if a torchreid checkpoint is given.
+`dynamic` quantization only quantizes the weights and needs no data; `static`
+quantization also calibrates the activation ranges on a set of crops. Only
+static quantization speeds OSNet up on CPU: ONNX Runtime runs dynamically
+quantized convolutions as ConvInteger, which is usually slower than fp32. The
+quantized model is an ONNX file that loads like any other ReID weights, e.g.
+`StrongSORT('osnet_x0_25_msmt17_int8_static.onnx', device)`.
+
+Before a quantized model is kept, its embeddings are compared with the fp32
+embeddings on a crop set: the mean cosine similarity and the rank-1 agreement,
+i.e. the fraction of crops whose nearest neighbour among the other crops has
+the same identity under both models, must reach the configured thresholds.
+A crop set can be saved with `python track.py --save-crop`; crops are grouped
+by their parent directory, which `--save-crop` names after the track id, and
+the rank-1 identity accuracy of both models is reported as well.
+
+Usage:
+    $ python reid_quantize.py --weights strong_sort/deep/checkpoint/osnet_x0_25_msmt17.pth --mode static --source runs/track/exp/crops
+    $ python reid_quantize.py --weights strong_sort/deep/checkpoint/osnet_x0_25_msmt17.onnx --guard strong_sort/deep/checkpoint/osnet_x0_25_msmt17_int8_static.onnx --source runs/track/exp/crops
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # yolov5 strongsort root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'yolov5') not in sys.path:
+    sys.path.append(str(ROOT / 'yolov5'))  # add yolov5 ROOT to PATH
+
+from yolov5.utils.general import LOGGER, check_requirements, colorstr, file_size, print_args
+from strong_sort.deep.crop_batcher import CropBatcher
+from strong_sort.deep.reid_multibackend import ReIDDetectMultiBackend
+from reid_export import run as export
+
+IMG_FORMATS = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff', '.webp')
+
+
+def load_crops(source, max_crops=None, imgsz=(256, 128), seed=0):
+    """Load the crop images below `source` as a normalized Nx3xHxW batch.
+
+    Returns
+    -------
+    (torch.Tensor, List[str])
+        The crop batch and the label of each crop, i.e. its parent directory.
+    """
+    files = sorted(p for p in Path(source).rglob('*') if p.suffix.lower() in IMG_FORMATS)
+    assert files, f'No crop images found in {source}'
+    if max_crops and len(files) > max_crops:  # random, reproducible subset
+        files = [files[i] for i in sorted(np.random.default_rng(seed).choice(len(files), max_crops, replace=False))]
+    imgs = [cv2.imread(str(f)) for f in files]
+    boxes = [np.array([[0, 0, im.shape[1], im.shape[0]]]) for im in imgs]
+    crops = CropBatcher(image_size=imgsz, capacity=len(imgs)).batch(imgs, boxes).clone()
+    return crops, [str(f.parent) for f in files]
+
+
+class CropCalibrationReader:
+    """Feeds a crop batch to the ONNX Runtime calibrator in chunks."""
+
+    def __init__(self, crops, input_name, batch_size=1):
+        self.crops = crops.cpu().numpy().astype(np.float32)
+        self.input_name = input_name
+        self.batch_size = batch_size
+        self.i = 0
+
+    def get_next(self):
+        if self.i >= len(self.crops):
+            return None
+        batch = self.crops[self.i:self.i + self.batch_size]
+        self.i += self.batch_size
+        return {self.input_name: batch}
+
+    def rewind(self):
+        self.i = 0
+
+
+def _embed(model, crops, batch_size=32):
+    features = torch.cat([model(crops[i:i + batch_size]) for i in range(0, len(crops), batch_size)])
+    return torch.nn.functional.normalize(features.float(), dim=1)
+
+
+def _rank1(features, labels=None):
+    # Nearest neighbour of every crop among the other crops, and the rank-1
+    # accuracy if crops of the same label show the same identity
+    sim = features @ features.T
+    sim.fill_diagonal_(-float('inf'))
+    nn = sim.argmax(1).numpy()
+    if labels is None:
+        return nn, None
+    labels = np.asarray(labels)
+    return nn, float(np.mean(labels[nn] == labels))
+
+
+def guardrail(weights, quantized, crops, labels=None, min_cos=0.98, min_rank1=0.95, prefix=colorstr('Guardrail:')):
+    """Compare the embeddings of a quantized model with the fp32 model.
+
+    Parameters
+    ----------
+    weights : str or Path
+        The fp32 ReID weights.
+    quantized : str or Path
+        The quantized ReID weights.
+    crops : torch.Tensor
+        A normalized Nx3xHxW crop batch.
+    labels : Optional[List[str]]
+        Identity label of each crop, used to report the rank-1 accuracy.
+    min_cos : float
+        Minimum mean cosine similarity between fp32 and quantized embeddings.
+    min_rank1 : float
+        Minimum fraction of crops whose nearest neighbour has the same label
+        under both models. Without labels, the nearest crop itself has to be
+        the same.
+
+    Returns
+    -------
+    (bool, dict)
+        Whether the quantized model passes, and the measured metrics.
+    """
+    embeddings, dt = [], []
+    for w in (weights, quantized):
+        model = ReIDDetectMultiBackend(w)
+        model.warmup((1, 3, *crops.shape[2:]))
+        t = time.time()
+        embeddings.append(_embed(model, crops))
+        dt.append(time.time() - t)
+    f32, q = embeddings
+
+    if labels is not None and len(set(labels)) < 2:
+        labels = None  # a single identity, compare the nearest crops themselves
+    cos = (f32 * q).sum(1)
+    nn_f32, acc_f32 = _rank1(f32, labels)
+    nn_q, acc_q = _rank1(q, labels)
+    ids = np.asarray(labels) if labels is not None else np.arange(len(crops))
+    metrics = {
+        'cos_mean': cos.mean().item(),
+        'cos_min': cos.min().item(),
+        'rank1_agreement': float(np.mean(ids[nn_f32] == ids[nn_q])) if len(crops) > 1 else 1.0,
+        'rank1_fp32': acc_f32,
+        'rank1_int8': acc_q,
+        'ms_per_crop_fp32': dt[0] * 1E3 / len(crops),
+        'ms_per_crop_int8': dt[1] * 1E3 / len(crops)}
+    ok = metrics['cos_mean'] >= min_cos and metrics['rank1_agreement'] >= min_rank1
+    s = ', '.join(f'{k} {v:.4f}' for k, v in metrics.items() if v is not None)
+    LOGGER.info(f"{prefix} {'PASS' if ok else 'FAIL'} {Path(quantized).name} on {len(crops)} crops: {s}")
+    return ok, metrics
+
+
+@torch.no_grad()
+def run(
+        weights=ROOT / 'strong_sort/deep/checkpoint/osnet_x0_25_msmt17.pth',  # fp32 checkpoint or ONNX model
+        mode='dynamic',  # dynamic or static
+        source=None,  # directory of crop images for calibration and the guardrail
+        guard=None,  # only run the guardrail on this quantized model
+        imgsz=(256, 128),  # ReID input size (height, width)
+        calib_crops=256,  # maximum number of calibration crops
+        guard_crops=1000,  # maximum number of guardrail crops
+        per_channel=True,  # static: per channel weight quantization
+        min_cos=0.98,  # guardrail: minimum mean cosine similarity
+        min_rank1=0.95,  # guardrail: minimum rank-1 agreement
+        force=False,  # keep the quantized model even if the guardrail fails
+):
+    check_requirements(('onnx', 'onnxruntime'))
+    from onnxruntime.quantization import (CalibrationMethod, QuantFormat, QuantType, quant_pre_process,
+                                          quantize_dynamic, quantize_static)
+
+    weights = Path(weights)
+    if weights.suffix != '.onnx':  # export the fp32 model with a dynamic batch axis
+        exported = export(weights=weights, imgsz=imgsz, include=('onnx',), dynamic=True, check=False)
+        assert exported, f'ONNX export of {weights} failed'
+        weights = Path(exported[0])
+
+    if guard:
+        assert source, '--guard requires a --source crop set'
+        crops, labels = load_crops(source, guard_crops, imgsz)
+        return guardrail(weights, guard, crops, labels, min_cos, min_rank1)[0]
+
+    t = time.time()
+    f = weights.with_name(f'{weights.stem}_int8_{mode}.onnx')
+    prefix = colorstr(f'INT8 {mode}:')
+    LOGGER.info(f'\n{prefix} quantizing {weights} ({file_size(weights):.1f} MB)...')
+    assert mode in ('dynamic', 'static'), f'Invalid quantization mode {mode}; must be dynamic or static'
+    assert mode == 'dynamic' or source, 'static quantization requires a --source crop set for calibration'
+    preprocessed = weights.with_name(f'{weights.stem}_preprocessed.onnx')
+    quant_pre_process(str(weights), str(preprocessed))  # shape inference and graph optimization
+    if mode == 'dynamic':
+        quantize_dynamic(str(preprocessed), str(f), weight_type=QuantType.QInt8)
+    else:
+        crops, _ = load_crops(source, calib_crops, imgsz)
+        import onnxruntime
+        input_name = onnxruntime.InferenceSession(
+            str(preprocessed), providers=['CPUExecutionProvider']).get_inputs()[0].name
+        quantize_static(str(preprocessed), str(f), CropCalibrationReader(crops, input_name),
+                        quant_format=QuantFormat.QDQ, per_channel=per_channel,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        calibrate_method=CalibrationMethod.MinMax)
+    preprocessed.unlink()
+    LOGGER.info(f'{prefix} saved as {f} ({file_size(f):.1f} MB, {time.time() - t:.1f}s)')
+
+    if source:
+        crops, labels = load_crops(source, guard_crops, imgsz)
+        ok, _ = guardrail(weights, f, crops, labels, min_cos, min_rank1)
+        if not ok and not force:
+            f.unlink()
+            LOGGER.info(f'{prefix} {f.name} removed, the quantized embeddings diverge from fp32 '
+                        f'(use --force to keep it)')
+            return None
+    else:
+        LOGGER.info(f'{prefix} no --source crop set given, guardrail skipped')
+    LOGGER.info(f'\nUsage:                python track.py --strong-sort-weights {f}')
+    return f
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default=ROOT / 'strong_sort/deep/checkpoint/osnet_x0_25_msmt17.pth', help='fp32 torchreid checkpoint or ONNX model')
+    parser.add_argument('--mode', type=str, default='dynamic', choices=['dynamic', 'static'], help='quantization mode')
+    parser.add_argument('--source', type=str, default=None, help='directory of crop images for calibration and the guardrail')
+    parser.add_argument('--guard', type=str, default=None, help='only run the guardrail on this quantized model')
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs=2, type=int, default=[256, 128], help='ReID input size h w')
+    parser.add_argument('--calib-crops', type=int, default=256, help='maximum number of calibration crops')
+    parser.add_argument('--guard-crops', type=int, default=1000, help='maximum number of guardrail crops')
+    parser.add_argument('--no-per-channel', dest='per_channel', action='store_false', help='static: per tensor weight quantization')
+    parser.add_argument('--min-cos', type=float, default=0.98, help='guardrail: minimum mean cosine similarity')
+    parser.add_argument('--min-rank1', type=float, default=0.95, help='guardrail: minimum rank-1 agreement')
+    parser.add_argument('--force', action='store_true', help='keep the quantized model even if the guardrail fails')
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    ok = run(**vars(opt))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
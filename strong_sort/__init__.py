@@ -1,10 +1,17 @@
-from .strong_sort import StrongSORT
+__all__ = ['StrongSORT', 'build_tracker']
 
 
-__all__ = ['StrongSORT', 'build_tracker']
+def __getattr__(name):
+    # StrongSORT is imported on first use, so that the NumPy-only tracker in
+    # `strong_sort.sort` can be imported without torch and the ReID models
+    if name == 'StrongSORT':
+        from .strong_sort import StrongSORT
+        return StrongSORT
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def build_tracker(cfg, use_cuda):
+    from .strong_sort import StrongSORT
     return StrongSORT(cfg.STRONGSORT.REID_CKPT, 
                 max_dist=cfg.STRONGSORT.MAX_DIST, min_confidence=cfg.STRONGSORT.MIN_CONFIDENCE, 
                 nms_max_overlap=cfg.STRONGSORT.NMS_MAX_OVERLAP, max_iou_distance=cfg.STRONGSORT.MAX_IOU_DISTANCE, 
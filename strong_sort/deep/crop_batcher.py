@@ -0,0 +1,123 @@
+import cv2
+import numpy as np
+import torch
+from torchvision.ops import roi_align
+
+
+class CropBatcher(object):
+    """
+    Turns a frame and an array of boxes into a normalized `(N, 3, H, W)` ReID
+    input batch. Crops are resized straight into a preallocated host buffer
+    and normalized in one tensor operation. Both buffers are reused across
+    frames and only grown when a frame has more boxes than their capacity.
+
+    The crops keep the BGR channel order of the frame, as the torchreid
+    `FeatureExtractor` preprocessing does. `roi_align` crops RGB tensors like
+    the detector input and returns them in the same BGR order.
+
+    Parameters
+    ----------
+    image_size : (int, int)
+        Height and width of the model input.
+    pixel_mean : List[float]
+        Per channel mean used for normalization, in the [0, 1] range.
+    pixel_std : List[float]
+        Per channel standard deviation used for normalization.
+    device : str or torch.device
+        The device the batch is placed on.
+    capacity : int
+        Initial number of preallocated crops.
+    """
+
+    def __init__(self, image_size=(256, 128), pixel_mean=(0.485, 0.456, 0.406),
+                 pixel_std=(0.229, 0.224, 0.225), device='cpu', capacity=32):
+        self.image_size = tuple(image_size)
+        self.device = torch.device(device)
+        self.mean = torch.tensor(pixel_mean, device=self.device).view(1, 3, 1, 1)
+        self.std = torch.tensor(pixel_std, device=self.device).view(1, 3, 1, 1)
+        self._host = None
+        self._batch = None
+        self._reserve(capacity)
+
+    @property
+    def capacity(self):
+        return len(self._host)
+
+    def _reserve(self, n):
+        if self._host is not None and n <= self.capacity:
+            return
+        n = max(n, 2 * self.capacity if self._host is not None else n)
+        h, w = self.image_size
+        self._host = np.zeros((n, h, w, 3), dtype=np.uint8)
+        self._batch = torch.empty((n, 3, h, w), dtype=torch.float32, device=self.device)
+
+    def _normalize(self, batch):
+        return batch.sub_(self.mean).div_(self.std)
+
+    def __call__(self, img, boxes):
+        """Crop, resize and normalize boxes of a frame.
+
+        Parameters
+        ----------
+        img : ndarray
+            An HxWx3 uint8 frame.
+        boxes : ndarray
+            An Nx4 integer array of `(x1, y1, x2, y2)` boxes, clipped to the
+            frame.
+
+        Returns
+        -------
+        torch.Tensor
+            An Nx3xHxW float tensor. It is a view into a buffer that is
+            overwritten by the next call.
+        """
+        return self.batch([img], [boxes])
+
+    def batch(self, imgs, boxes):
+        """Like `__call__`, for the boxes of several frames at once. The crops
+        are concatenated in the order of `imgs`.
+        """
+        n = sum(len(b) for b in boxes)
+        self._reserve(n)
+        h, w = self.image_size
+        i = 0
+        for img, img_boxes in zip(imgs, boxes):
+            for x1, y1, x2, y2 in np.asarray(img_boxes, dtype=np.int64).reshape(-1, 4):
+                crop = img[y1:y2, x1:x2]
+                if crop.size == 0:
+                    self._host[i] = 0
+                else:
+                    shrink = crop.shape[0] > h or crop.shape[1] > w
+                    cv2.resize(crop, (w, h), dst=self._host[i],
+                               interpolation=cv2.INTER_AREA if shrink else cv2.INTER_LINEAR)
+                i += 1
+        batch = self._batch[:n]
+        batch.copy_(torch.from_numpy(self._host[:n]).to(self.device).permute(0, 3, 1, 2))
+        return self._normalize(batch.div_(255.))
+
+    def roi_align(self, im, boxes, rgb=True):
+        """Crop, resize and normalize boxes from a batch of frames that already
+        is on the device, e.g. the detector input.
+
+        Parameters
+        ----------
+        im : torch.Tensor
+            A Bx3xHxW float tensor with values in [0, 1].
+        boxes : List[torch.Tensor]
+            B tensors of `(x1, y1, x2, y2)` boxes, one per frame, in the
+            coordinates of `im`.
+        rgb : bool
+            Whether `im` is in RGB order, as the YOLOv5 detector input. The
+            crops are then flipped to the BGR order of `batch`.
+
+        Returns
+        -------
+        torch.Tensor
+            An Nx3xHxW float tensor of the crops of all frames.
+        """
+        boxes = [b.to(device=im.device, dtype=im.dtype) for b in boxes]
+        crops = roi_align(im, boxes, output_size=self.image_size, spatial_scale=1.0,
+                          sampling_ratio=2, aligned=True)
+        if rgb:  # channels are cropped independently, flipping the crops is cheaper than the frames
+            crops = crops[:, [2, 1, 0]]
+        return self._normalize(crops.float().to(self.device))
@@ -95,9 +95,13 @@ __trained_urls = {
 }
 
 
+def downloadable_models():
+    return list(__trained_urls.keys())
+
+
 def show_downloadeable_models():
     print('\nAvailable ReID models for automatic download')
-    print(list(__trained_urls.keys()))
+    print(downloadable_models())
 
 
 def get_model_url(model):
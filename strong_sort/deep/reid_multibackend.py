@@ -0,0 +1,133 @@
+from os.path import exists as file_exists
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from .reid_model_factory import get_model_name
+
+# weight file suffixes of each inference backend
+REID_FORMATS = {
+    'pt': ('.pt', '.pth'),
+    'jit': ('.torchscript',),
+    'onnx': ('.onnx',),
+    'xml': ('.xml',),
+}
+
+
+class ReIDDetectMultiBackend(nn.Module):
+    """
+    A ReID model that runs on the inference backend selected by the suffix of
+    its weight file, like `DetectMultiBackend` does for YOLO:
+
+        PyTorch:     *.pt, *.pth (torchreid checkpoint)
+        TorchScript: *.torchscript
+        ONNX Runtime: *.onnx
+        OpenVINO:    *.xml
+
+    All backends take the same normalized `(N, 3, H, W)` crop batch, e.g. from
+    a `CropBatcher`, and return the `(N, M)` float32 embeddings as a tensor on
+    `device`.
+
+    Parameters
+    ----------
+    weights : str or Path
+        Path to the model weights.
+    device : str or torch.device
+        The device inputs are expected and outputs are returned on. PyTorch
+        and TorchScript models run on it; ONNX Runtime uses CUDA if available
+        and the device is a GPU; OpenVINO always runs on the CPU.
+    fp16 : bool
+        Run PyTorch and TorchScript models in half precision on GPU, and let
+        OpenVINO pick its default reduced inference precision.
+    """
+
+    def __init__(self, weights, device=torch.device('cpu'), fp16=False):
+        super().__init__()
+        w = str(weights[0] if isinstance(weights, list) else weights)
+        self.weights = w
+        self.pt, self.jit, self.onnx, self.xml = self._model_type(w)
+        self.device = torch.device(device)
+        self.fp16 = fp16 and self.device.type != 'cpu' and (self.pt or self.jit)
+        self.batch_size = None  # fixed batch size of exported models without dynamic axes
+
+        if self.pt:  # PyTorch
+            from torchreid.models import build_model
+            from torchreid.utils import load_pretrained_weights
+            model_name = get_model_name(w)
+            if model_name is None:
+                raise ValueError(f'Cannot infer the ReID architecture from {w}')
+            model = build_model(model_name, num_classes=1, pretrained=not file_exists(w),
+                                use_gpu=self.device.type == 'cuda')
+            if file_exists(w):
+                load_pretrained_weights(model, w)
+            model.to(self.device).eval()
+            self.model = model.half() if self.fp16 else model
+        elif self.jit:  # TorchScript
+            model = torch.jit.load(w, map_location=self.device)
+            self.model = model.half() if self.fp16 else model.float()
+        elif self.onnx:  # ONNX Runtime
+            import onnxruntime
+            cuda = self.device.type == 'cuda' and 'CUDAExecutionProvider' in onnxruntime.get_available_providers()
+            providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if cuda else ['CPUExecutionProvider']
+            self.session = onnxruntime.InferenceSession(w, providers=providers)
+            self.input_name = self.session.get_inputs()[0].name
+            batch = self.session.get_inputs()[0].shape[0]
+            self.batch_size = batch if isinstance(batch, int) else None
+            self.output_names = [x.name for x in self.session.get_outputs()]
+        elif self.xml:  # OpenVINO
+            import openvino as ov
+            core = ov.Core()
+            # CPUs with bf16 support otherwise lower the precision by default
+            config = {} if fp16 else {'INFERENCE_PRECISION_HINT': 'f32'}
+            self.executable_network = core.compile_model(core.read_model(w), 'CPU', config)
+            self.output_layer = self.executable_network.output(0)
+            batch = self.executable_network.input(0).get_partial_shape()[0]
+            self.batch_size = batch.get_length() if batch.is_static else None
+
+    @staticmethod
+    def _model_type(p):
+        # Return the backend flags (pt, jit, onnx, xml) of weight file path p
+        suffix = Path(p).suffix.lower()
+        types = [suffix in suffixes for suffixes in REID_FORMATS.values()]
+        if not any(types):
+            raise ValueError(
+                f'Invalid ReID weights {p}; the suffix must be one of '
+                + ', '.join(s for suffixes in REID_FORMATS.values() for s in suffixes))
+        return types
+
+    @torch.no_grad()
+    def forward(self, im_batch):
+        """Compute the embeddings of a normalized Nx3xHxW crop batch."""
+        if self.pt or self.jit:
+            im_batch = im_batch.to(self.device)
+            features = self.model(im_batch.half() if self.fp16 else im_batch)
+        elif self.onnx:
+            im = im_batch.cpu().numpy().astype(np.float32)
+            features = self._run_static(
+                lambda x: self.session.run(self.output_names, {self.input_name: x})[0], im)
+        else:  # OpenVINO
+            im = im_batch.cpu().numpy().astype(np.float32)
+            features = self._run_static(
+                lambda x: self.executable_network([x])[self.output_layer], im)
+
+        if isinstance(features, np.ndarray):
+            features = torch.from_numpy(features).to(self.device)
+        return features.float()
+
+    def _run_static(self, run, im):
+        # Models exported with a fixed batch size get fixed size chunks, the
+        # last one zero padded
+        b, n = self.batch_size, len(im)
+        if b is None or n == b:
+            return run(im)
+        pad = -n % b
+        if pad:
+            im = np.concatenate([im, np.zeros((pad, *im.shape[1:]), dtype=im.dtype)])
+        return np.concatenate([run(im[i:i + b]) for i in range(0, len(im), b)])[:n]
+
+    def warmup(self, imgsz=(1, 3, 256, 128)):
+        """Run one dummy batch so that the first frame does not pay for lazy
+        initialization."""
+        self.forward(torch.zeros(imgsz, device=self.device))
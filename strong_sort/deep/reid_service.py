@@ -0,0 +1,97 @@
+import gdown
+import numpy as np
+import torch
+from os.path import exists as file_exists
+
+from .reid_model_factory import downloadable_models, get_model_url
+from .reid_multibackend import ReIDDetectMultiBackend
+from .crop_batcher import CropBatcher
+
+
+class ReIDService(object):
+    """
+    A ReID feature extractor that can be shared by the StrongSORT instances of
+    all video sources of a process. Crops of all sources are run through the
+    model in one batched forward pass, so that memory does not grow with the
+    number of sources. Crops are preprocessed into a reused input buffer by a
+    `CropBatcher`.
+
+    Parameters
+    ----------
+    model_weights : str or Path
+        Path to the ReID weights. The suffix selects the inference backend,
+        see `ReIDDetectMultiBackend`. Known models are downloaded if missing,
+        a FileNotFoundError is raised for other missing weights.
+    device : str or torch.device
+        The device the model runs on.
+    batch_size : int
+        Maximum number of crops per forward pass.
+    fp16 : bool
+        Run PyTorch and TorchScript models in half precision.
+    """
+
+    def __init__(self, model_weights, device, batch_size=64, fp16=False):
+        model_url = get_model_url(model_weights)
+
+        if not file_exists(model_weights) and model_url is not None:
+            gdown.download(model_url, str(model_weights), quiet=False)
+        elif file_exists(model_weights):
+            pass
+        elif model_url is None:
+            raise FileNotFoundError(
+                f'ReID weights {model_weights} not found and no download URL is associated with them. '
+                f'Choose between: {", ".join(downloadable_models())}')
+
+        self.extractor = ReIDDetectMultiBackend(model_weights, device, fp16)
+        self.batch_size = batch_size
+        self.crops = CropBatcher(device=self.extractor.device)
+
+    def __call__(self, batch):
+        """Extract the features of a preprocessed Nx3xHxW crop batch.
+
+        Returns
+        -------
+        torch.Tensor | ndarray
+            An NxM tensor of N features, or an empty array if there are no
+            crops.
+        """
+        if len(batch) == 0:
+            return np.array([])
+        features = [self.extractor(batch[i:i + self.batch_size])
+                    for i in range(0, len(batch), self.batch_size)]
+        return torch.cat(features) if len(features) > 1 else features[0]
+
+    @staticmethod
+    def _split(features, sizes):
+        offsets = np.cumsum([0] + sizes)
+        return [features[offsets[i]:offsets[i + 1]] if sizes[i] else np.array([])
+                for i in range(len(sizes))]
+
+    def extract(self, imgs, boxes):
+        """Extract the features of the boxes of several frames, e.g. one per
+        source, in one batch.
+
+        Parameters
+        ----------
+        imgs : List[ndarray]
+            The BGR frames.
+        boxes : List[ndarray]
+            One Nx4 integer array of `(x1, y1, x2, y2)` boxes per frame.
+
+        Returns
+        -------
+        List[torch.Tensor | ndarray]
+            The features of each frame, in the order of its boxes.
+        """
+        sizes = [len(b) for b in boxes]
+        return self._split(self(self.crops.batch(imgs, boxes)), sizes)
+
+    def extract_roi(self, im, boxes):
+        """Like `extract`, but crops the boxes with ROI-align from a Bx3xHxW
+        RGB frame tensor that already is on the device, e.g. the detector
+        input. `boxes` are given in the coordinates of `im`.
+        """
+        sizes = [len(b) for b in boxes]
+        if sum(sizes) == 0:
+            return [np.array([]) for _ in sizes]
+        return self._split(self(self.crops.roi_align(im, boxes)), sizes)
@@ -0,0 +1,299 @@
+# vim: expandtab:ts=4:sw=4
+import time
+import cv2
+import numpy as np
+
+
+def get_matrix(matrix):
+    eye = np.eye(3)
+    dist = np.linalg.norm(eye - matrix)
+    if dist < 100:
+        return matrix
+    else:
+        return eye
+
+
+class CMC(object):
+    """
+    Base class of the global camera motion compensation backends. The warp
+    between two consecutive frames of a video source is estimated once per
+    frame, so that it can be applied to all tracks of a tracker at once.
+
+    Each frame is converted to a downscaled grayscale image exactly once. That
+    image, together with whatever the backend derives from it (keypoints), is
+    cached as the reference for the next frame.
+
+    Before estimating, a tiny thumbnail of the frame is compared with the
+    thumbnail of the reference. If their mean absolute difference is below
+    `static_thresh`, the scene is considered static: the estimation is skipped
+    and the reference is kept, so that slow motion still accumulates until it
+    is detected.
+
+    Parameters
+    ----------
+    scale : float or [int, int]
+        scale_ratio: float
+        scale_size: [W, H]
+    static_thresh : float
+        Mean absolute gray level difference between thumbnails below which a
+        frame is considered static. 0 disables the check.
+    static_size : int
+        Width in pixels of the thumbnails used by the static scene check.
+
+    Attributes
+    ----------
+    elapsed : float
+        Time in seconds spent in the last call to `apply`.
+    computed : int
+        Number of frames for which a warp has been estimated.
+    skipped : int
+        Number of frames for which the estimation was skipped because the
+        scene was static.
+
+    """
+
+    def __init__(self, scale=0.1, static_thresh=1.0, static_size=64):
+        self.scale = scale
+        self.static_thresh = static_thresh
+        self.static_size = static_size
+        self.elapsed = 0.
+        self.computed = 0
+        self.skipped = 0
+        self._prev_gray = None
+        self._prev_thumb = None
+        self._prev_state = None
+
+    def reset(self):
+        """Drop the cached reference frame."""
+        self._prev_gray = None
+        self._prev_thumb = None
+        self._prev_state = None
+
+    def _thumbnail(self, gray):
+        h, w = gray.shape[:2]
+        size = (min(w, self.static_size), max(1, int(round(h * min(w, self.static_size) / w))))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def is_static(self, thumb):
+        """Returns True if `thumb` is effectively identical to the thumbnail of
+        the reference frame."""
+        if self.static_thresh <= 0 or self._prev_thumb is None:
+            return False
+        return float(np.mean(np.abs(thumb - self._prev_thumb))) < self.static_thresh
+
+    def _preprocess(self, img):
+        """Convert a frame to a downscaled grayscale image. Returns the image
+        and the 3x3 matrix that maps full resolution coordinates to it.
+        """
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        h, w = img.shape[:2]
+        scale = self.scale
+        if scale is None or scale == 1:
+            return img, np.eye(3)
+        if isinstance(scale, float) or isinstance(scale, int):
+            size = (int(round(w * scale)), int(round(h * scale)))
+        else:
+            size = (int(scale[0]), int(scale[1]))
+        gray = cv2.resize(img, size, interpolation=cv2.INTER_LINEAR)
+        return gray, np.diag([size[0] / w, size[1] / h, 1.])
+
+    def _prepare(self, gray):
+        """Derive the backend specific state (e.g. keypoints) of a frame."""
+        return gray
+
+    def _estimate(self, prev_state, curr_state):
+        """Estimate the warp between two prepared frames in downscaled
+        coordinates. Returns a 2x3 or 3x3 matrix, or None on failure.
+        """
+        raise NotImplementedError
+
+    def apply(self, img, estimate=True):
+        """Estimate the camera motion between the cached reference frame and
+        `img`, and make `img` the new reference.
+
+        Parameters
+        ----------
+        img : ndarray
+            The current frame (BGR or gray).
+        estimate : bool
+            If False, only the reference is updated. This is used when there
+            are no tracks to compensate.
+
+        Returns
+        -------
+        Optional[ndarray]
+            The 3x3 matrix that maps image coordinates of the previous frame to
+            the current frame, or None if no warp has been estimated.
+
+        """
+        t0 = time.time()
+        gray, to_small = self._preprocess(img)
+        thumb = self._thumbnail(gray) if self.static_thresh > 0 else None
+        matrix, curr_state = None, None
+        if estimate and self._prev_gray is not None and self._prev_gray.shape == gray.shape:
+            if self.is_static(thumb):
+                self.skipped += 1
+                self.elapsed = time.time() - t0
+                return None
+            self.computed += 1
+            if self._prev_state is None:
+                self._prev_state = self._prepare(self._prev_gray)
+            curr_state = self._prepare(gray)
+            warp = self._estimate(self._prev_state, curr_state)
+            if warp is not None:
+                if warp.shape[0] == 2:
+                    warp = np.vstack([warp, [0, 0, 1]])
+                matrix = get_matrix(np.linalg.multi_dot((
+                    np.linalg.inv(to_small), warp, to_small)))
+        self._prev_gray, self._prev_thumb, self._prev_state = gray, thumb, curr_state
+        self.elapsed = time.time() - t0
+        return matrix
+
+
+class ECC(CMC):
+    """
+    Camera motion compensation by enhanced correlation coefficient
+    maximization (`cv2.findTransformECC`) on the downscaled frames.
+
+    Parameters
+    ----------
+    warp_mode: flags of opencv
+        translation: cv2.MOTION_TRANSLATION
+        rotated and shifted: cv2.MOTION_EUCLIDEAN
+        affine(shift,rotated,shear): cv2.MOTION_AFFINE
+    eps: float
+        the threshold of the increment in the correlation coefficient between two iterations
+    max_iter: int
+        the number of iterations.
+
+    """
+
+    def __init__(self, scale=0.1, warp_mode=cv2.MOTION_EUCLIDEAN, eps=1e-5, max_iter=100, **kwargs):
+        super(ECC, self).__init__(scale, **kwargs)
+        self.warp_mode = warp_mode
+        self.criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, max_iter, eps)
+
+    def _estimate(self, prev_state, curr_state):
+        warp_matrix = np.eye(2, 3, dtype=np.float32)
+        try:
+            (cc, warp_matrix) = cv2.findTransformECC(
+                prev_state, curr_state, warp_matrix, self.warp_mode, self.criteria, None, 1)
+        except cv2.error:
+            return None
+        return warp_matrix
+
+
+class SparseOptFlow(CMC):
+    """
+    Camera motion compensation by tracking corner features of the previous
+    frame with pyramidal Lucas-Kanade optical flow and fitting a partial
+    affine (rotation, translation, uniform scale) model with RANSAC. The
+    corners of a frame are detected once and reused when the frame becomes
+    the reference.
+
+    Parameters
+    ----------
+    max_corners : int
+        Maximum number of corners to track.
+    quality_level : float
+        Minimal accepted corner quality, relative to the best corner.
+    min_distance : float
+        Minimum distance between corners in downscaled pixels.
+    win_size : int
+        Size of the Lucas-Kanade search window at each pyramid level.
+    max_level : int
+        Number of pyramid levels above the base image.
+
+    """
+
+    def __init__(self, scale=0.5, max_corners=300, quality_level=0.01, min_distance=3,
+                 win_size=21, max_level=3, **kwargs):
+        super(SparseOptFlow, self).__init__(scale, **kwargs)
+        self.max_corners = max_corners
+        self.quality_level = quality_level
+        self.min_distance = min_distance
+        self.win_size = (win_size, win_size)
+        self.max_level = max_level
+
+    def _prepare(self, gray):
+        corners = cv2.goodFeaturesToTrack(
+            gray, self.max_corners, self.quality_level, self.min_distance, blockSize=3)
+        return gray, corners
+
+    def _estimate(self, prev_state, curr_state):
+        prev_gray, prev_corners = prev_state
+        curr_gray, _ = curr_state
+        if prev_corners is None or len(prev_corners) < 4:
+            return None
+        next_corners, status, _ = cv2.calcOpticalFlowPyrLK(
+            prev_gray, curr_gray, prev_corners, None,
+            winSize=self.win_size, maxLevel=self.max_level)
+        tracked = status.ravel() == 1
+        if tracked.sum() < 4:
+            return None
+        warp_matrix, _ = cv2.estimateAffinePartial2D(
+            prev_corners[tracked], next_corners[tracked], method=cv2.RANSAC)
+        return warp_matrix
+
+
+class ORB(CMC):
+    """
+    Camera motion compensation by matching ORB keypoints between the previous
+    and the current frame and fitting a partial affine (rotation, translation,
+    uniform scale) model with RANSAC. The keypoints and descriptors of a frame
+    are computed once and reused when the frame becomes the reference.
+
+    Parameters
+    ----------
+    n_features : int
+        Maximum number of ORB keypoints per frame.
+    ratio : float
+        Lowe's ratio test threshold for descriptor matches.
+
+    """
+
+    def __init__(self, scale=0.5, n_features=500, ratio=0.75, **kwargs):
+        super(ORB, self).__init__(scale, **kwargs)
+        self.ratio = ratio
+        self.detector = cv2.ORB_create(n_features)
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    def _prepare(self, gray):
+        keypoints, descriptors = self.detector.detectAndCompute(gray, None)
+        points = np.float32([kp.pt for kp in keypoints]).reshape(-1, 2)
+        return points, descriptors
+
+    def _estimate(self, prev_state, curr_state):
+        prev_points, prev_descriptors = prev_state
+        curr_points, curr_descriptors = curr_state
+        if prev_descriptors is None or curr_descriptors is None:
+            return None
+        matches = [
+            m[0] for m in self.matcher.knnMatch(prev_descriptors, curr_descriptors, k=2)
+            if len(m) == 2 and m[0].distance < self.ratio * m[1].distance]
+        if len(matches) < 4:
+            return None
+        src = prev_points[[m.queryIdx for m in matches]]
+        dst = curr_points[[m.trainIdx for m in matches]]
+        warp_matrix, _ = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC)
+        return warp_matrix
+
+
+CMC_METHODS = {
+    'ecc': ECC,
+    'sparse_flow': SparseOptFlow,
+    'orb': ORB,
+}
+
+
+def build_cmc(method='ecc', **kwargs):
+    """Create the camera motion compensation backend registered as `method`
+    in `CMC_METHODS`. Keyword arguments set to None use the backend default.
+    """
+    if method not in CMC_METHODS:
+        raise ValueError(
+            "Invalid camera motion compensation method; must be one of %s"
+            % ", ".join(sorted(CMC_METHODS)))
+    kwargs = {k: v for k, v in kwargs.items() if v is not None}
+    return CMC_METHODS[method](**kwargs)
@@ -12,8 +12,10 @@ class Detection(object):
         Bounding box in format `(x, y, w, h)`.
     confidence : float
         Detector confidence score.
-    feature : array_like
-        A feature vector that describes the object contained in this image.
+    feature : array_like | NoneType
+        A feature vector that describes the object contained in this image, or
+        None if it has not been extracted. Must be a NumPy array or convertible
+        to one, e.g. a list.
 
     Attributes
     ----------
@@ -27,9 +29,9 @@ class Detection(object):
     """
 
     def __init__(self, tlwh, confidence, feature):
-        self.tlwh = np.asarray(tlwh, dtype=np.float)
+        self.tlwh = np.asarray(tlwh, dtype=np.float64)
         self.confidence = float(confidence)
-        self.feature = np.asarray(feature.cpu(), dtype=np.float32)
+        self.feature = np.asarray(feature, dtype=np.float32) if feature is not None else None
 
     def to_tlbr(self):
         """Convert bounding box to format `(min x, min y, max x, max y)`, i.e.,
@@ -47,3 +49,116 @@ class Detection(object):
         ret[:2] += ret[2:] / 2
         ret[2] /= ret[3]
         return ret
+
+
+class DetectionBatch(object):
+    """
+    The detections of one image as contiguous arrays, which the cost functions
+    and the tracker index with integer arrays instead of iterating over
+    `Detection` objects. Derived box formats are computed once on
+    construction.
+
+    Parameters
+    ----------
+    tlwh : array_like
+        An Nx4 array of bounding boxes in format `(x, y, w, h)`.
+    confidence : array_like
+        The N detector confidence scores.
+    features : Optional[array_like]
+        An NxM array of feature vectors, or None if they have not been
+        extracted (see `set_features`).
+    class_id : Optional[array_like]
+        The N detected class ids.
+
+    Attributes
+    ----------
+    tlwh : ndarray
+        Bounding boxes in format `(top left x, top left y, width, height)`.
+    tlbr : ndarray
+        Bounding boxes in format `(min x, min y, max x, max y)`.
+    xyah : ndarray
+        Bounding boxes in format `(center x, center y, aspect ratio, height)`,
+        where the aspect ratio is `width / height`.
+    confidence : ndarray
+        Detector confidence scores.
+    class_id : ndarray | NoneType
+        Detected class ids.
+    features : ndarray | NoneType
+        An NxM float32 array of feature vectors. Rows where `has_feature` is
+        False are undefined.
+    has_feature : ndarray
+        A boolean array that is True for the detections with a feature vector.
+
+    """
+
+    def __init__(self, tlwh, confidence, features=None, class_id=None):
+        self.tlwh = np.asarray(tlwh, dtype=np.float64).reshape(-1, 4)
+        self.tlbr = self.tlwh.copy()
+        self.tlbr[:, 2:] += self.tlwh[:, :2]
+        self.xyah = self.tlwh.copy()
+        self.xyah[:, :2] += self.tlwh[:, 2:] / 2
+        self.xyah[:, 2] /= self.xyah[:, 3]
+        self.confidence = np.asarray(confidence, dtype=np.float64).reshape(-1)
+        self.class_id = None if class_id is None else np.asarray(class_id).reshape(-1)
+        self.features = None
+        self.has_feature = np.zeros(len(self.tlwh), dtype=bool)
+        if features is not None:
+            self.set_features(np.arange(len(self.tlwh)), features)
+
+    @classmethod
+    def from_detections(cls, detections):
+        """Create a batch from a list of `Detection` objects."""
+        batch = cls(np.array([d.tlwh for d in detections]).reshape(-1, 4),
+                    [d.confidence for d in detections])
+        with_feature = [i for i, d in enumerate(detections) if d.feature is not None]
+        if with_feature:
+            batch.set_features(with_feature, [detections[i].feature for i in with_feature])
+        return batch
+
+    def __len__(self):
+        return len(self.tlwh)
+
+    def __getitem__(self, index):
+        """A single `Detection` for an integer index, otherwise the batch of
+        the detections selected by an integer array or boolean mask."""
+        if np.ndim(index) == 0:
+            detection = Detection(self.tlwh[index], self.confidence[index], None)
+            detection.feature = self.feature(index)
+            return detection
+        batch = DetectionBatch.__new__(DetectionBatch)
+        batch.tlwh, batch.tlbr, batch.xyah = self.tlwh[index], self.tlbr[index], self.xyah[index]
+        batch.confidence = self.confidence[index]
+        batch.class_id = None if self.class_id is None else self.class_id[index]
+        batch.features = None if self.features is None else self.features[index]
+        batch.has_feature = self.has_feature[index]
+        return batch
+
+    def feature(self, index):
+        """The feature vector of one detection, or None if it has none."""
+        return self.features[index] if self.has_feature[index] else None
+
+    def set_features(self, indices, features):
+        """Set the feature vectors of some detections, e.g. those that have
+        been extracted lazily.
+
+        Parameters
+        ----------
+        indices : array_like
+            The K detections to set.
+        features : array_like
+            A KxM array of feature vectors.
+
+        """
+        features = np.asarray(features, dtype=np.float32)
+        if self.features is None:
+            self.features = np.zeros((len(self), features.shape[-1]), dtype=np.float32)
+        self.features[indices] = features
+        self.has_feature[indices] = True
+
+
+def as_batch(detections):
+    """Return `detections` as `DetectionBatch`, converting a list of
+    `Detection` objects."""
+    if isinstance(detections, DetectionBatch):
+        return detections
+    return DetectionBatch.from_detections(detections)
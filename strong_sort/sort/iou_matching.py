@@ -1,7 +1,10 @@
 # vim: expandtab:ts=4:sw=4
 from __future__ import absolute_import
 import numpy as np
+from scipy.sparse import coo_matrix
 from . import linear_assignment
+from .detection import as_batch
+from .spatial_index import GridIndex
 
 
 def iou(bbox, candidates):
@@ -39,6 +42,67 @@ def iou(bbox, candidates):
     return area_intersection / (area_bbox + area_candidates - area_intersection)
 
 
+def iou_batch(bboxes, candidates):
+    """Computer intersection over union between all pairs of two sets of
+    bounding boxes.
+
+    Parameters
+    ----------
+    bboxes : ndarray
+        A Tx4 matrix of bounding boxes in format `(top left x, top left y,
+        width, height)`.
+    candidates : ndarray
+        A Dx4 matrix of candidate bounding boxes in the same format as
+        `bboxes`.
+
+    Returns
+    -------
+    ndarray
+        A TxD matrix where entry (i, j) is the intersection over union in
+        [0, 1] between `bboxes[i]` and `candidates[j]`.
+
+    """
+    bboxes_tl, bboxes_br = bboxes[:, None, :2], bboxes[:, None, :2] + bboxes[:, None, 2:]
+    candidates_tl = candidates[None, :, :2]
+    candidates_br = candidates[None, :, :2] + candidates[None, :, 2:]
+
+    wh = np.maximum(0., np.minimum(bboxes_br, candidates_br) - np.maximum(bboxes_tl, candidates_tl))
+
+    area_intersection = wh.prod(axis=2)
+    area_bboxes = bboxes[:, 2:].prod(axis=1)[:, None]
+    area_candidates = candidates[:, 2:].prod(axis=1)[None, :]
+    return area_intersection / (area_bboxes + area_candidates - area_intersection)
+
+
+def iou_pairs(bboxes, candidates):
+    """Computer intersection over union between pairs of bounding boxes.
+
+    Parameters
+    ----------
+    bboxes : ndarray
+        An Nx4 matrix of bounding boxes in format `(top left x, top left y,
+        width, height)`.
+    candidates : ndarray
+        An Nx4 matrix of candidate bounding boxes in the same format as
+        `bboxes`, one per box.
+
+    Returns
+    -------
+    ndarray
+        An array of length N where entry i is the intersection over union in
+        [0, 1] between `bboxes[i]` and `candidates[i]`.
+
+    """
+    tl = np.maximum(bboxes[:, :2], candidates[:, :2])
+    br = np.minimum(bboxes[:, :2] + bboxes[:, 2:], candidates[:, :2] + candidates[:, 2:])
+    wh = np.maximum(0., br - tl)
+
+    area_intersection = wh.prod(axis=1)
+    area_bboxes = bboxes[:, 2:].prod(axis=1)
+    area_candidates = candidates[:, 2:].prod(axis=1)
+    return area_intersection / (area_bboxes + area_candidates - area_intersection)
+
+
 def iou_cost(tracks, detections, track_indices=None,
              detection_indices=None):
     """An intersection over union distance metric.
@@ -47,8 +111,8 @@ def iou_cost(tracks, detections, track_indices=None,
     ----------
     tracks : List[deep_sort.track.Track]
         A list of tracks.
-    detections : List[deep_sort.detection.Detection]
-        A list of detections.
+    detections : detection.DetectionBatch
+        The detections, or a list of `detection.Detection`.
     track_indices : Optional[List[int]]
         A list of indices to tracks that should be matched. Defaults to
         all `tracks`.
@@ -64,19 +128,70 @@ def iou_cost(tracks, detections, track_indices=None,
         `1 - iou(tracks[track_indices[i]], detections[detection_indices[j]])`.
 
     """
+    detections = as_batch(detections)
     if track_indices is None:
         track_indices = np.arange(len(tracks))
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
 
-    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
-    for row, track_idx in enumerate(track_indices):
-        if tracks[track_idx].time_since_update > 1:
-            cost_matrix[row, :] = linear_assignment.INFTY_COST
-            continue
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return np.zeros((len(track_indices), len(detection_indices)))
 
-        bbox = tracks[track_idx].to_tlwh()
-        candidates = np.asarray(
-            [detections[i].tlwh for i in detection_indices])
-        cost_matrix[row, :] = 1. - iou(bbox, candidates)
+    store = tracks[track_indices[0]].store
+    bboxes = store.to_tlwh([tracks[i].slot for i in track_indices])
+    candidates = detections.tlwh[detection_indices]
+    cost_matrix = 1. - iou_batch(bboxes, candidates)
+
+    time_since_update = np.array([tracks[i].time_since_update for i in track_indices])
+    cost_matrix[time_since_update > 1, :] = linear_assignment.INFTY_COST
     return cost_matrix
+
+
+def sparse_iou_cost(tracks, detections, track_indices=None,
+                    detection_indices=None):
+    """An intersection over union distance metric that only compares the
+    tracks and detections whose bounding boxes overlap, which are found with
+    a `GridIndex`.
+
+    Parameters
+    ----------
+    tracks : List[deep_sort.track.Track]
+        A list of tracks.
+    detections : detection.DetectionBatch
+        The detections, or a list of `detection.Detection`.
+    track_indices : Optional[List[int]]
+        A list of indices to tracks that should be matched. Defaults to
+        all `tracks`.
+    detection_indices : Optional[List[int]]
+        A list of indices to detections that should be matched. Defaults
+        to all `detections`.
+
+    Returns
+    -------
+    scipy.sparse.coo_matrix
+        Returns a sparse cost matrix of shape
+        len(track_indices), len(detection_indices) that stores the entries of
+        `iou_cost` of the overlapping pairs of tracks that have been updated
+        in the previous frame and detections. All other entries are
+        infeasible.
+
+    """
+    detections = as_batch(detections)
+    if track_indices is None:
+        track_indices = np.arange(len(tracks))
+    if detection_indices is None:
+        detection_indices = np.arange(len(detections))
+    shape = len(track_indices), len(detection_indices)
+
+    time_since_update = np.array([tracks[i].time_since_update for i in track_indices])
+    rows = np.flatnonzero(time_since_update <= 1)
+    if len(rows) == 0 or shape[1] == 0:
+        return coo_matrix(shape)
+
+    store = tracks[track_indices[0]].store
+    bboxes = store.to_tlwh([tracks[track_indices[i]].slot for i in rows])
+    candidates = detections.tlwh[detection_indices]
+    pairs_rows, pairs_cols = GridIndex(np.c_[bboxes[:, :2], bboxes[:, :2] + bboxes[:, 2:]]).query(
+        np.c_[candidates[:, :2], candidates[:, :2] + candidates[:, 2:]])
+    cost = 1. - iou_pairs(bboxes[pairs_rows], candidates[pairs_cols])
+    return coo_matrix((cost, (rows[pairs_rows], pairs_cols)), shape=shape)
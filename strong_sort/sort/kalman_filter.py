@@ -28,6 +28,8 @@ class KalmanFilter(object):
     Object motion follows a constant velocity model. The bounding box location
     (x, y, a, h) is taken as direct observation of the state space (linear
     observation model).
+    The model matrices are read-only, so that one filter can be shared by all
+    tracks of a tracker.
     """
 
     def __init__(self):
@@ -39,6 +41,8 @@ class KalmanFilter(object):
             self._motion_mat[i, ndim + i] = dt
 
         self._update_mat = np.eye(ndim, 2 * ndim)
+        self._motion_mat.setflags(write=False)
+        self._update_mat.setflags(write=False)
 
         # Motion and observation uncertainty are chosen relative to the current
         # state estimate. These weights control the amount of uncertainty in
@@ -46,6 +50,14 @@ class KalmanFilter(object):
         self._std_weight_position = 1. / 20
         self._std_weight_velocity = 1. / 160
 
+    def _motion(self, dt):
+        # Motion matrix for a time step of `dt` frames
+        if dt == 1.:
+            return self._motion_mat
+        motion_mat = np.eye(8)
+        motion_mat[:4, 4:] = dt * np.eye(4)
+        return motion_mat
+
     def initiate(self, measurement):
         """Create track from unassociated measurement.
         Parameters
@@ -76,7 +88,31 @@ class KalmanFilter(object):
         covariance = np.diag(np.square(std))
         return mean, covariance
 
-    def predict(self, mean, covariance):
+    def multi_initiate(self, measurements):
+        """Create tracks from unassociated measurements (vectorized version).
+        Parameters
+        ----------
+        measurements : ndarray
+            An Nx4 dimensional matrix of bounding box coordinates (x, y, a, h).
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx8 dimensional mean matrix and Nx8x8 dimensional
+            covariance matrices of the new tracks.
+        """
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+        mean = np.zeros((len(measurements), 8))
+        mean[:, :4] = measurements
+        weights = np.array([
+            2 * self._std_weight_position, 2 * self._std_weight_position, 1,
+            2 * self._std_weight_position, 10 * self._std_weight_velocity,
+            10 * self._std_weight_velocity, 0.1, 10 * self._std_weight_velocity])
+        covariance = np.zeros((len(measurements), 8, 8))
+        diagonal = np.arange(8)
+        covariance[:, diagonal, diagonal] = np.square(weights * np.tile(measurements, 2))
+        return mean, covariance
+
+    def predict(self, mean, covariance, dt=1.):
         """Run Kalman filter prediction step.
         Parameters
         ----------
@@ -86,11 +122,15 @@ class KalmanFilter(object):
         covariance : ndarray
             The 8x8 dimensional covariance matrix of the object state at the
             previous time step.
+        dt : float
+            The time since the previous time step in frames, which need not be
+            an integer. The state moves by `dt` times its velocity, and the
+            process noise grows linearly with `dt`.
         Returns
         -------
         (ndarray, ndarray)
-            Returns the mean vector and covariance matrix of the predicted
-            state. Unobserved velocities are initialized to 0 mean.
+            Returns the mean vector and covariance matrix of the state
+            predicted `dt` frames ahead.
         """
         std_pos = [
             self._std_weight_position * mean[0],
@@ -102,11 +142,51 @@ class KalmanFilter(object):
             self._std_weight_velocity * mean[1],
             0.1 * mean[2],
             self._std_weight_velocity * mean[3]]
-        motion_cov = np.diag(np.square(np.r_[std_pos, std_vel]))
+        motion_cov = dt * np.diag(np.square(np.r_[std_pos, std_vel]))
 
-        mean = np.dot(self._motion_mat, mean)
+        motion_mat = self._motion(dt)
+        mean = np.dot(motion_mat, mean)
         covariance = np.linalg.multi_dot((
-            self._motion_mat, covariance, self._motion_mat.T)) + motion_cov
+            motion_mat, covariance, motion_mat.T)) + motion_cov
+
+        return mean, covariance
+
+    def multi_predict(self, mean, covariance, dt=1.):
+        """Run Kalman filter prediction step (vectorized version).
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the object states at the previous
+            time step.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states at the
+            previous time step.
+        dt : float
+            The time since the previous time step in frames, the same for all
+            states, see `predict`.
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx8 dimensional mean matrix and Nx8x8 dimensional
+            covariance matrices of the states predicted `dt` frames ahead.
+        """
+        std_pos = [
+            self._std_weight_position * mean[:, 0],
+            self._std_weight_position * mean[:, 1],
+            1 * mean[:, 2],
+            self._std_weight_position * mean[:, 3]]
+        std_vel = [
+            self._std_weight_velocity * mean[:, 0],
+            self._std_weight_velocity * mean[:, 1],
+            0.1 * mean[:, 2],
+            self._std_weight_velocity * mean[:, 3]]
+        sqr = np.square(np.stack(std_pos + std_vel, axis=1))
+        motion_cov = dt * sqr[:, :, None] * np.eye(2 * len(std_pos))
+
+        motion_mat = self._motion(dt)
+        mean = np.dot(mean, motion_mat.T)
+        covariance = np.matmul(np.matmul(
+            motion_mat, covariance), motion_mat.T) + motion_cov
 
         return mean, covariance
 
@@ -141,6 +221,38 @@ class KalmanFilter(object):
             self._update_mat, covariance, self._update_mat.T))
         return mean, covariance + innovation_cov
 
+    def multi_project(self, mean, covariance, confidence=.0):
+        """Project state distributions to measurement space (vectorized
+        version).
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean matrix of the states.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the states.
+        confidence : float or ndarray
+            Detection confidence, either a scalar or one value per state.
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 projected covariance
+            matrices of the given state estimates.
+        """
+        std = np.stack([
+            self._std_weight_position * mean[:, 3],
+            self._std_weight_position * mean[:, 3],
+            1e-1 * np.ones_like(mean[:, 3]),
+            self._std_weight_position * mean[:, 3]], axis=1)
+
+        std = (1 - np.asarray(confidence, dtype=np.float64)).reshape(-1, 1) * std
+
+        innovation_cov = np.square(std)[:, :, None] * np.eye(std.shape[1])
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = np.matmul(np.matmul(
+            self._update_mat, covariance), self._update_mat.T)
+        return mean, covariance + innovation_cov
+
     def update(self, mean, covariance, measurement, confidence=.0):
         """Run Kalman filter correction step.
         Parameters
@@ -173,6 +285,37 @@ class KalmanFilter(object):
             kalman_gain, projected_cov, kalman_gain.T))
         return new_mean, new_covariance
 
+    def multi_update(self, mean, covariance, measurement, confidence=.0):
+        """Run Kalman filter correction step (vectorized version).
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional predicted mean matrix.
+        covariance : ndarray
+            The Nx8x8 dimensional predicted covariance matrices.
+        measurement : ndarray
+            The Nx4 dimensional measurement matrix, one (x, y, a, h) row per
+            state.
+        confidence : float or ndarray
+            Detection confidence, either a scalar or one value per state.
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+        """
+        projected_mean, projected_cov = self.multi_project(mean, covariance, confidence)
+
+        # The projected covariance is symmetric, so solving S K^T = H P^T
+        # yields the transposed Kalman gain for all states at once.
+        kalman_gain = np.linalg.solve(
+            projected_cov, np.matmul(self._update_mat, covariance)).transpose(0, 2, 1)
+        innovation = measurement - projected_mean
+
+        new_mean = mean + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariance = covariance - np.matmul(np.matmul(
+            kalman_gain, projected_cov), kalman_gain.transpose(0, 2, 1))
+        return new_mean, new_covariance
+
     def gating_distance(self, mean, covariance, measurements,
                         only_position=False):
         """Compute gating distance between state distribution and measurements.
@@ -211,4 +354,85 @@ class KalmanFilter(object):
             cholesky_factor, d.T, lower=True, check_finite=False,
             overwrite_b=True)
         squared_maha = np.sum(z * z, axis=0)
+        return squared_maha
+
+    def multi_gating_distance(self, mean, covariance, measurements,
+                              only_position=False):
+        """Compute gating distances between several state distributions and
+        measurements (vectorized version of `gating_distance`).
+        Parameters
+        ----------
+        mean : ndarray
+            The Tx8 dimensional mean matrix of T state distributions.
+        covariance : ndarray
+            The Tx8x8 dimensional covariance matrices of the state
+            distributions.
+        measurements : ndarray
+            An Dx4 dimensional matrix of D measurements, each in
+            format (x, y, a, h) where (x, y) is the bounding box center
+            position, a the aspect ratio, and h the height.
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+        Returns
+        -------
+        ndarray
+            Returns a TxD matrix, where element (i, j) contains the squared
+            Mahalanobis distance between (mean[i], covariance[i]) and
+            `measurements[j]`.
+        """
+        mean, covariance = self.multi_project(mean, covariance)
+
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        cholesky_factor = np.linalg.cholesky(covariance)
+        d = measurements[None, :, :] - mean[:, None, :]
+        z = np.linalg.solve(cholesky_factor, d.transpose(0, 2, 1))
+        squared_maha = np.sum(z * z, axis=1)
+        return squared_maha
+
+    def gating_distance_pairs(self, mean, covariance, measurements, rows,
+                              cols, only_position=False):
+        """Compute the entries (rows, cols) of `multi_gating_distance` only,
+        e.g. for a sparse set of candidate pairs.
+        Parameters
+        ----------
+        mean : ndarray
+            The Tx8 dimensional mean matrix of T state distributions.
+        covariance : ndarray
+            The Tx8x8 dimensional covariance matrices of the state
+            distributions.
+        measurements : ndarray
+            An Dx4 dimensional matrix of D measurements, each in
+            format (x, y, a, h) where (x, y) is the bounding box center
+            position, a the aspect ratio, and h the height.
+        rows : ndarray
+            The state distribution of each pair.
+        cols : ndarray
+            The measurement of each pair.
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+        Returns
+        -------
+        ndarray
+            Returns an array whose i-th element contains the squared
+            Mahalanobis distance between (mean[rows[i]], covariance[rows[i]])
+            and `measurements[cols[i]]`.
+        """
+        mean, covariance = self.multi_project(mean, covariance)
+
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        # Invert the Cholesky factor of every state once, instead of solving
+        # once per pair.
+        cholesky_factor = np.linalg.cholesky(covariance)
+        inverse_factor = np.linalg.inv(cholesky_factor)
+        d = measurements[cols] - mean[rows]
+        z = np.einsum('nij,nj->ni', inverse_factor[rows], d)
+        squared_maha = np.sum(z * z, axis=1)
         return squared_maha
\ No newline at end of file
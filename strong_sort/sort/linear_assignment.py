@@ -1,8 +1,12 @@
 # vim: expandtab:ts=4:sw=4
 from __future__ import absolute_import
 import numpy as np
-from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix, issparse
+from scipy.sparse.csgraph import connected_components
 from . import kalman_filter
+from . import solvers
+from .detection import as_batch
+from .spatial_index import GridIndex
 
 
 INFTY_COST = 1e+5
@@ -10,29 +14,36 @@ INFTY_COST = 1e+5
 
 def min_cost_matching(
         distance_metric, max_distance, tracks, detections, track_indices=None,
-        detection_indices=None):
+        detection_indices=None, solver=None):
     """Solve linear assignment problem.
     Parameters
     ----------
-    distance_metric : Callable[List[Track], List[Detection], List[int], List[int]) -> ndarray
+    distance_metric : Callable[List[Track], DetectionBatch, List[int], List[int]) -> ndarray
         The distance metric is given a list of tracks and detections as well as
         a list of N track indices and M detection indices. The metric should
         return the NxM dimensional cost matrix, where element (i, j) is the
         association cost between the i-th track in the given track indices and
-        the j-th detection in the given detection_indices.
+        the j-th detection in the given detection_indices. The cost matrix
+        may also be a `scipy.sparse` matrix, whose entries that are not stored
+        are infeasible.
     max_distance : float
         Gating threshold. Associations with cost larger than this value are
         disregarded.
     tracks : List[track.Track]
         A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    detections : detection.DetectionBatch
+        The detections at the current time step.
     track_indices : List[int]
         List of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above).
     detection_indices : List[int]
         List of detection indices that maps columns in `cost_matrix` to
         detections in `detections` (see description above).
+    solver : Optional[Callable[ndarray, float) -> (ndarray, ndarray)]
+        The assignment solver (see `solvers`) that is run on every connected
+        component of the feasible pairs. Defaults to the exact solver. If it
+        has an `observe` method, like `solvers.CostRecorder`, that is given
+        the feasible pairs of the whole problem first.
     Returns
     -------
     (List[(int, int)], List[int], List[int])
@@ -41,6 +52,8 @@ def min_cost_matching(
         * A list of unmatched track indices.
         * A list of unmatched detection indices.
     """
+    if solver is None:
+        solver = solvers.hungarian
     if track_indices is None:
         track_indices = np.arange(len(tracks))
     if detection_indices is None:
@@ -51,34 +64,106 @@ def min_cost_matching(
 
     cost_matrix = distance_metric(
         tracks, detections, track_indices, detection_indices)
-    cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
-    row_indices, col_indices = linear_sum_assignment(cost_matrix)
-
-    matches, unmatched_tracks, unmatched_detections = [], [], []
-    for col, detection_idx in enumerate(detection_indices):
-        if col not in col_indices:
-            unmatched_detections.append(detection_idx)
-    for row, track_idx in enumerate(track_indices):
-        if row not in row_indices:
-            unmatched_tracks.append(track_idx)
-    for row, col in zip(row_indices, col_indices):
-        track_idx = track_indices[row]
-        detection_idx = detection_indices[col]
-        if cost_matrix[row, col] > max_distance:
-            unmatched_tracks.append(track_idx)
-            unmatched_detections.append(detection_idx)
-        else:
-            matches.append((track_idx, detection_idx))
+    if issparse(cost_matrix):
+        cost_matrix = cost_matrix.tocoo()
+        feasible = cost_matrix.data <= max_distance
+        rows, cols = cost_matrix.row[feasible].astype(np.int64), cost_matrix.col[feasible].astype(np.int64)
+        costs = cost_matrix.data[feasible]
+    else:
+        rows, cols = np.nonzero(cost_matrix <= max_distance)
+        costs = cost_matrix[rows, cols]
+    if hasattr(solver, 'observe'):
+        solver.observe(rows, cols, costs, (len(track_indices), len(detection_indices)), max_distance)
+
+    # Solving each connected component of the feasible pairs separately is
+    # equivalent to solving the whole matrix: pairs above `max_distance` are
+    # rejected anyway, and all of them have the same cost.
+    single, components = _feasible_components(
+        rows, cols, len(track_indices), len(detection_indices))
+    matched_rows = np.zeros(len(track_indices), dtype=bool)
+    matched_cols = np.zeros(len(detection_indices), dtype=bool)
+    row_indices, col_indices = [rows[single]], [cols[single]]
+    for comp_rows, comp_cols, pairs in components:
+        sub_matrix = np.full((len(comp_rows), len(comp_cols)), max_distance + 1e-5)
+        sub_rows = np.searchsorted(comp_rows, rows[pairs])
+        sub_cols = np.searchsorted(comp_cols, cols[pairs])
+        sub_matrix[sub_rows, sub_cols] = costs[pairs]
+        rows_c, cols_c = solver(sub_matrix, max_distance)
+        keep = sub_matrix[rows_c, cols_c] <= max_distance
+        row_indices.append(comp_rows[rows_c[keep]])
+        col_indices.append(comp_cols[cols_c[keep]])
+    row_indices, col_indices = np.concatenate(row_indices), np.concatenate(col_indices)
+    matched_rows[row_indices] = True
+    matched_cols[col_indices] = True
+
+    order = np.argsort(row_indices, kind='stable')
+    matches = [(track_indices[row], detection_indices[col])
+               for row, col in zip(row_indices[order], col_indices[order])]
+    unmatched_tracks = [track_indices[row] for row in np.flatnonzero(~matched_rows)]
+    unmatched_detections = [detection_indices[col] for col in np.flatnonzero(~matched_cols)]
     return matches, unmatched_tracks, unmatched_detections
 
 
+def _feasible_components(rows, cols, n_rows, n_cols):
+    """Split the bipartite graph of feasible track/detection pairs into its
+    connected components.
+
+    Parameters
+    ----------
+    rows : ndarray
+        The row index of each feasible pair.
+    cols : ndarray
+        The column index of each feasible pair.
+    n_rows : int
+        Number of rows of the cost matrix.
+    n_cols : int
+        Number of columns of the cost matrix.
+
+    Returns
+    -------
+    (ndarray, List[(ndarray, ndarray, ndarray)])
+        A boolean mask of the pairs that form a component on their own, which
+        are matched trivially, and for each larger component its sorted row
+        and column indices and the indices of its pairs.
+
+    """
+    single = np.logical_and(
+        np.bincount(rows, minlength=n_rows)[rows] == 1,
+        np.bincount(cols, minlength=n_cols)[cols] == 1)
+    if single.all():
+        return single, []
+    components = []
+    pairs = np.flatnonzero(~single)
+    graph = coo_matrix(
+        (np.ones(len(pairs), dtype=bool), (rows[pairs], n_rows + cols[pairs])),
+        shape=(n_rows + n_cols, n_rows + n_cols))
+    n_components, labels = connected_components(graph, directed=False)
+
+    # Group the rows, columns and pairs by component. Stable sorting keeps
+    # the indices of each component in order.
+    def group(node_labels, indices=None):
+        order = np.argsort(node_labels, kind='stable')
+        bounds = np.searchsorted(node_labels[order], np.arange(n_components + 1))
+        return order if indices is None else indices[order], bounds
+
+    row_order, row_bounds = group(labels[:n_rows])
+    col_order, col_bounds = group(labels[n_rows:])
+    pair_order, pair_bounds = group(labels[rows[pairs]], pairs)
+    for label in np.unique(labels[rows[pairs]]):
+        components.append((
+            row_order[row_bounds[label]:row_bounds[label + 1]],
+            col_order[col_bounds[label]:col_bounds[label + 1]],
+            pair_order[pair_bounds[label]:pair_bounds[label + 1]]))
+    return single, components
+
+
 def matching_cascade(
         distance_metric, max_distance, cascade_depth, tracks, detections,
-        track_indices=None, detection_indices=None):
+        track_indices=None, detection_indices=None, solver=None):
     """Run matching cascade.
     Parameters
     ----------
-    distance_metric : Callable[List[Track], List[Detection], List[int], List[int]) -> ndarray
+    distance_metric : Callable[List[Track], DetectionBatch, List[int], List[int]) -> ndarray
         The distance metric is given a list of tracks and detections as well as
         a list of N track indices and M detection indices. The metric should
         return the NxM dimensional cost matrix, where element (i, j) is the
@@ -91,8 +176,8 @@ def matching_cascade(
         The cascade depth, should be se to the maximum track age.
     tracks : List[track.Track]
         A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    detections : detection.DetectionBatch
+        The detections at the current time step.
     track_indices : Optional[List[int]]
         List of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above). Defaults to all tracks.
@@ -100,6 +185,8 @@ def matching_cascade(
         List of detection indices that maps columns in `cost_matrix` to
         detections in `detections` (see description above). Defaults to all
         detections.
+    solver : Optional[Callable[ndarray, float) -> (ndarray, ndarray)]
+        The assignment solver, see `min_cost_matching`.
     Returns
     -------
     (List[(int, int)], List[int], List[int])
@@ -122,7 +209,7 @@ def matching_cascade(
     matches_l, _, unmatched_detections = \
         min_cost_matching(
             distance_metric, max_distance, tracks, detections,
-            track_indices_l, unmatched_detections)
+            track_indices_l, unmatched_detections, solver)
     matches += matches_l
     unmatched_tracks = list(set(track_indices) - set(k for k, _ in matches))
     return matches, unmatched_tracks, unmatched_detections
@@ -135,7 +222,6 @@ def gate_cost_matrix(
     distributions obtained by Kalman filtering.
     Parameters
     ----------
-    kf : The Kalman filter.
     cost_matrix : ndarray
         The NxM dimensional cost matrix, where N is the number of track indices
         and M is the number of detection indices, such that entry (i, j) is the
@@ -143,8 +229,8 @@ def gate_cost_matrix(
         `detections[detection_indices[j]]`.
     tracks : List[track.Track]
         A list of predicted tracks at the current time step.
-    detections : List[detection.Detection]
-        A list of detections at the current time step.
+    detections : detection.DetectionBatch
+        The detections at the current time step.
     track_indices : List[int]
         List of track indices that maps rows in `cost_matrix` to tracks in
         `tracks` (see description above).
@@ -162,13 +248,139 @@ def gate_cost_matrix(
     ndarray
         Returns the modified cost matrix.
     """
+    if len(track_indices) == 0:
+        return cost_matrix
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
-    measurements = np.asarray(
-        [detections[i].to_xyah() for i in detection_indices])
-    for row, track_idx in enumerate(track_indices):
-        track = tracks[track_idx]
-        gating_distance = track.kf.gating_distance(track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = gated_cost
-        cost_matrix[row] = 0.995 * cost_matrix[row] + (1 - 0.995) *  gating_distance
-    return cost_matrix
\ No newline at end of file
+    measurements = as_batch(detections).xyah[detection_indices]
+    # All tracks of a tracker share one state store, which gates them in batch.
+    store = tracks[track_indices[0]].store
+    gating_distance = store.gating_distance(
+        [tracks[i].slot for i in track_indices], measurements, only_position)
+    cost_matrix[gating_distance > gating_threshold] = gated_cost
+    cost_matrix = 0.995 * cost_matrix + (1 - 0.995) * gating_distance
+    return cost_matrix
+
+
+def gate_candidates(
+        tracks, detections, track_indices, detection_indices,
+        only_position=False):
+    """Find the track/detection pairs that may pass the gate of
+    `gate_cost_matrix`, i.e. the detections whose center lies within the
+    bounding rectangle of a track's gate, with a `GridIndex` over the gates.
+    Parameters
+    ----------
+    tracks : List[track.Track]
+        A list of predicted tracks at the current time step.
+    detections : detection.DetectionBatch
+        The detections at the current time step.
+    track_indices : List[int]
+        List of N track indices.
+    detection_indices : List[int]
+        List of M detection indices.
+    only_position : Optional[bool]
+        If True, only the x, y position of the state distribution is considered
+        during gating. Defaults to False.
+    Returns
+    -------
+    (ndarray, ndarray)
+        Returns the positions of the candidate pairs in `track_indices` and
+        `detection_indices`, sorted by track.
+    """
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    gating_dim = 2 if only_position else 4
+    store = tracks[track_indices[0]].store
+    boxes = store.gate_boxes(
+        [tracks[i].slot for i in track_indices], kalman_filter.chi2inv95[gating_dim])
+    positions = as_batch(detections).xyah[detection_indices, :2]
+    return GridIndex(boxes).query(np.c_[positions, positions])
+
+
+def gate_pairs(
+        tracks, detections, track_indices, detection_indices,
+        only_position=False, spatial_index=False):
+    """Find the track/detection pairs that pass the gate of
+    `gate_cost_matrix`, so that association costs need to be computed for
+    these pairs only.
+    Parameters
+    ----------
+    tracks : List[track.Track]
+        A list of predicted tracks at the current time step.
+    detections : detection.DetectionBatch
+        The detections at the current time step.
+    track_indices : List[int]
+        List of N track indices.
+    detection_indices : List[int]
+        List of M detection indices.
+    only_position : Optional[bool]
+        If True, only the x, y position of the state distribution is considered
+        during gating. Defaults to False.
+    spatial_index : Optional[bool]
+        If True, only the candidates found by `gate_candidates` are tested
+        instead of all NxM pairs. Defaults to False.
+    Returns
+    -------
+    (ndarray, ndarray, ndarray)
+        Returns the positions of the pairs within the gate in `track_indices`
+        and `detection_indices`, sorted by track, and their squared
+        Mahalanobis distance.
+    """
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    gating_dim = 2 if only_position else 4
+    gating_threshold = kalman_filter.chi2inv95[gating_dim]
+    measurements = as_batch(detections).xyah[detection_indices]
+    store = tracks[track_indices[0]].store
+    slots = [tracks[i].slot for i in track_indices]
+    if spatial_index:
+        rows, cols = gate_candidates(
+            tracks, detections, track_indices, detection_indices, only_position)
+        gating_distance = store.gating_distance_pairs(
+            slots, measurements, rows, cols, only_position)
+        keep = gating_distance <= gating_threshold
+        return rows[keep], cols[keep], gating_distance[keep]
+    gating_distance = store.gating_distance(slots, measurements, only_position)
+    rows, cols = np.nonzero(gating_distance <= gating_threshold)
+    return rows, cols, gating_distance[rows, cols]
+
+
+def gated_pair_cost(
+        pair_metric, tracks, detections, track_indices, detection_indices,
+        only_position=False, spatial_index=False):
+    """Gate first version of `gate_cost_matrix`: the association cost is
+    only computed for the pairs within the gate (see `gate_pairs`) and is
+    blended with their gating distance like in `gate_cost_matrix`.
+    Parameters
+    ----------
+    pair_metric : Callable[ndarray, ndarray) -> ndarray
+        Given the positions of a set of pairs in `track_indices` and
+        `detection_indices`, returns their association costs, e.g.
+        `nn_matching.NearestNeighborDistanceMetric.distance_pairs`.
+    tracks : List[track.Track]
+        A list of predicted tracks at the current time step.
+    detections : detection.DetectionBatch
+        The detections at the current time step.
+    track_indices : List[int]
+        List of N track indices.
+    detection_indices : List[int]
+        List of M detection indices.
+    only_position : Optional[bool]
+        If True, only the x, y position of the state distribution is considered
+        during gating. Defaults to False.
+    spatial_index : Optional[bool]
+        If True, the pairs within the gate are found with a spatial index,
+        see `gate_pairs`.
+    Returns
+    -------
+    scipy.sparse.coo_matrix
+        Returns the NxM sparse cost matrix of the pairs within the gate.
+        Entries that are not stored are infeasible.
+    """
+    rows, cols, gating_distance = gate_pairs(
+        tracks, detections, track_indices, detection_indices, only_position,
+        spatial_index)
+    costs = pair_metric(rows, cols)
+    costs = 0.995 * costs + (1 - 0.995) * gating_distance
+    return coo_matrix(
+        (costs, (rows, cols)), shape=(len(track_indices), len(detection_indices)))
@@ -1,9 +1,5 @@
 # vim: expandtab:ts=4:sw=4
 import numpy as np
-import sys
-import torch
-sys.path.append('strong_sort/deep/reid')
-from torchreid.metrics.distance import compute_distance_matrix
 
 
 def _pdist(a, b):
@@ -66,10 +62,10 @@ def _nn_euclidean_distance(x, y):
         A vector of length M that contains for each entry in `y` the
         smallest Euclidean distance to a sample in `x`.
     """
-    x_ = torch.from_numpy(np.asarray(x) / np.linalg.norm(x, axis=1, keepdims=True))
-    y_ = torch.from_numpy(np.asarray(y) / np.linalg.norm(y, axis=1, keepdims=True))
-    distances = compute_distance_matrix(x_, y_, metric='euclidean')
-    return np.maximum(0.0, torch.min(distances, axis=0)[0].numpy())
+    x_ = np.asarray(x) / np.linalg.norm(x, axis=1, keepdims=True)
+    y_ = np.asarray(y) / np.linalg.norm(y, axis=1, keepdims=True)
+    distances = _pdist(x_, y_)
+    return np.maximum(0.0, distances.min(axis=0))
 
 
 def _nn_cosine_distance(x, y):
@@ -86,10 +82,7 @@ def _nn_cosine_distance(x, y):
         A vector of length M that contains for each entry in `y` the
         smallest cosine distance to a sample in `x`.
     """
-    x_ = torch.from_numpy(np.asarray(x))
-    y_ = torch.from_numpy(np.asarray(y))
-    distances = compute_distance_matrix(x_, y_, metric='cosine')
-    distances = distances.cpu().detach().numpy()
+    distances = _cosine_distance(x, y)
     return distances.min(axis=0)
 
 
@@ -97,6 +90,13 @@ class NearestNeighborDistanceMetric(object):
     """
     A nearest neighbor distance metric that, for each target, returns
     the closest distance to any sample that has been observed so far.
+
+    The samples live in one preallocated `(capacity, budget, dim)` float32
+    gallery. Each target owns a row of it, which is filled as a ring buffer,
+    and a validity mask marks the slots that hold a sample. Samples are stored
+    normalized, so that the distances of all requested targets are computed
+    by a single matrix product followed by a masked reduction.
+
     Parameters
     ----------
     metric : str
@@ -107,27 +107,100 @@ class NearestNeighborDistanceMetric(object):
     budget : Optional[int]
         If not None, fix samples per class to at most this number. Removes
         the oldest samples when the budget is reached.
+    capacity : int
+        Number of preallocated target rows. The gallery is grown by doubling
+        when more targets are active.
+
     Attributes
     ----------
-    samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+    gallery : ndarray
+        The `(capacity, budget, dim)` array of normalized samples, or None
+        before the first sample has been added.
+    valid : ndarray
+        A `(capacity, budget)` boolean array that is True for the gallery
+        entries that hold a sample.
+    rows : Dict[int -> int]
+        A dictionary that maps from target identities to their gallery row.
+
     """
 
-    def __init__(self, metric, matching_threshold, budget=None):
+    def __init__(self, metric, matching_threshold, budget=None, capacity=64):
         if metric == "euclidean":
-            self._metric = _nn_euclidean_distance
+            # squared Euclidean distance between unit vectors
+            self._metric = lambda similarity: np.maximum(0., 2. - 2. * similarity)
         elif metric == "cosine":
-            self._metric = _nn_cosine_distance
+            self._metric = lambda similarity: 1. - similarity
         else:
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
         self.matching_threshold = matching_threshold
         self.budget = budget
-        self.samples = {}
+        self.gallery = None
+        self.valid = np.zeros((capacity, budget or 1), dtype=bool)
+        self.rows = {}
+        self._cursor = np.zeros(capacity, dtype=np.int64)
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def _grow(self, capacity, width):
+        # Reallocate the gallery with at least `capacity` rows and `width`
+        # samples per row
+        old_capacity, old_width = self.valid.shape
+        valid = np.zeros((capacity, width), dtype=bool)
+        valid[:old_capacity, :old_width] = self.valid
+        self.valid = valid
+        if self.gallery is not None:
+            gallery = np.zeros((capacity, width, self.gallery.shape[2]), dtype=np.float32)
+            gallery[:old_capacity, :old_width] = self.gallery
+            self.gallery = gallery
+        if capacity > old_capacity:
+            self._cursor = np.r_[self._cursor, np.zeros(capacity - old_capacity, dtype=np.int64)]
+            self._free = list(range(capacity - 1, old_capacity - 1, -1)) + self._free
+
+    def _row(self, target):
+        row = self.rows.get(target)
+        if row is None:
+            if not self._free:
+                self._grow(2 * len(self.valid), self.valid.shape[1])
+            row = self.rows[target] = self._free.pop()
+        return row
+
+    def add(self, target, feature):
+        """Add a sample of a target to the gallery.
+
+        Parameters
+        ----------
+        target : int
+            The target identity, i.e. the track id.
+        feature : ndarray
+            A feature vector of dimensionality M.
+        """
+        feature = np.asarray(feature, dtype=np.float32)
+        if self.gallery is None:
+            self.gallery = np.zeros(self.valid.shape + feature.shape, dtype=np.float32)
+        row = self._row(target)
+        width = self.valid.shape[1]
+        slot = self._cursor[row]
+        if slot == width:  # no budget, the row is full
+            self._grow(len(self.valid), 2 * width)
+        self.gallery[row, slot] = feature / np.linalg.norm(feature)
+        self.valid[row, slot] = True
+        self._cursor[row] = (slot + 1) % self.budget if self.budget else slot + 1
+
+    def evict(self, target):
+        """Remove all samples of a target from the gallery. Does nothing if
+        the target has no samples.
+        """
+        row = self.rows.pop(target, None)
+        if row is None:
+            return
+        self.valid[row] = False
+        self._cursor[row] = 0
+        self._free.append(row)
 
     def partial_fit(self, features, targets, active_targets):
-        """Update the distance metric with new data.
+        """Update the distance metric with new data. Every target that is not
+        in `active_targets` is evicted, so this touches all targets; use `add`
+        and `evict` to update only the targets that changed.
         Parameters
         ----------
         features : ndarray
@@ -137,11 +210,12 @@ class NearestNeighborDistanceMetric(object):
         active_targets : List[int]
             A list of targets that are currently present in the scene.
         """
+        active_targets = set(active_targets)
+        for target in [t for t in self.rows if t not in active_targets]:
+            self.evict(target)
         for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+            if target in active_targets:
+                self.add(target, feature)
 
     def distance(self, features, targets):
         """Compute distance between features and targets.
@@ -158,7 +232,61 @@ class NearestNeighborDistanceMetric(object):
             element (i, j) contains the closest squared distance between
             `targets[i]` and `features[j]`.
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
-        return cost_matrix
\ No newline at end of file
+        if len(targets) == 0 or len(features) == 0:
+            return np.zeros((len(targets), len(features)))
+        features = np.asarray(features, dtype=np.float32)
+        features = features / np.linalg.norm(features, axis=1, keepdims=True)
+        rows = np.fromiter((self.rows[t] for t in targets), dtype=np.int64, count=len(targets))
+        valid = self.valid[rows]
+        # only the columns that have been written to by any requested target
+        width = len(valid[0]) - np.argmax(valid.any(axis=0)[::-1])
+        valid = valid[:, :width]
+        end = rows.max() + 1
+        dense = 2 * len(rows) >= end
+        # for dense requests, multiply the gallery without gathering its rows
+        # first and pick them from the result
+        samples = self.gallery[:end, :width] if dense else self.gallery[rows, :width]
+        similarity = np.dot(samples.reshape(-1, samples.shape[2]), features.T).reshape(
+            len(samples), width, len(features))
+        if dense:
+            similarity = similarity[rows]
+        similarity[~valid] = -np.inf
+        return self._metric(similarity.max(axis=1)).astype(np.float64)
+
+    def distance_pairs(self, features, targets, rows, cols, chunk_size=1 << 22):
+        """Compute the entries (rows, cols) of `distance` only, e.g. for a
+        sparse set of candidate pairs.
+        Parameters
+        ----------
+        features : ndarray
+            An NxM matrix of N features of dimensionality M.
+        targets : List[int]
+            A list of targets to match the given `features` against.
+        rows : ndarray
+            The target of each pair, as index into `targets`.
+        cols : ndarray
+            The feature of each pair, as index into `features`.
+        chunk_size : int
+            Maximum number of gallery values gathered at once.
+        Returns
+        -------
+        ndarray
+            Returns an array whose i-th element contains the closest distance
+            between `targets[rows[i]]` and `features[cols[i]]`.
+        """
+        distances = np.zeros(len(rows))
+        if len(rows) == 0:
+            return distances
+        features = np.asarray(features, dtype=np.float32)
+        features = features / np.linalg.norm(features, axis=1, keepdims=True)
+        target_rows = np.fromiter((self.rows[t] for t in targets), dtype=np.int64, count=len(targets))
+        gallery_rows = target_rows[rows]
+        valid = self.valid[target_rows]
+        width = len(valid[0]) - np.argmax(valid.any(axis=0)[::-1])
+        step = max(1, chunk_size // (width * features.shape[1]))
+        for i in range(0, len(rows), step):
+            samples = self.gallery[gallery_rows[i:i + step], :width]
+            similarity = np.matmul(samples, features[cols[i:i + step], :, None])[:, :, 0]
+            similarity[~self.valid[gallery_rows[i:i + step], :width]] = -np.inf
+            distances[i:i + step] = self._metric(similarity.max(axis=1))
+        return distances
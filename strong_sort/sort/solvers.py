@@ -0,0 +1,250 @@
+# vim: expandtab:ts=4:sw=4
+"""
+Linear assignment solvers used by `linear_assignment.min_cost_matching`.
+
+A solver is a callable `solver(cost_matrix, max_distance)` that returns the
+row and column indices of an assignment, like
+`scipy.optimize.linear_sum_assignment`. Entries above `max_distance` are
+infeasible; a solver may leave their rows and columns unassigned, and the
+caller drops any pair above `max_distance` that it returns.
+"""
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+def hungarian(cost_matrix, max_distance):
+    """Exact minimum cost assignment (shortest augmenting path / JV, as
+    implemented by `scipy.optimize.linear_sum_assignment`)."""
+    return linear_sum_assignment(cost_matrix)
+
+
+def greedy(cost_matrix, max_distance):
+    """Greedy assignment by increasing cost.
+
+    Pairs that are each other's cheapest feasible option are matched in
+    rounds, which yields the same matching as repeatedly taking the globally
+    cheapest remaining pair, but needs only a few vectorized passes over the
+    matrix.
+    """
+    cost = np.where(cost_matrix <= max_distance, cost_matrix, np.inf)
+    n_rows, n_cols = cost.shape
+    row_indices, col_indices = [], []
+    rows, cols = np.arange(n_rows), np.arange(n_cols)
+    while len(rows) and len(cols):
+        sub = cost[np.ix_(rows, cols)]
+        best_col = sub.argmin(axis=1)
+        best_row = sub.argmin(axis=0)
+        mutual = np.logical_and(
+            best_row[best_col] == np.arange(len(rows)),
+            np.isfinite(sub[np.arange(len(rows)), best_col]))
+        if not mutual.any():
+            break
+        row_indices.append(rows[mutual])
+        col_indices.append(cols[best_col[mutual]])
+        keep_cols = np.ones(len(cols), dtype=bool)
+        keep_cols[best_col[mutual]] = False
+        rows, cols = rows[~mutual], cols[keep_cols]
+    if not row_indices:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    row_indices, col_indices = np.concatenate(row_indices), np.concatenate(col_indices)
+    order = np.argsort(row_indices)
+    return row_indices[order], col_indices[order]
+
+
+def auction(cost_matrix, max_distance, eps=None, max_iter=100000):
+    """Approximate minimum cost assignment by the auction algorithm with
+    Jacobi (simultaneous) bidding, on the feasible pairs only.
+
+    Rows bid for columns. A feasible pair is worth `max_distance - cost`
+    and every row may also stay unassigned, which is worth nothing, so that
+    the result maximizes the same objective as the exact solver on a gated
+    matrix. The total cost is within `n * eps` of the optimum.
+
+    Parameters
+    ----------
+    eps : Optional[float]
+        Bidding increment. Defaults to `max_distance / (4 * n)`.
+    max_iter : int
+        Maximum number of bidding rounds.
+    """
+    n, m = cost_matrix.shape
+    rows, cols = np.nonzero(cost_matrix <= max_distance)
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # strictly positive, so that a feasible pair is preferred to no pair
+    benefit = max_distance + 1e-5 - cost_matrix[rows, cols]
+    indptr = np.searchsorted(rows, np.arange(n + 1))
+    if eps is None:
+        eps = max_distance / (4. * n)
+
+    prices = np.zeros(m)
+    owner = np.full(m, -1, dtype=np.int64)
+    assigned = np.full(n, -1, dtype=np.int64)
+    bidders = np.flatnonzero(np.diff(indptr) > 0)
+    for _ in range(max_iter):
+        if len(bidders) == 0:
+            break
+        # the feasible pairs of all bidders, grouped by bidder
+        lengths = indptr[bidders + 1] - indptr[bidders]
+        segment = np.repeat(np.arange(len(bidders)), lengths)
+        edges = np.arange(len(segment)) - np.repeat(np.cumsum(lengths) - lengths, lengths) \
+            + np.repeat(indptr[bidders], lengths)
+        values = benefit[edges] - prices[cols[edges]]
+
+        # best and second best value of every bidder, staying unassigned
+        # is worth 0
+        order = np.lexsort((-values, segment))
+        values, edges = values[order], edges[order]
+        starts = np.cumsum(lengths) - lengths
+        best, best_edge = values[starts], edges[starts]
+        second = np.zeros(len(bidders))
+        has_second = lengths > 1
+        second[has_second] = np.maximum(0., values[starts[has_second] + 1])
+
+        # bidders without a positive value stay unassigned
+        bidding = best > 0
+        if not bidding.any():
+            break
+        bidder, objects = bidders[bidding], cols[best_edge[bidding]]
+        bids = prices[objects] + best[bidding] - second[bidding] + eps
+
+        # every object goes to its highest bidder
+        order = np.lexsort((-bids, objects))
+        objects, bids, bidder = objects[order], bids[order], bidder[order]
+        winner = np.r_[True, objects[1:] != objects[:-1]]
+        objects, bids, bidder = objects[winner], bids[winner], bidder[winner]
+        prices[objects] = bids
+        outbid = owner[objects]
+        outbid = outbid[outbid >= 0]
+        assigned[outbid] = -1
+        owner[objects] = bidder
+        assigned[bidder] = objects
+        lost = np.setdiff1d(bidders[bidding], bidder, assume_unique=True)
+        bidders = np.union1d(lost, outbid)
+
+    rows = np.flatnonzero(assigned >= 0)
+    return rows, assigned[rows]
+
+
+class AutoSolver(object):
+    """
+    Picks a solver for every assignment problem from its size and density,
+    i.e. the fraction of feasible pairs. `min_cost_matching` calls the solver
+    once per connected component of the feasible pairs, so the thresholds
+    apply to the size and density of a component, not of the whole cost
+    matrix of an association stage.
+
+    Problems with at most `exact_size` rows and columns are solved exactly.
+    Larger ones are solved by auction if they are sparse, since its work
+    grows with the number of feasible pairs, and greedily if they are dense,
+    where the exact solver shows up as a latency spike. Larger problems in
+    between are still solved exactly.
+
+    Parameters
+    ----------
+    exact_size : int
+        Problems with at most this many rows and columns are solved exactly.
+    sparse_density : float
+        Larger problems with at most this density are solved by auction.
+    dense_density : float
+        Larger problems with at least this density are solved greedily.
+
+    """
+
+    def __init__(self, exact_size=500, sparse_density=0.01, dense_density=0.2):
+        self.exact_size = exact_size
+        self.sparse_density = sparse_density
+        self.dense_density = dense_density
+
+    def select(self, cost_matrix, max_distance):
+        """Return the solver used for a cost matrix."""
+        if max(cost_matrix.shape) <= self.exact_size:
+            return hungarian
+        density = np.mean(cost_matrix <= max_distance)
+        if density <= self.sparse_density:
+            return auction
+        if density >= self.dense_density:
+            return greedy
+        return hungarian
+
+    def __call__(self, cost_matrix, max_distance):
+        return self.select(cost_matrix, max_distance)(cost_matrix, max_distance)
+
+
+class CostRecorder(object):
+    """
+    Wraps a solver and keeps a copy of the assignment problems of a real
+    sequence, so that the solvers can be benchmarked on them. Two kinds of
+    problems are recorded:
+
+    * 'full': the whole gated cost matrix of an association stage, before
+      `min_cost_matching` splits it into connected components, given to
+      `observe`.
+    * 'component': every component matrix the solver is called on.
+
+    Parameters
+    ----------
+    solver : Callable[[ndarray, float], (ndarray, ndarray)]
+        The solver that is used for the assignment.
+
+    Attributes
+    ----------
+    problems : List[(ndarray, float, str)]
+        The recorded cost matrices, their `max_distance` and their kind.
+
+    """
+
+    def __init__(self, solver):
+        self.solver = solver
+        self.problems = []
+
+    def observe(self, rows, cols, costs, shape, max_distance):
+        """Record the full problem of an association stage, given by its
+        feasible pairs `rows, cols` with cost `costs` in a matrix of
+        `shape`. Infeasible entries are set just above `max_distance`."""
+        cost_matrix = np.full(shape, max_distance + 1e-5)
+        cost_matrix[rows, cols] = costs
+        self.problems.append((cost_matrix, float(max_distance), 'full'))
+
+    def __call__(self, cost_matrix, max_distance):
+        self.problems.append((cost_matrix.copy(), float(max_distance), 'component'))
+        return self.solver(cost_matrix, max_distance)
+
+    def save(self, path):
+        """Save the recorded problems to a `.npz` file."""
+        np.savez_compressed(
+            path, max_distance=np.array([d for _, d, _ in self.problems]),
+            kind=np.array([k for _, _, k in self.problems], dtype=str),
+            **{'cost_%d' % i: c for i, (c, _, _) in enumerate(self.problems)})
+
+
+def load_cost_matrices(path, kind=None):
+    """Load the problems saved by `CostRecorder.save` as a list of
+    `(cost_matrix, max_distance)` tuples, only those of `kind` ('full' or
+    'component') if given. Files recorded before the kinds were introduced
+    only hold component problems."""
+    data = np.load(path)
+    kinds = data['kind'] if 'kind' in data else ['component'] * len(data['max_distance'])
+    return [(data['cost_%d' % i], float(d)) for i, (d, k) in enumerate(zip(data['max_distance'], kinds))
+            if kind is None or k == kind]
+
+
+SOLVERS = {
+    'hungarian': hungarian,
+    'auction': auction,
+    'greedy': greedy,
+}
+
+
+def build_solver(method='auto', **kwargs):
+    """Create the assignment solver registered as `method` in `SOLVERS`, or
+    an `AutoSolver` for 'auto'. Keyword arguments configure the
+    `AutoSolver`; those set to None use its default.
+    """
+    if method == 'auto':
+        return AutoSolver(**{k: v for k, v in kwargs.items() if v is not None})
+    if method not in SOLVERS:
+        raise ValueError(
+            "Invalid assignment solver; must be one of %s"
+            % ", ".join(sorted(SOLVERS) + ['auto']))
+    return SOLVERS[method]
@@ -0,0 +1,156 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+
+
+# Offset that makes cell coordinates non-negative when they are packed into
+# one int64 key per cell.
+_KEY_OFFSET = 1 << 30
+
+
+def _cell_keys(x, y):
+    return (x + _KEY_OFFSET) * (2 * _KEY_OFFSET) + (y + _KEY_OFFSET)
+
+
+def _covered_cells(lo, hi):
+    """Enumerate the grid cells covered by a set of rectangles.
+
+    Parameters
+    ----------
+    lo : ndarray
+        An Nx2 integer array of the first covered cell of each rectangle.
+    hi : ndarray
+        An Nx2 integer array of the last covered cell of each rectangle.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        The index of the rectangle and the key of every covered cell.
+
+    """
+    nx, ny = hi[:, 0] - lo[:, 0] + 1, hi[:, 1] - lo[:, 1] + 1
+    count = nx * ny
+    item = np.repeat(np.arange(len(lo)), count)
+    k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    x = lo[item, 0] + k // ny[item]
+    y = lo[item, 1] + k % ny[item]
+    return item, _cell_keys(x, y)
+
+
+def _overlap(a, b):
+    # Whether rectangles a and b overlap, broadcasting over leading axes
+    return ((a[..., 0] <= b[..., 2]) & (b[..., 0] <= a[..., 2])
+            & (a[..., 1] <= b[..., 3]) & (b[..., 1] <= a[..., 3]))
+
+
+class GridIndex(object):
+    """
+    A uniform grid spatial hash over a set of axis-aligned rectangles, which
+    finds the rectangles that overlap a set of query rectangles without
+    comparing all pairs.
+
+    Every rectangle is registered in the grid cells it overlaps, and a query
+    is only compared with the rectangles registered in the cells it overlaps,
+    so that the work grows with the number of nearby pairs instead of the
+    product of both set sizes. Rectangles that would cover more than
+    `max_cells` cells, e.g. the gates of tracks that have been lost for a
+    while, are compared with every query instead. The index is meant to be
+    rebuilt every frame.
+
+    Parameters
+    ----------
+    boxes : ndarray
+        An Nx4 array of rectangles in format `(min x, min y, max x, max y)`.
+    cell_size : Optional[float]
+        Edge length of the grid cells, in pixels. Defaults to the median of
+        the larger side of the rectangles, but at least one pixel.
+    max_cells : int
+        Maximum number of cells a rectangle is registered in.
+
+    Attributes
+    ----------
+    boxes : ndarray
+        The Nx4 array of indexed rectangles.
+    cell_size : float
+        Edge length of the grid cells.
+
+    """
+
+    def __init__(self, boxes, cell_size=None, max_cells=16):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if cell_size is None:
+            sides = np.maximum(self.boxes[:, 2] - self.boxes[:, 0], self.boxes[:, 3] - self.boxes[:, 1])
+            cell_size = np.median(sides) if len(sides) else 1.
+        self.cell_size = max(float(cell_size), 1.)
+        self.max_cells = max_cells
+
+        lo, hi, large = self._cells(self.boxes)
+        self._lo = lo
+        self._large = np.flatnonzero(large)
+        small = np.flatnonzero(~large)
+        item, keys = _covered_cells(lo[small], hi[small])
+        order = np.argsort(keys, kind='stable')
+        self._keys, self._items = keys[order], small[item[order]]
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _cells(self, boxes):
+        # First and last covered cell of each rectangle, and whether it
+        # covers more than `max_cells` cells
+        lo = np.floor(boxes[:, :2] / self.cell_size).astype(np.int64)
+        hi = np.floor(boxes[:, 2:] / self.cell_size).astype(np.int64)
+        count = np.prod(hi - lo + 1, axis=1)
+        return lo, hi, count > self.max_cells
+
+    def query(self, boxes):
+        """Find all pairs of indexed and query rectangles that overlap.
+
+        Parameters
+        ----------
+        boxes : ndarray
+            An Mx4 array of query rectangles in format `(min x, min y, max x,
+            max y)`. Points are rectangles of zero size.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            The indices of the overlapping pairs into the indexed rectangles
+            and into `boxes`, sorted by indexed rectangle and query, each pair
+            once.
+
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        n, m = len(self.boxes), len(boxes)
+        if n == 0 or m == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        lo, hi, large = self._cells(boxes)
+        small = np.flatnonzero(~large)
+        query, keys = _covered_cells(lo[small], hi[small])
+        start = np.searchsorted(self._keys, keys, side='left')
+        count = np.searchsorted(self._keys, keys, side='right') - start
+        # every small indexed rectangle registered in a cell a small query
+        # covers. Overlapping rectangles share the cell of the top left corner
+        # of their intersection, only the pair found in that cell is kept.
+        offset = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        rows = self._items[np.repeat(start, count) + offset]
+        cols = small[np.repeat(query, count)]
+        corner = np.maximum(self._lo[rows], lo[cols])
+        keep = np.logical_and(
+            _cell_keys(corner[:, 0], corner[:, 1]) == np.repeat(keys, count),
+            _overlap(self.boxes[rows], boxes[cols]))
+        rows, cols = [rows[keep]], [cols[keep]]
+        # large rectangles on either side are compared with everything
+        if len(self._large):
+            r, c = np.nonzero(_overlap(self.boxes[self._large, None], boxes[None]))
+            rows.append(self._large[r])
+            cols.append(c)
+        large = np.flatnonzero(large)
+        if len(large):
+            small_items = np.setdiff1d(np.arange(n), self._large, assume_unique=True)
+            r, c = np.nonzero(_overlap(self.boxes[small_items, None], boxes[None, large]))
+            rows.append(small_items[r])
+            cols.append(large[c])
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        order = np.lexsort((cols, rows))
+        return rows[order], cols[order]
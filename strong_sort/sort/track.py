@@ -1,7 +1,7 @@
 # vim: expandtab:ts=4:sw=4
-import cv2
 import numpy as np
 from strong_sort.sort.kalman_filter import KalmanFilter
+from strong_sort.sort.track_store import TrackStore
 
 
 class TrackState:
@@ -27,12 +27,14 @@ class Track:
 
     Parameters
     ----------
-    mean : ndarray
-        Mean vector of the initial state distribution.
-    covariance : ndarray
-        Covariance matrix of the initial state distribution.
+    detection : ndarray
+        The initial measurement in format `(x, y, a, h)`.
     track_id : int
         A unique track identifier.
+    class_id : int
+        The detected class.
+    conf : float
+        The detector confidence score.
     n_init : int
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
@@ -43,13 +45,27 @@ class Track:
     feature : Optional[ndarray]
         Feature vector of the detection this track originates from. If not None,
         this feature is added to the `features` cache.
+    store : Optional[TrackStore]
+        The store that holds the Kalman filter state of this track. If None, the
+        track keeps its state in a store of its own.
+    slot : Optional[int]
+        The row of `store` that already holds the initial state of this track,
+        e.g. when the states of several new tracks have been initiated in
+        batch. If None, the state is initiated from `detection`.
 
     Attributes
     ----------
     mean : ndarray
-        Mean vector of the initial state distribution.
+        Mean vector of the current state distribution, a view into `store`.
     covariance : ndarray
-        Covariance matrix of the initial state distribution.
+        Covariance matrix of the current state distribution, a view into
+        `store`.
+    kf : kalman_filter.KalmanFilter
+        The Kalman filter of `store`, shared by all tracks of a tracker.
+    store : TrackStore
+        The store that holds the Kalman filter state of this track.
+    slot : int
+        The row of `store` that holds the state of this track.
     track_id : int
         A unique track identifier.
     hits : int
@@ -63,11 +79,18 @@ class Track:
     features : List[ndarray]
         A cache of features. On each measurement update, the associated feature
         vector is added to this list.
+    feature_age : int
+        Number of measurement updates since the last one that came with an
+        appearance feature.
 
     """
 
+    __slots__ = (
+        'track_id', 'class_id', 'hits', 'age', 'time_since_update', 'ema_alpha', 'state',
+        'features', 'feature_age', 'conf', '_n_init', '_max_age', 'kf', 'store', 'slot')
+
     def __init__(self, detection, track_id, class_id, conf, n_init, max_age, ema_alpha,
-                 feature=None):
+                 feature=None, store=None, slot=None):
         self.track_id = track_id
         self.class_id = int(class_id)
         self.hits = 1
@@ -77,16 +100,35 @@ class Track:
 
         self.state = TrackState.Tentative
         self.features = []
+        self.feature_age = 0
         if feature is not None:
-            feature /= np.linalg.norm(feature)
-            self.features.append(feature)
+            self.features.append(feature / np.linalg.norm(feature))
 
-        self.conf = conf
+        self.conf = float(conf)
         self._n_init = n_init
         self._max_age = max_age
 
-        self.kf = KalmanFilter()
-        self.mean, self.covariance = self.kf.initiate(detection)
+        if store is None:
+            store = TrackStore(KalmanFilter(), capacity=1)
+        self.kf = store.kf
+        self.store = store
+        self.slot = store.add(*self.kf.initiate(detection)) if slot is None else slot
+
+    @property
+    def mean(self):
+        return self.store.mean[self.slot]
+
+    @mean.setter
+    def mean(self, value):
+        self.store.mean[self.slot] = value
+
+    @property
+    def covariance(self):
+        return self.store.covariance[self.slot]
+
+    @covariance.setter
+    def covariance(self, value):
+        self.store.covariance[self.slot] = value
 
     def to_tlwh(self):
         """Get current position in bounding box format `(top left x, top left y,
@@ -117,128 +159,6 @@ class Track:
         ret[2:] = ret[:2] + ret[2:]
         return ret
 
-
-    def ECC(self, src, dst, warp_mode = cv2.MOTION_EUCLIDEAN, eps = 1e-5,
-        max_iter = 100, scale = 0.1, align = False):
-        """Compute the warp matrix from src to dst.
-        Parameters
-        ----------
-        src : ndarray 
-            An NxM matrix of source img(BGR or Gray), it must be the same format as dst.
-        dst : ndarray
-            An NxM matrix of target img(BGR or Gray).
-        warp_mode: flags of opencv
-            translation: cv2.MOTION_TRANSLATION
-            rotated and shifted: cv2.MOTION_EUCLIDEAN
-            affine(shift,rotated,shear): cv2.MOTION_AFFINE
-            homography(3d): cv2.MOTION_HOMOGRAPHY
-        eps: float
-            the threshold of the increment in the correlation coefficient between two iterations
-        max_iter: int
-            the number of iterations.
-        scale: float or [int, int]
-            scale_ratio: float
-            scale_size: [W, H]
-        align: bool
-            whether to warp affine or perspective transforms to the source image
-        Returns
-        -------
-        warp matrix : ndarray
-            Returns the warp matrix from src to dst.
-            if motion models is homography, the warp matrix will be 3x3, otherwise 2x3
-        src_aligned: ndarray
-            aligned source image of gray
-        """
-        assert src.shape == dst.shape, "the source image must be the same format to the target image!"
-        
-        if src.any() or dst.any() is None: 
-            return None, None
-
-        # BGR2GRAY
-        if src.ndim == 3:
-            # Convert images to grayscale
-            src = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
-            dst = cv2.cvtColor(dst, cv2.COLOR_BGR2GRAY)
-
-        # make the imgs smaller to speed up
-        if scale is not None:
-            if isinstance(scale, float) or isinstance(scale, int):
-                if scale != 1:
-                    src_r = cv2.resize(src, (0, 0), fx = scale, fy = scale,interpolation =  cv2.INTER_LINEAR)
-                    dst_r = cv2.resize(dst, (0, 0), fx = scale, fy = scale,interpolation =  cv2.INTER_LINEAR)
-                    scale = [scale, scale]
-                else:
-                    src_r, dst_r = src, dst
-                    scale = None
-            else:
-                if scale[0] != src.shape[1] and scale[1] != src.shape[0]:
-                    src_r = cv2.resize(src, (scale[0], scale[1]), interpolation = cv2.INTER_LINEAR)
-                    dst_r = cv2.resize(dst, (scale[0], scale[1]), interpolation=cv2.INTER_LINEAR)
-                    scale = [scale[0] / src.shape[1], scale[1] / src.shape[0]]
-                else:
-                    src_r, dst_r = src, dst
-                    scale = None
-        else:
-            src_r, dst_r = src, dst
-
-        # Define 2x3 or 3x3 matrices and initialize the matrix to identity
-        if warp_mode == cv2.MOTION_HOMOGRAPHY :
-            warp_matrix = np.eye(3, 3, dtype=np.float32)
-        else :
-            warp_matrix = np.eye(2, 3, dtype=np.float32)
-
-        # Define termination criteria
-        criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, max_iter, eps)
-
-        # Run the ECC algorithm. The results are stored in warp_matrix.
-        try:
-            (cc, warp_matrix) = cv2.findTransformECC (src_r, dst_r, warp_matrix, warp_mode, criteria, None, 1)
-        except cv2.error as e:
-            return None, None
-        
-
-        if scale is not None:
-            warp_matrix[0, 2] = warp_matrix[0, 2] / scale[0]
-            warp_matrix[1, 2] = warp_matrix[1, 2] / scale[1]
-
-        if align:
-            sz = src.shape
-            if warp_mode == cv2.MOTION_HOMOGRAPHY:
-                # Use warpPerspective for Homography
-                src_aligned = cv2.warpPerspective(src, warp_matrix, (sz[1],sz[0]), flags=cv2.INTER_LINEAR)
-            else :
-                # Use warpAffine for Translation, Euclidean and Affine
-                src_aligned = cv2.warpAffine(src, warp_matrix, (sz[1],sz[0]), flags=cv2.INTER_LINEAR)
-            return warp_matrix, src_aligned
-        else:
-            return warp_matrix, None
-
-
-    def get_matrix(self, matrix):
-        eye = np.eye(3)
-        dist = np.linalg.norm(eye - matrix)
-        if dist < 100:
-            return matrix
-        else:
-            return eye
-
-    def camera_update(self, previous_frame, next_frame):
-        warp_matrix, src_aligned = self.ECC(previous_frame, next_frame)
-        if warp_matrix is None and src_aligned is None:
-            return
-        [a,b] = warp_matrix
-        warp_matrix=np.array([a,b,[0,0,1]])
-        warp_matrix = warp_matrix.tolist()
-        matrix = self.get_matrix(warp_matrix)
-
-        x1, y1, x2, y2 = self.to_tlbr()
-        x1_, y1_, _ = matrix @ np.array([x1, y1, 1]).T
-        x2_, y2_, _ = matrix @ np.array([x2, y2, 1]).T
-        w, h = x2_ - x1_, y2_ - y1_
-        cx, cy = x1_ + w / 2, y1_ + h / 2
-        self.mean[:4] = [cx, cy, w / h, h]
-
-
     def increment_age(self):
         self.age += 1
         self.time_since_update += 1
@@ -265,15 +185,35 @@ class Track:
         detection : Detection
             The associated detection.
         """
-        self.conf = conf
-        self.class_id = class_id.int()
         self.mean, self.covariance = self.kf.update(self.mean, self.covariance, detection.to_xyah(), detection.confidence)
+        self.mark_hit(detection.feature, class_id, conf)
 
-        feature = detection.feature / np.linalg.norm(detection.feature)
+    def mark_hit(self, feature, class_id, conf):
+        """Update the feature cache and the track state after the Kalman state
+        has been corrected with the associated detection, e.g. by a batched
+        update of the `store`.
+        Parameters
+        ----------
+        feature : ndarray | NoneType
+            The feature vector of the associated detection, or None if it has
+            not been extracted.
+        """
+        self.conf = float(conf)
+        self.class_id = int(class_id)
+
+        if feature is None:
+            # matched on motion alone, keep the appearance of the last update
+            self.feature_age += 1
+        elif not self.features:
+            self.features = [feature / np.linalg.norm(feature)]
+            self.feature_age = 0
+        else:
+            feature = feature / np.linalg.norm(feature)
 
-        smooth_feat = self.ema_alpha * self.features[-1] + (1 - self.ema_alpha) * feature
-        smooth_feat /= np.linalg.norm(smooth_feat)
-        self.features = [smooth_feat]
+            smooth_feat = self.ema_alpha * self.features[-1] + (1 - self.ema_alpha) * feature
+            smooth_feat /= np.linalg.norm(smooth_feat)
+            self.features = [smooth_feat]
+            self.feature_age = 0
 
         self.hits += 1
         self.time_since_update = 0
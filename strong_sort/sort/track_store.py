@@ -0,0 +1,318 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+
+
+class TrackStore(object):
+    """
+    Struct-of-arrays storage for the Kalman filter states of a set of tracks.
+    The state of the track with slot `i` lives in row `i` of `mean` and
+    `covariance`; rows `0, ..., len(store) - 1` are in use. Prediction,
+    projection and correction run as batched operations over these rows.
+
+    Parameters
+    ----------
+    kf : kalman_filter.KalmanFilter
+        The Kalman filter used for the batched filter steps.
+    capacity : int
+        Number of preallocated rows. The arrays are grown by doubling when a
+        state is added to a full store.
+
+    Attributes
+    ----------
+    kf : kalman_filter.KalmanFilter
+        The Kalman filter used for the batched filter steps.
+    mean : ndarray
+        A (capacity, 8) array of state mean vectors.
+    covariance : ndarray
+        A (capacity, 8, 8) array of state covariance matrices.
+
+    """
+
+    def __init__(self, kf, capacity=64):
+        self.kf = kf
+        self.mean = np.zeros((capacity, 8))
+        self.covariance = np.zeros((capacity, 8, 8))
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _grow(self, capacity):
+        mean = np.zeros((capacity, 8))
+        covariance = np.zeros((capacity, 8, 8))
+        mean[:self._size] = self.mean[:self._size]
+        covariance[:self._size] = self.covariance[:self._size]
+        self.mean, self.covariance = mean, covariance
+
+    def add(self, mean, covariance):
+        """Append a state distribution to the store.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The 8 dimensional mean vector.
+        covariance : ndarray
+            The 8x8 dimensional covariance matrix.
+
+        Returns
+        -------
+        int
+            The slot the state has been stored in.
+
+        """
+        if self._size == len(self.mean):
+            self._grow(max(1, 2 * len(self.mean)))
+        slot = self._size
+        self.mean[slot] = mean
+        self.covariance[slot] = covariance
+        self._size += 1
+        return slot
+
+    def extend(self, mean, covariance):
+        """Append several state distributions to the store.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices.
+
+        Returns
+        -------
+        ndarray
+            The slots the states have been stored in.
+
+        """
+        n = len(mean)
+        if self._size + n > len(self.mean):
+            self._grow(max(self._size + n, 2 * len(self.mean)))
+        slots = np.arange(self._size, self._size + n)
+        self.mean[slots] = mean
+        self.covariance[slots] = covariance
+        self._size += n
+        return slots
+
+    def predict(self, slots=None, dt=1.):
+        """Run the Kalman filter prediction step on the given slots.
+
+        Parameters
+        ----------
+        slots : Optional[array_like]
+            Slots to propagate. Defaults to all slots in use.
+        dt : float
+            The time step in frames.
+
+        """
+        if slots is None:
+            slots = slice(0, self._size)
+        self.mean[slots], self.covariance[slots] = self.kf.multi_predict(
+            self.mean[slots], self.covariance[slots], dt)
+
+    def project(self, slots=None, confidence=.0):
+        """Project the states of the given slots to measurement space.
+
+        Parameters
+        ----------
+        slots : Optional[array_like]
+            Slots to project. Defaults to all slots in use.
+        confidence : float or ndarray
+            Detection confidence, either a scalar or one value per slot.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 projected covariance
+            matrices.
+
+        """
+        if slots is None:
+            slots = slice(0, self._size)
+        return self.kf.multi_project(
+            self.mean[slots], self.covariance[slots], confidence)
+
+    def to_tlwh(self, slots=None):
+        """Get the bounding boxes of the given slots in format `(top left x,
+        top left y, width, height)`.
+
+        Parameters
+        ----------
+        slots : Optional[array_like]
+            Slots to convert. Defaults to all slots in use.
+
+        Returns
+        -------
+        ndarray
+            An Nx4 array of bounding boxes.
+
+        """
+        if slots is None:
+            slots = slice(0, self._size)
+        ret = self.mean[slots, :4].copy()
+        ret[:, 2] *= ret[:, 3]
+        ret[:, :2] -= ret[:, 2:] / 2
+        return ret
+
+    def gating_distance(self, slots, measurements, only_position=False):
+        """Compute the squared Mahalanobis distances between the states of the
+        given slots and a set of measurements.
+
+        Parameters
+        ----------
+        slots : array_like
+            The T slots to compute distances for.
+        measurements : ndarray
+            A Dx4 dimensional matrix of (x, y, a, h) measurements.
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+
+        Returns
+        -------
+        ndarray
+            Returns a TxD matrix of squared Mahalanobis distances.
+
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        return self.kf.multi_gating_distance(
+            self.mean[slots], self.covariance[slots], measurements,
+            only_position)
+
+    def gating_distance_pairs(self, slots, measurements, rows, cols,
+                              only_position=False):
+        """Compute the entries (rows, cols) of `gating_distance` only.
+
+        Parameters
+        ----------
+        slots : array_like
+            The T slots to compute distances for.
+        measurements : ndarray
+            A Dx4 dimensional matrix of (x, y, a, h) measurements.
+        rows : ndarray
+            The position in `slots` of each pair.
+        cols : ndarray
+            The measurement of each pair.
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+
+        Returns
+        -------
+        ndarray
+            Returns the squared Mahalanobis distance of each pair.
+
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        return self.kf.gating_distance_pairs(
+            self.mean[slots], self.covariance[slots], measurements, rows, cols,
+            only_position)
+
+    def gate_boxes(self, slots, threshold):
+        """Compute rectangles that contain the center position of every
+        measurement within the gate of the given slots, i.e. with a squared
+        Mahalanobis distance of at most `threshold`, with or without
+        `only_position`: a gate is never wider than that of the x or y
+        marginal alone.
+
+        Parameters
+        ----------
+        slots : array_like
+            The T slots to compute rectangles for.
+        threshold : float
+            The gating threshold on the squared Mahalanobis distance.
+
+        Returns
+        -------
+        ndarray
+            A Tx4 array of rectangles in format `(min x, min y, max x, max y)`.
+
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        mean, covariance = self.project(slots)
+        half_size = np.sqrt(threshold * np.stack(
+            [covariance[:, 0, 0], covariance[:, 1, 1]], axis=1))
+        return np.c_[mean[:, :2] - half_size, mean[:, :2] + half_size]
+
+    def update(self, slots, measurements, confidences=.0):
+        """Run the Kalman filter correction step on the given slots.
+
+        Parameters
+        ----------
+        slots : array_like
+            Slots to correct, each slot at most once.
+        measurements : ndarray
+            An Nx4 dimensional matrix of (x, y, a, h) measurements, one row per
+            slot.
+        confidences : float or ndarray
+            Detection confidence, either a scalar or one value per slot.
+
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        if len(slots) == 0:
+            return
+        self.mean[slots], self.covariance[slots] = self.kf.multi_update(
+            self.mean[slots], self.covariance[slots], measurements, confidences)
+
+    def camera_update(self, matrix, slots=None):
+        """Apply a global camera motion to the states of the given slots.
+
+        The corners of each bounding box are mapped through `matrix`, and the
+        position part of the velocity and covariance is rotated by its linear
+        part.
+
+        Parameters
+        ----------
+        matrix : ndarray
+            A 3x3 affine matrix that maps image coordinates of the previous
+            frame to the current frame.
+        slots : Optional[array_like]
+            Slots to warp. Defaults to all slots in use.
+
+        """
+        if slots is None:
+            slots = slice(0, self._size)
+        matrix = np.asarray(matrix, dtype=np.float64)
+        R, t = matrix[:2, :2], matrix[:2, 2]
+        mean = self.mean[slots]
+
+        wh = np.c_[mean[:, 2] * mean[:, 3], mean[:, 3]]
+        tl = np.dot(mean[:, :2] - wh / 2, R.T) + t
+        br = np.dot(mean[:, :2] + wh / 2, R.T) + t
+        wh = br - tl
+        mean[:, :2] = tl + wh / 2
+        mean[:, 2] = wh[:, 0] / wh[:, 1]
+        mean[:, 3] = wh[:, 1]
+        mean[:, 4:6] = np.dot(mean[:, 4:6], R.T)
+
+        transform = np.eye(8)
+        transform[:2, :2] = R
+        transform[4:6, 4:6] = R
+        self.mean[slots] = mean
+        self.covariance[slots] = np.matmul(np.matmul(
+            transform, self.covariance[slots]), transform.T)
+
+    def compact(self, keep):
+        """Remove the states of dropped slots and close the gaps, preserving
+        the order of the remaining states.
+
+        Parameters
+        ----------
+        keep : ndarray
+            A boolean array of length `len(store)` that is True for the slots
+            to keep.
+
+        Returns
+        -------
+        ndarray
+            An integer array of length `len(store)` (before compaction) that
+            maps each old slot to its new slot, or -1 if it has been dropped.
+
+        """
+        keep = np.asarray(keep, dtype=bool)
+        remap = np.full(self._size, -1, dtype=np.int64)
+        n = int(keep.sum())
+        remap[keep] = np.arange(n)
+        self.mean[:n] = self.mean[:self._size][keep]
+        self.covariance[:n] = self.covariance[:self._size][keep]
+        self._size = n
+        return remap
@@ -4,12 +4,18 @@ import numpy as np
 from . import kalman_filter
 from . import linear_assignment
 from . import iou_matching
+from . import solvers
+from .cmc import ECC
+from .detection import as_batch
 from .track import Track
+from .track_store import TrackStore
 
 
 class Tracker:
     """
-    This is the multi-target tracker.
+    This is the multi-target tracker. It works on NumPy arrays only, inputs
+    from other frameworks have to be converted by the caller, once per frame
+    (see `StrongSORT.update`).
     Parameters
     ----------
     metric : nn_matching.NearestNeighborDistanceMetric
@@ -20,6 +26,24 @@ class Tracker:
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
         `n_init` frames.
+    cmc : Optional[cmc.CMC]
+        The camera motion compensation backend used by `camera_update`.
+        Defaults to `cmc.ECC`.
+    solver : str or Callable[ndarray, float) -> (ndarray, ndarray)
+        The linear assignment solver used by all association stages, either a
+        solver function or a name accepted by `solvers.build_solver`. Defaults
+        to picking a solver per problem (see `solvers.AutoSolver`).
+    spatial_index : bool
+        If True, tracks are only compared with the detections near their
+        predicted position, which are found with a `spatial_index.GridIndex`,
+        and the association stages build sparse cost matrices. This gives the
+        same associations without the memory and time of dense track by
+        detection matrices in scenes with many objects.
+    track_pool : bool
+        If True, the `Track` records of deleted tracks are reused for new
+        tracks, which saves allocations and garbage collections when many
+        short-lived tracks are created. Callers must then not keep references
+        to tracks that have been deleted.
     Attributes
     ----------
     metric : nn_matching.NearestNeighborDistanceMetric
@@ -29,13 +53,20 @@ class Tracker:
     n_init : int
         Number of frames that a track remains in initialization phase.
     kf : kalman_filter.KalmanFilter
-        A Kalman filter to filter target trajectories in image space.
+        A Kalman filter to filter target trajectories in image space, shared
+        by all tracks.
+    store : TrackStore
+        Contiguous storage of the Kalman filter states of all `tracks`, which
+        are propagated and corrected in batch.
+    solver : Callable[ndarray, float) -> (ndarray, ndarray)
+        The linear assignment solver.
     tracks : List[Track]
         The list of active tracks at the current time step.
     """
     GATING_THRESHOLD = np.sqrt(kalman_filter.chi2inv95[4])
 
-    def __init__(self, metric, max_iou_distance=0.9, max_age=30, n_init=3, _lambda=0, ema_alpha=0.9, mc_lambda=0.995):
+    def __init__(self, metric, max_iou_distance=0.9, max_age=30, n_init=3, _lambda=0, ema_alpha=0.9, mc_lambda=0.995,
+                 cmc=None, solver='auto', spatial_index=False, track_pool=True):
         self.metric = metric
         self.max_iou_distance = max_iou_distance
         self.max_age = max_age
@@ -45,58 +76,137 @@ class Tracker:
         self.mc_lambda = mc_lambda
 
         self.kf = kalman_filter.KalmanFilter()
+        self.store = TrackStore(self.kf)
+        self.cmc = cmc if cmc is not None else ECC()
+        self.solver = solvers.build_solver(solver) if isinstance(solver, str) else solver
+        self.spatial_index = spatial_index
+        self.track_pool = track_pool
         self.tracks = []
+        self._free_tracks = []
         self._next_id = 1
+        # unambiguous pairs found by `appearance_required`, with the detections
+        # they belong to, reused by `update` of the same step
+        self._unambiguous = None
 
-    def predict(self):
+    def predict(self, dt=1.):
         """Propagate track state distributions one time step forward.
 
         This function should be called once every time step, before `update`.
+
+        Parameters
+        ----------
+        dt : float
+            The time since the previous step in frames, e.g. the frame gap
+            when frames are dropped, or the gap between capture timestamps
+            divided by the nominal frame period.
         """
+        self._unambiguous = None
+        self.store.predict(dt=dt)
         for track in self.tracks:
-            track.predict(self.kf)
+            track.increment_age()
+
+    def coast(self, dt=1.):
+        """Propagate track state distributions by the motion model only, on
+        frames between two time steps that the detector does not run on. The
+        tracks do not age, so that track management counts detector frames
+        only; the following `predict` covers the time since the last call.
+
+        Parameters
+        ----------
+        dt : float
+            The time since the previous propagation in frames.
+        """
+        self._unambiguous = None
+        self.store.predict(dt=dt)
 
     def increment_ages(self):
         for track in self.tracks:
             track.increment_age()
             track.mark_missed()
 
-    def camera_update(self, previous_img, current_img):
-        for track in self.tracks:
-            track.camera_update(previous_img, current_img)
+    def camera_update(self, current_img):
+        """Compensate the camera motion between the previous frame, which is
+        cached by the camera motion compensation backend, and `current_img`.
+        The warp is estimated once and applied to all tracks.
+        """
+        matrix = self.cmc.apply(current_img, estimate=len(self.tracks) > 0)
+        self.apply_camera_motion(matrix)
+
+    def apply_camera_motion(self, matrix):
+        """Warp all tracks with a camera motion estimated by `self.cmc`, e.g.
+        on a background thread. Does nothing if `matrix` is None.
+        """
+        if matrix is not None:
+            self._unambiguous = None
+            self.store.camera_update(matrix)
 
-    def update(self, detections, classes, confidences):
+    def update(self, detections, classes=None, confidences=None):
         """Perform measurement update and track management.
 
         Parameters
         ----------
-        detections : List[deep_sort.detection.Detection]
-            A list of detections at the current time step.
+        detections : detection.DetectionBatch
+            The detections at the current time step, or a list of
+            `detection.Detection`.
+        classes : Optional[ndarray]
+            The class id of every detection. Defaults to
+            `detections.class_id`, or 0 if the batch has none.
+        confidences : Optional[ndarray]
+            The confidence score of every detection, which is stored with the
+            tracks. Defaults to `detections.confidence`.
 
         """
+        detections = as_batch(detections)
+        if classes is None:
+            classes = detections.class_id if detections.class_id is not None else np.zeros(len(detections))
+        if confidences is None:
+            confidences = detections.confidence
+        # plain Python numbers for the per-track bookkeeping
+        classes = np.asarray(classes).astype(np.int64).tolist()
+        confidences = np.asarray(confidences, dtype=np.float64).tolist()
         # Run matching cascade.
         matches, unmatched_tracks, unmatched_detections = \
             self._match(detections)
+        self._unambiguous = None
 
         # Update track set.
+        matched_detections = np.array([i for _, i in matches], dtype=np.int64)
+        self.store.update(
+            [self.tracks[track_idx].slot for track_idx, _ in matches],
+            detections.xyah[matched_detections], detections.confidence[matched_detections])
         for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(
-                detections[detection_idx], classes[detection_idx], confidences[detection_idx])
+            track = self.tracks[track_idx]
+            was_confirmed = track.is_confirmed()
+            feature = detections.feature(detection_idx)
+            track.mark_hit(feature, classes[detection_idx], confidences[detection_idx])
+            # Update distance metric with the appearance of tracks that have
+            # just been confirmed or matched with a new feature.
+            if track.is_confirmed() and (not was_confirmed or feature is not None):
+                self.metric.add(track.track_id, track.features[-1])
         for track_idx in unmatched_tracks:
             self.tracks[track_idx].mark_missed()
-        for detection_idx in unmatched_detections:
-            self._initiate_track(detections[detection_idx], classes[detection_idx].item(), confidences[detection_idx].item())
-        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+        if unmatched_detections:
+            # initiate the Kalman states of all new tracks in one step
+            slots = self.store.extend(*self.kf.multi_initiate(detections.xyah[unmatched_detections]))
+            for detection_idx, slot in zip(unmatched_detections, slots.tolist()):
+                self._initiate_track(
+                    detections.xyah[detection_idx], detections.feature(detection_idx),
+                    classes[detection_idx], confidences[detection_idx], slot)
+        self._remove_deleted_tracks()
 
-        # Update distance metric.
-        active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
-        features, targets = [], []
+    def _remove_deleted_tracks(self):
+        for track in self.tracks:
+            if track.is_deleted():
+                self.metric.evict(track.track_id)
+                if self.track_pool:
+                    track.features = None
+                    self._free_tracks.append(track)
+        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+        keep = np.zeros(len(self.store), dtype=bool)
+        keep[[t.slot for t in self.tracks]] = True
+        remap = self.store.compact(keep)
         for track in self.tracks:
-            if not track.is_confirmed():
-                continue
-            features += track.features
-            targets += [track.track_id for _ in track.features]
-        self.metric.partial_fit(np.asarray(features), np.asarray(targets), active_targets)
+            track.slot = remap[track.slot]
 
     def _full_cost_metric(self, tracks, dets, track_indices, detection_indices):
         """
@@ -111,18 +221,16 @@ class Tracker:
         is more intuitive in terms of values.
         """
         # Compute First the Position-based Cost Matrix
-        pos_cost = np.empty([len(track_indices), len(detection_indices)])
-        msrs = np.asarray([dets[i].to_xyah() for i in detection_indices])
-        for row, track_idx in enumerate(track_indices):
-            pos_cost[row, :] = np.sqrt(
-                self.kf.gating_distance(
-                    tracks[track_idx].mean, tracks[track_idx].covariance, msrs, False
-                )
-            ) / self.GATING_THRESHOLD
+        msrs = dets.xyah[detection_indices]
+        pos_cost = np.sqrt(
+            self.store.gating_distance(
+                [tracks[i].slot for i in track_indices], msrs, False
+            )
+        ) / self.GATING_THRESHOLD
         pos_gate = pos_cost > 1.0
         # Now Compute the Appearance-based Cost Matrix
         app_cost = self.metric.distance(
-            np.array([dets[i].feature for i in detection_indices]),
+            dets.features[detection_indices],
             np.array([tracks[i].track_id for i in track_indices]),
         )
         app_gate = app_cost > self.metric.matching_threshold
@@ -132,27 +240,125 @@ class Tracker:
         # Return Matrix
         return cost_matrix
 
+    def _motion_candidates(self, detections):
+        """Find the track/detection pairs that are feasible by motion alone:
+        confirmed tracks within the Mahalanobis gate, and tracks of the IOU
+        matching stage within `max_iou_distance`. Returns the track and
+        detection indices of the pairs, sorted by track.
+        """
+        n_tracks, n_detections = len(self.tracks), len(detections)
+        if n_tracks == 0 or n_detections == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        confirmed = [i for i, t in enumerate(self.tracks) if t.is_confirmed()]
+        iou_track_candidates = [
+            i for i, t in enumerate(self.tracks)
+            if not t.is_confirmed() or t.time_since_update == 1]
+        track_idx, detection_idx = [], []
+        if confirmed:
+            rows, cols, _ = linear_assignment.gate_pairs(
+                self.tracks, detections, confirmed, list(range(n_detections)),
+                spatial_index=self.spatial_index)
+            track_idx.append(np.asarray(confirmed)[rows])
+            detection_idx.append(cols)
+        if iou_track_candidates:
+            if self.spatial_index:
+                iou_cost = iou_matching.sparse_iou_cost(self.tracks, detections, iou_track_candidates)
+                keep = iou_cost.data <= self.max_iou_distance
+                rows, cols = iou_cost.row[keep], iou_cost.col[keep]
+            else:
+                iou_cost = iou_matching.iou_cost(self.tracks, detections, iou_track_candidates)
+                rows, cols = np.nonzero(iou_cost <= self.max_iou_distance)
+            track_idx.append(np.asarray(iou_track_candidates)[rows])
+            detection_idx.append(cols.astype(np.int64))
+        pairs = np.unique(np.concatenate(track_idx) * n_detections + np.concatenate(detection_idx))
+        return pairs // n_detections, pairs % n_detections
+
+    def _unambiguous_pairs(self, candidates, n_detections):
+        """Return the (track, detection) index pairs of `_motion_candidates`
+        that are each other's only motion-feasible candidate."""
+        track_idx, detection_idx = candidates
+        unique = np.logical_and(
+            np.bincount(track_idx, minlength=len(self.tracks))[track_idx] == 1,
+            np.bincount(detection_idx, minlength=n_detections)[detection_idx] == 1)
+        return track_idx[unique], detection_idx[unique]
+
+    def appearance_required(self, detections, refresh_interval=1):
+        """Decide for which detections an appearance feature has to be
+        extracted. This must be called after `predict` and before `update`.
+
+        A detection does not need a feature if it and a track are each other's
+        only motion-feasible candidate, and the feature of that track has been
+        refreshed within the last `refresh_interval - 1` updates. `update`
+        matches such detections without a feature to their track directly.
+
+        Parameters
+        ----------
+        detections : detection.DetectionBatch
+            The detections at the current time step, or a list of
+            `detection.Detection`.
+        refresh_interval : int
+            Maximum number of consecutive updates of a track without
+            appearance feature, plus one.
+
+        Returns
+        -------
+        ndarray
+            A boolean array that is True for the detections that need a
+            feature: ambiguous ones, new track candidates and those whose track
+            is due for a feature refresh.
+        """
+        detections = as_batch(detections)
+        required = np.ones(len(detections), dtype=bool)
+        track_idx, detection_idx = self._unambiguous_pairs(
+            self._motion_candidates(detections), len(detections))
+        self._unambiguous = (detections, (track_idx, detection_idx))
+        for track_idx, detection_idx in zip(track_idx, detection_idx):
+            if self.tracks[track_idx].feature_age + 1 < refresh_interval:
+                required[detection_idx] = False
+        return required
+
     def _match(self, detections):
 
         def gated_metric(tracks, dets, track_indices, detection_indices):
-            features = np.array([dets[i].feature for i in detection_indices])
+            # Appearance distances are only computed for the pairs within the
+            # motion gate.
+            features = dets.features[detection_indices]
             targets = np.array([tracks[i].track_id for i in track_indices])
-            cost_matrix = self.metric.distance(features, targets)
-            cost_matrix = linear_assignment.gate_cost_matrix(cost_matrix, tracks, dets, track_indices, detection_indices)
+            return linear_assignment.gated_pair_cost(
+                lambda rows, cols: self.metric.distance_pairs(features, targets, rows, cols),
+                tracks, dets, track_indices, detection_indices,
+                spatial_index=self.spatial_index)
 
-            return cost_matrix
+        # Associate detections without appearance feature (see
+        # `appearance_required`) with their only motion-feasible track.
+        matches_0 = []
+        featureless = np.flatnonzero(~detections.has_feature).tolist()
+        if featureless:
+            if self._unambiguous is not None and self._unambiguous[0] is detections:
+                track_idx, detection_idx = self._unambiguous[1]
+            else:
+                track_idx, detection_idx = self._unambiguous_pairs(
+                    self._motion_candidates(detections), len(detections))
+            matches_0 = [(int(t), int(d)) for t, d in zip(track_idx, detection_idx)
+                         if not detections.has_feature[d]]
+        matched_tracks = set(t for t, _ in matches_0)
+        matched_detections = set(d for _, d in matches_0)
 
         # Split track set into confirmed and unconfirmed tracks.
         confirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if t.is_confirmed()]
+            i for i, t in enumerate(self.tracks) if t.is_confirmed() and i not in matched_tracks]
         unconfirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if not t.is_confirmed()]
+            i for i, t in enumerate(self.tracks) if not t.is_confirmed() and i not in matched_tracks]
 
         # Associate confirmed tracks using appearance features.
         matches_a, unmatched_tracks_a, unmatched_detections = \
             linear_assignment.matching_cascade(
                 gated_metric, self.metric.matching_threshold, self.max_age,
-                self.tracks, detections, confirmed_tracks)
+                self.tracks, detections, confirmed_tracks,
+                np.flatnonzero(detections.has_feature).tolist(), self.solver)
+        if featureless:
+            unmatched_detections = sorted(unmatched_detections + [
+                i for i in featureless if i not in matched_detections])
 
         # Associate remaining tracks together with unconfirmed tracks using IOU.
         iou_track_candidates = unconfirmed_tracks + [
@@ -163,15 +369,19 @@ class Tracker:
             self.tracks[k].time_since_update != 1]
         matches_b, unmatched_tracks_b, unmatched_detections = \
             linear_assignment.min_cost_matching(
-                iou_matching.iou_cost, self.max_iou_distance, self.tracks,
-                detections, iou_track_candidates, unmatched_detections)
+                iou_matching.sparse_iou_cost if self.spatial_index else iou_matching.iou_cost,
+                self.max_iou_distance, self.tracks,
+                detections, iou_track_candidates, unmatched_detections, self.solver)
 
-        matches = matches_a + matches_b
+        matches = matches_0 + matches_a + matches_b
         unmatched_tracks = list(set(unmatched_tracks_a + unmatched_tracks_b))
         return matches, unmatched_tracks, unmatched_detections
 
-    def _initiate_track(self, detection, class_id, conf):
-        self.tracks.append(Track(
-            detection.to_xyah(), self._next_id, class_id, conf, self.n_init, self.max_age, self.ema_alpha,
-            detection.feature))
+    def _initiate_track(self, xyah, feature, class_id, conf, slot=None):
+        # reinitialize a recycled record of a deleted track if there is one
+        track = self._free_tracks.pop() if self._free_tracks else Track.__new__(Track)
+        track.__init__(
+            xyah, self._next_id, class_id, conf, self.n_init, self.max_age, self.ema_alpha,
+            feature, store=self.store, slot=slot)
+        self.tracks.append(track)
         self._next_id += 1
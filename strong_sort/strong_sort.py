@@ -1,16 +1,13 @@
 import numpy as np
 import torch
 import sys
-import gdown
-from os.path import exists as file_exists, join
 
 from .sort.nn_matching import NearestNeighborDistanceMetric
-from .sort.detection import Detection
+from .sort.detection import DetectionBatch
 from .sort.tracker import Tracker
-from .deep.reid_model_factory import show_downloadeable_models, get_model_url, get_model_name
-
-from torchreid.utils import FeatureExtractor
-from torchreid.utils.tools import download_url
+from .sort.cmc import build_cmc
+from .sort.solvers import build_solver
+from .deep.reid_service import ReIDService
 
 __all__ = ['StrongSORT']
 
@@ -23,49 +20,118 @@ class StrongSORT(object):
                  max_age=70, n_init=3,
                  nn_budget=100,
                  mc_lambda=0.995,
-                 ema_alpha=0.9
+                 ema_alpha=0.9,
+                 cmc_method='ecc',
+                 cmc_scale=None,
+                 cmc_static_thresh=None,
+                 cmc_static_size=None,
+                 extractor=None,
+                 lazy_reid=False,
+                 reid_refresh=10,
+                 solver='auto',
+                 solver_exact_size=None,
+                 solver_sparse_density=None,
+                 solver_dense_density=None,
+                 spatial_index=False
                 ):
-        model_name = get_model_name(model_weights)
-        model_url = get_model_url(model_weights)
-
-        if not file_exists(model_weights) and model_url is not None:
-            gdown.download(model_url, str(model_weights), quiet=False)
-        elif file_exists(model_weights):
-            pass
-        elif model_url is None:
-            print('No URL associated to the chosen DeepSort weights. Choose between:')
-            show_downloadeable_models()
-            exit()
-
-        self.extractor = FeatureExtractor(
-            # get rid of dataset information DeepSort model name
-            model_name=model_name,
-            model_path=model_weights,
-            device=str(device)
-        )
+        # a ReIDService shared between several instances avoids loading one
+        # model per video source
+        self.extractor = extractor if extractor is not None else ReIDService(model_weights, device)
+
+        # in lazy mode, appearance features are only extracted for detections
+        # that motion alone cannot associate
+        self.lazy_reid = lazy_reid
+        self.reid_refresh = reid_refresh
+        self.reid_stats = {'computed': 0, 'skipped': 0}
+        self._pending = None
+        # frames the tracker has coasted through since the last detector frame
+        self.coasted = 0
 
         self.max_dist = max_dist
         metric = NearestNeighborDistanceMetric(
             "cosine", self.max_dist, nn_budget)
         self.tracker = Tracker(
-            metric, max_iou_distance=max_iou_distance, max_age=max_age, n_init=n_init)
+            metric, max_iou_distance=max_iou_distance, max_age=max_age, n_init=n_init,
+            cmc=build_cmc(cmc_method, scale=cmc_scale, static_thresh=cmc_static_thresh,
+                          static_size=cmc_static_size),
+            solver=build_solver(solver, exact_size=solver_exact_size, sparse_density=solver_sparse_density,
+                                dense_density=solver_dense_density),
+            spatial_index=spatial_index)
+
+    def update(self, bbox_xywh, confidences, classes, ori_img, features=None, dt=1.):
+        """Run one tracking step. `features` can be passed if the appearance
+        features of the detections have already been extracted, e.g. by a
+        `ReIDService` batching several sources. Otherwise they are extracted
+        here, in lazy mode only for the detections that need them. `dt` is the
+        time since the previous step or `coast` in frames.
+
+        The inputs may be NumPy arrays or torch tensors on any device. They
+        are converted to NumPy once here, the tracker itself only works on
+        NumPy arrays.
+        """
+        if features is None and self.lazy_reid:
+            boxes = self.begin_update(bbox_xywh, confidences, classes, ori_img, dt)
+            features = self.extractor.extract([ori_img], [boxes])[0] if len(boxes) else None
+            return self.finish_update(features)
 
-    def update(self, bbox_xywh, confidences, classes, ori_img):
         self.height, self.width = ori_img.shape[:2]
+        bbox_xywh = self._to_numpy(bbox_xywh).reshape(-1, 4)
         # generate detections
-        features = self._get_features(bbox_xywh, ori_img)
-        bbox_tlwh = self._xywh_to_tlwh(bbox_xywh)
-        detections = [Detection(bbox_tlwh[i], conf, features[i]) for i, conf in enumerate(
-            confidences)]
-
-        # run on non-maximum supression
-        boxes = np.array([d.tlwh for d in detections])
-        scores = np.array([d.confidence for d in detections])
+        if features is None:
+            features = self._get_features(bbox_xywh, ori_img)
+        detections = self._detections(bbox_xywh, confidences, classes, features)
 
         # update tracker
-        self.tracker.predict()
-        self.tracker.update(detections, classes, confidences)
+        self.tracker.predict(dt)
+        self.coasted = 0
+        self.reid_stats = {'computed': len(detections), 'skipped': 0}
+        self.tracker.update(detections)
+        return self._outputs()
+
+    def begin_update(self, bbox_xywh, confidences, classes, ori_img, dt=1.):
+        """First half of a lazy tracking step, which lets the caller extract
+        the appearance features of several sources in one batch. Predicts the
+        tracks and returns the Nx4 integer crop boxes of the detections that
+        need a feature (see `Tracker.appearance_required`). Pass their
+        features to `finish_update`; nothing else may change the tracker in
+        between. Takes the same arguments as `update`.
+        """
+        self.height, self.width = ori_img.shape[:2]
+        bbox_xywh = self._to_numpy(bbox_xywh).reshape(-1, 4)
+        detections = self._detections(bbox_xywh, confidences, classes)
+        self.tracker.predict(dt)
+        self.coasted = 0
+        required = np.flatnonzero(self.tracker.appearance_required(detections, self.reid_refresh))
+        self._pending = (detections, required)
+        return self.get_boxes(bbox_xywh, ori_img)[required]
+
+    def finish_update(self, features):
+        """Second half of a lazy tracking step, given the features of the boxes
+        returned by `begin_update`. Returns the tracks like `update`."""
+        detections, required = self._pending
+        self._pending = None
+        if len(required):
+            detections.set_features(required, self._to_numpy(features))
+        self.reid_stats = {'computed': len(required), 'skipped': len(detections) - len(required)}
+        self.tracker.update(detections)
+        return self._outputs()
+
+    def _detections(self, bbox_xywh, confidences, classes, features=None):
+        return DetectionBatch(
+            self._xywh_to_tlwh(bbox_xywh), self._to_numpy(confidences),
+            None if features is None else self._to_numpy(features), self._to_numpy(classes))
+
+    def coast(self, dt=1., conf_decay=1.):
+        """Propagate the tracks by their motion model only, on a frame the
+        detector does not run on, and return their predicted boxes like
+        `update`. The confidence of each box is the one of its last detection
+        times `conf_decay` per frame coasted since the last detector frame.
+        """
+        self.tracker.coast(dt)
+        self.coasted += 1
+        return self._outputs(conf_decay ** self.coasted)
 
+    def _outputs(self, conf_scale=1.):
         # output bbox identities
         outputs = []
         for track in self.tracker.tracks:
@@ -77,7 +143,7 @@ class StrongSORT(object):
             
             track_id = track.track_id
             class_id = track.class_id
-            conf = track.conf
+            conf = track.conf * conf_scale
             outputs.append(np.array([x1, y1, x2, y2, track_id, class_id, conf]))
         if len(outputs) > 0:
             outputs = np.stack(outputs, axis=0)
@@ -90,10 +156,7 @@ class StrongSORT(object):
     """
     @staticmethod
     def _xywh_to_tlwh(bbox_xywh):
-        if isinstance(bbox_xywh, np.ndarray):
-            bbox_tlwh = bbox_xywh.copy()
-        elif isinstance(bbox_xywh, torch.Tensor):
-            bbox_tlwh = bbox_xywh.clone()
+        bbox_tlwh = bbox_xywh.copy()
         bbox_tlwh[:, 0] = bbox_xywh[:, 0] - bbox_xywh[:, 2] / 2.
         bbox_tlwh[:, 1] = bbox_xywh[:, 1] - bbox_xywh[:, 3] / 2.
         return bbox_tlwh
@@ -119,8 +182,16 @@ class StrongSORT(object):
         y2 = min(int(y+h), self.height - 1)
         return x1, y1, x2, y2
 
-    def increment_ages(self):
+    def increment_ages(self, dt=None):
+        """Age all tracks and mark them missed, on a step without detections.
+        If `dt`, the time since the previous step or `coast` in frames, is
+        given, the tracks are also predicted by it, so that the next step
+        only covers the time after this one.
+        """
+        if dt is not None:
+            self.tracker.coast(dt)
         self.tracker.increment_ages()
+        self.coasted = 0
 
     def _xyxy_to_tlwh(self, bbox_xyxy):
         x1, y1, x2, y2 = bbox_xyxy
@@ -131,14 +202,23 @@ class StrongSORT(object):
         h = int(y2 - y1)
         return t, l, w, h
 
+    def get_boxes(self, bbox_xywh, ori_img):
+        """Convert `(center x, center y, w, h)` boxes to integer `(x1, y1, x2,
+        y2)` crop boxes clipped to `ori_img`."""
+        self.height, self.width = ori_img.shape[:2]
+        bbox_xywh = np.asarray(bbox_xywh, dtype=np.float64).reshape(-1, 4)
+        x, y, w, h = bbox_xywh.T
+        x1 = np.maximum((x - w / 2).astype(int), 0)
+        x2 = np.minimum((x + w / 2).astype(int), self.width - 1)
+        y1 = np.maximum((y - h / 2).astype(int), 0)
+        y2 = np.minimum((y + h / 2).astype(int), self.height - 1)
+        return np.stack([x1, y1, x2, y2], axis=1)
+
+    @staticmethod
+    def _to_numpy(x):
+        if isinstance(x, torch.Tensor):
+            return x.detach().cpu().numpy()
+        return np.asarray(x)
+
     def _get_features(self, bbox_xywh, ori_img):
-        im_crops = []
-        for box in bbox_xywh:
-            x1, y1, x2, y2 = self._xywh_to_xyxy(box)
-            im = ori_img[y1:y2, x1:x2]
-            im_crops.append(im)
-        if im_crops:
-            features = self.extractor(im_crops)
-        else:
-            features = np.array([])
-        return features
+        return self.extractor.extract([ori_img], [self.get_boxes(bbox_xywh, ori_img)])[0]
\ No newline at end of file
@@ -10,9 +10,13 @@ os.environ["VECLIB_MAXIMUM_THREADS"] = "1"
 os.environ["NUMEXPR_NUM_THREADS"] = "1"
 
 import sys
+import time
 from pathlib import Path
 from lf.gst_loader import LoadGstAppSink
+from lf.cmc_worker import CMCWorker
+from lf.frame_clock import FrameClock
 
+import numpy as np
 import torch
 import torch.backends.cudnn as cudnn
 
@@ -37,6 +41,11 @@ from yolov5.utils.torch_utils import select_device, time_sync
 from yolov5.utils.plots import Annotator, colors, save_one_box
 from strong_sort.utils.parser import get_config
 from strong_sort.strong_sort import StrongSORT
+from strong_sort.deep.reid_service import ReIDService
+from strong_sort.sort.solvers import CostRecorder
+from lf.motion_gate import MotionGate
+from lf.roi_detect import ROIDetector
+from lf.tiling import TiledDetector
 
 # remove duplicated stream handler to avoid duplicated logging
 logging.getLogger().removeHandler(logging.getLogger().handlers[0])
@@ -80,6 +89,19 @@ def run(
         frame_mod=1,  # show every n=th frame
         threads=1,  # inference threads
         scale=1.0,  # video display scale
+        reid_roi_align=False,  # crop ReID inputs with ROI-align from the detector input
+        record_costs=None,  # save the assignment cost matrices to this .npz file, see benchmark.py
+        detect_interval=1,  # run the detector on every n-th processed frame, Kalman prediction only in between
+        conf_decay=0.9,  # confidence factor per frame of the boxes predicted between detector frames
+        kalman_timestamps=False,  # Kalman time steps from capture timestamps instead of frame indices
+        roi_detect=0,  # full-frame detector pass every n-th detector frame, only around the tracks in between (0: off)
+        roi_imgsz=320,  # inference size of the regions around the tracks
+        roi_margin=0.5,  # margin around the predicted track boxes, relative to their larger side
+        tile_size=0,  # detect in overlapping tiles of this size in frame pixels (0: off)
+        tile_overlap=128,  # minimum overlap of neighbouring tiles in frame pixels
+        tile_global=0,  # inference size of an additional pass over the whole tiled frame (0: off)
+        motion_gate=0,  # skip the detector on unchanged frames of empty scenes, at most this many in a row (0: off)
+        motion_min_changed=0.002,  # fraction of changed pixels of the downscaled frame that counts as a change
 ):
 
     if gst_source:
@@ -123,6 +145,13 @@ def run(
     model = DetectMultiBackend(yolo_weights, device=device, dnn=dnn, data=None, fp16=half)
     stride, names, pt = model.stride, model.names, model.pt
     imgsz = check_img_size(imgsz, s=stride)  # check image size
+    roi_detector = ROIDetector(model, check_img_size(roi_imgsz, s=stride), roi_margin, conf_thres=conf_thres,
+                               iou_thres=iou_thres, classes=classes, agnostic=agnostic_nms,
+                               max_det=max_det) if roi_detect > 1 else None
+    tiled_detector = TiledDetector(model, check_img_size(tile_size, s=stride), tile_overlap,
+                                   check_img_size(tile_global, s=stride) if tile_global else 0, conf_thres=conf_thres,
+                                   iou_thres=iou_thres, classes=classes, agnostic=agnostic_nms,
+                                   max_det=max_det) if tile_size else None
 
     # Dataloader
     if is_gst:
@@ -145,6 +174,13 @@ def run(
     cfg = get_config()
     cfg.merge_from_file(opt.config_strongsort)
 
+    # One ReID model shared by all video sources, run once per frame on the crops of all sources
+    try:
+        reid = ReIDService(strong_sort_weights, device, fp16=half)
+    except FileNotFoundError as e:
+        LOGGER.error(e)
+        sys.exit(1)
+
     # Create as many strong sort instances as there are video sources
     strongsort_list = []
     for i in range(nr_sources):
@@ -159,11 +195,34 @@ def run(
                 nn_budget=cfg.STRONGSORT.NN_BUDGET,
                 mc_lambda=cfg.STRONGSORT.MC_LAMBDA,
                 ema_alpha=cfg.STRONGSORT.EMA_ALPHA,
-
+                cmc_method=cfg.STRONGSORT.CMC_METHOD,
+                cmc_scale=cfg.STRONGSORT.CMC_SCALE,
+                cmc_static_thresh=cfg.STRONGSORT.CMC_STATIC_THRESH,
+                cmc_static_size=cfg.STRONGSORT.CMC_STATIC_SIZE,
+                extractor=reid,
+                lazy_reid=cfg.STRONGSORT.LAZY_REID,
+                reid_refresh=cfg.STRONGSORT.REID_REFRESH,
+                solver=cfg.STRONGSORT.SOLVER,
+                solver_exact_size=cfg.STRONGSORT.SOLVER_EXACT_SIZE,
+                solver_sparse_density=cfg.STRONGSORT.SOLVER_SPARSE_DENSITY,
+                solver_dense_density=cfg.STRONGSORT.SOLVER_DENSE_DENSITY,
+                spatial_index=cfg.STRONGSORT.SPATIAL_INDEX,
             )
         )
+        if record_costs:  # one recording of the assignment problems of all sources
+            tracker = strongsort_list[i].tracker
+            recorder = recorder if i else CostRecorder(tracker.solver)
+            tracker.solver = recorder
     outputs = [None] * nr_sources
 
+    # camera motion compensation runs on a worker thread while the detector runs
+    cmc_worker = CMCWorker(max_pending=nr_sources) if cfg.STRONGSORT.ECC else None
+
+    def apply_camera_motion(i):  # warp the tracks of source i, returns the estimation time
+        strongsort_list[i].tracker.apply_camera_motion(cmc_worker.join(i))
+        dt[4] += cmc_worker.waited.get(i, 0.0)
+        return cmc_worker.elapsed.get(i, 0.0)
+
     is_quit = False         # Used to signal that quit is called
     is_paused = False       # Used to signal that pause is called
     frame_counter = 0
@@ -188,6 +247,22 @@ def run(
 
     LOGGER.info("pt inter thread: %d intra threads: %d", num_inter_threads, threads)
 
+    # time between the Kalman filter steps of each source, in frames
+    clocks = [FrameClock(dataset.fps[i] if webcam else video_fps) for i in range(nr_sources)]
+    detector_frames, coasted_frames = [0] * nr_sources, [0] * nr_sources
+    motion_gates = [MotionGate(min_changed=motion_min_changed, max_interval=motion_gate)
+                    for _ in range(nr_sources)] if motion_gate else None
+    detector_passes = 0
+
+    def capture_time(vid_cap):
+        # capture time of the current frame in seconds: the position in video
+        # files, the arrival time for live streams, unknown for images
+        if webcam or is_gst:
+            return time.time()
+        if vid_cap:
+            return vid_cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        return None
+
     # video controller
     def quit_key_action(**params):
         nonlocal is_quit
@@ -260,8 +335,8 @@ def run(
 
     # Run tracking
     model.warmup(imgsz=(1 if pt else nr_sources, 3, *imgsz))  # warmup
-    dt, seen = [0.0, 0.0, 0.0, 0.0], 0
-    curr_frames, prev_frames = [None] * nr_sources, [None] * nr_sources
+    reid.extractor.warmup()
+    dt, seen = [0.0, 0.0, 0.0, 0.0, 0.0], 0
     for frame_idx, (path, im, im0s, vid_cap, s) in enumerate(dataset):
         if len(im.shape) == 3:
             im_display = im[::-1].transpose(1,2,0)
@@ -280,24 +355,95 @@ def run(
         if (frame_idx % frame_mod) != 0:
             continue
 
-        t1 = time_sync()
-        im = torch.from_numpy(im).to(device)
-        im = im.half() if half else im.float()  # uint8 to fp16/32
-        im /= 255.0  # 0 - 255 to 0.0 - 1.0
-        if len(im.shape) == 3:
-            im = im[None]  # expand for batch dim
-        t2 = time_sync()
-        dt[0] += t2 - t1
-
-        # Inference
-        visualize = increment_path(save_dir / Path(path[0]).stem, mkdir=True) if opt.visualize else False
-        pred = model(im, augment=opt.augment, visualize=visualize)
-        t3 = time_sync()
-        dt[1] += t3 - t2
-
-        # Apply NMS
-        pred = non_max_suppression(pred, opt.conf_thres, opt.iou_thres, opt.classes, opt.agnostic_nms, max_det=opt.max_det)
-        dt[2] += time_sync() - t3
+        # the detector and ReID run on every detect_interval-th processed
+        # frame, the tracks are only predicted on the frames in between
+        detect = (frame_idx // frame_mod) % detect_interval == 0
+        t_frame = time_sync()
+        timestamp = capture_time(vid_cap)
+        clock_time = timestamp if kalman_timestamps else None
+        frames = im0s if webcam else [im0s]
+        t_cmc = [None] * nr_sources
+        gated = False
+        if detect and motion_gates:
+            # skip the detector if no source has changed or active tracks
+            needed = [gate.needs_detection(frame, strongsort.tracker)
+                      for gate, frame, strongsort in zip(motion_gates, frames, strongsort_list)]
+            detect = any(needed)
+            gated = not detect
+            for gate in motion_gates:
+                gate.record(detect)
+
+        if not detect:
+            pred = [None] * nr_sources
+        else:
+            if cmc_worker:  # start camera motion estimation as soon as the frames are decoded
+                for i, frame in enumerate(frames):
+                    cmc_worker.submit(i, strongsort_list[i].tracker, frame)
+
+            # between full-frame passes, detect only in the regions around
+            # the predicted tracks, unless they cover most of the frames
+            regions = None
+            if roi_detector and detector_passes % roi_detect:
+                regions = roi_detector.plan(
+                    frames, [strongsort.tracker for strongsort in strongsort_list],
+                    [clock.elapsed(frame_idx, clock_time) for clock in clocks])
+            detector_passes += 1
+            full_frame = regions is None and tiled_detector is None
+
+            if full_frame:
+                t1 = time_sync()
+                im = torch.from_numpy(im).to(device)
+                im = im.half() if half else im.float()  # uint8 to fp16/32
+                im /= 255.0  # 0 - 255 to 0.0 - 1.0
+                if len(im.shape) == 3:
+                    im = im[None]  # expand for batch dim
+                t2 = time_sync()
+                dt[0] += t2 - t1
+
+                # Inference
+                visualize = increment_path(save_dir / Path(path[0]).stem, mkdir=True) if opt.visualize else False
+                pred = model(im, augment=opt.augment, visualize=visualize)
+                t3 = time_sync()
+                dt[1] += t3 - t2
+
+                # Apply NMS
+                pred = non_max_suppression(pred, opt.conf_thres, opt.iou_thres, opt.classes, opt.agnostic_nms, max_det=opt.max_det)
+                dt[2] += time_sync() - t3
+            else:
+                # ROI or tiled inference, the detections are in frame coordinates
+                t2 = time_sync()
+                pred = tiled_detector.detect(frames) if regions is None else roi_detector.detect(frames, regions)
+                t3 = time_sync()
+                dt[1] += t3 - t2
+
+            # Rescale boxes and extract the appearance features of all sources in one batch
+            t4 = time_sync()
+            crop_boxes, roi_boxes = [], []
+            for i, (det, frame) in enumerate(zip(pred, frames)):
+                if det is not None and len(det):
+                    if full_frame:
+                        roi_boxes.append(det[:, :4].clone())
+                        # Rescale boxes from img_size to im0 size
+                        det[:, :4] = scale_coords(im.shape[2:], det[:, :4], frame.shape).round()
+                    if cfg.STRONGSORT.LAZY_REID:
+                        # predict the tracks first, only the detections that
+                        # motion cannot associate need a feature
+                        if cmc_worker:
+                            t_cmc[i] = apply_camera_motion(i)
+                        crop_boxes.append(strongsort_list[i].begin_update(
+                            xyxy2xywh(det[:, 0:4]), det[:, 4], det[:, 5], frame,
+                            dt=clocks[i].tick(frame_idx, clock_time)))
+                    else:
+                        crop_boxes.append(strongsort_list[i].get_boxes(xyxy2xywh(det[:, 0:4]).cpu(), frame))
+                else:
+                    roi_boxes.append(torch.zeros((0, 4), device=device))
+                    crop_boxes.append(np.zeros((0, 4), dtype=int))
+            if reid_roi_align and full_frame and not cfg.STRONGSORT.LAZY_REID:  # crop from the detector input that already is on the device
+                features = reid.extract_roi(im, roi_boxes)
+            else:
+                features = reid.extract(frames, crop_boxes)
+            t_reid = time_sync() - t4
+            dt[3] += t_reid
 
         # Process detections
         for i, det in enumerate(pred):  # detections per image
@@ -319,20 +465,32 @@ def run(
                 else:
                     txt_file_name = p.parent.name  # get folder name containing current img
                     save_path = str(save_dir / p.parent.name)  # im.jpg, vid.mp4, ...
-            curr_frames[i] = im0
 
             txt_path = str(save_dir / 'tracks' / txt_file_name)  # im.txt
-            s += '{}x{} [{}] '.format(im.shape[2], im.shape[3], frame_idx)  # print string
+            s += '{}x{} [{}] '.format(im.shape[-2], im.shape[-1], frame_idx)  # print string
             imc = im0.copy() if save_crop else im0  # for save_crop
 
             annotator = Annotator(im0, line_width=2, pil=not ascii)
-            if cfg.STRONGSORT.ECC:  # camera motion compensation
-                strongsort_list[i].tracker.camera_update(prev_frames[i], curr_frames[i])
-
-            if det is not None and len(det):
-                # Rescale boxes from img_size to im0 size
-                det[:, :4] = scale_coords(im.shape[2:], det[:, :4], im0.shape).round()
+            if cmc_worker and detect and t_cmc[i] is None:  # camera motion compensation
+                t_cmc[i] = apply_camera_motion(i)
 
+            if gated:
+                # nothing has changed in an empty scene, the tracks miss this frame
+                strongsort_list[i].increment_ages(clocks[i].tick(frame_idx, clock_time))
+                outputs[i] = []
+                if not quite:
+                    LOGGER.info(f'{s}Skipped by the motion gate')
+            elif not detect:
+                # predict the tracks with the Kalman filter only
+                t4 = time_sync()
+                outputs[i] = strongsort_list[i].coast(clocks[i].tick(frame_idx, clock_time), conf_decay)
+                t5 = time_sync()
+                dt[3] += t5 - t4
+                coasted_frames[i] += 1
+                if not quite:
+                    LOGGER.info(f'{s}Predicted. StrongSORT:({t5 - t4:.3f}s)')
+            elif det is not None and len(det):
+                detector_frames[i] += 1
                 # Print results
                 for c in det[:, -1].unique():
                     n = (det[:, -1] == c).sum()  # detections per class
@@ -344,70 +502,81 @@ def run(
 
                 # pass detections to strongsort
                 t4 = time_sync()
-                outputs[i] = strongsort_list[i].update(xywhs.cpu(), confs.cpu(), clss.cpu(), im0)
+                if cfg.STRONGSORT.LAZY_REID:  # the tracks were predicted with the feature extraction
+                    outputs[i] = strongsort_list[i].finish_update(features[i])
+                else:
+                    outputs[i] = strongsort_list[i].update(
+                        xywhs, confs, clss, im0, features[i], dt=clocks[i].tick(frame_idx, clock_time))
                 t5 = time_sync()
                 dt[3] += t5 - t4
 
-                # json out
-                # draw boxes for visualization
-                if len(outputs[i]) > 0:
-                    persons = []
-
-                    for j, (output, conf) in enumerate(zip(outputs[i], confs)):
-    
-                        bboxes = output[0:4]
-                        id = output[4]
-                        cls = output[5]
-
-                        if save_txt or output_file_handle:
-                            # to MOT format
-                            bbox_left = output[0]
-                            bbox_top = output[1]
-                            bbox_w = output[2] - output[0]
-                            bbox_h = output[3] - output[1]
-                            if output_file_handle:
-                                person = {
-                                    "confidence": conf.cpu().numpy().item(),
-                                    "identity": int(id),
-                                    "bbox": {"x": bbox_left, "y": bbox_top, "w": bbox_w, "h": bbox_h},
-                                }
-                                persons.append(person)
-                            if save_txt:
-                                # Write MOT compliant results to file
-                                with open(txt_path + '.txt', 'a') as f:
-                                    f.write(('%g ' * 10 + '\n') % (frame_idx + 1, id, bbox_left,  # MOT format
-                                                                   bbox_top, bbox_w, bbox_h, -1, -1, -1, i))
-
-                        if save_vid or save_crop or show_vid:  # Add bbox to image
-                            c = int(cls)  # integer class
-                            id = int(id)  # integer id
-                            label = None if hide_labels else (f'{id} {names[c]}' if hide_conf else \
-                                (f'{id} {conf:.2f}' if hide_class else f'{id} {names[c]} {conf:.2f}'))
-                            annotator.box_label(bboxes, label, color=colors(c, True))
-                            if save_crop:
-                                txt_file_name = txt_file_name if (isinstance(path, list) and len(path) > 1) else ''
-                                save_one_box(bboxes, imc, file=save_dir / 'crops' / txt_file_name / names[c] / f'{id}' / f'{p.stem}.jpg', BGR=True)
-
-                    if output_file_handle:
-                        out = {
-                            "timestamp": t1,
-                            "frame_id": frame_idx,
-                            "predictions": {
-                                "persons": persons
-                            }
-                        }
-
-                        line = json.dumps(out)
-                        output_file_handle.write(f'{line}\n')
-
                 if not quite:
-                    log_line = f'{s}Done. YOLO:({t3 - t2:.3f}s), StrongSORT:({t5 - t4:.3f}s)'
+                    log_line = f'{s}Done. YOLO:({t3 - t2:.3f}s), ReID:({t_reid:.3f}s), StrongSORT:({t5 - t4:.3f}s), CMC:({t_cmc[i] or 0.0:.3f}s)'
+                    if cfg.STRONGSORT.LAZY_REID:
+                        log_line += f", ReID crops: {strongsort_list[i].reid_stats['computed']} computed, {strongsort_list[i].reid_stats['skipped']} skipped"
                     LOGGER.info(log_line)
             else:
-                strongsort_list[i].increment_ages()
+                detector_frames[i] += 1
+                strongsort_list[i].increment_ages(clocks[i].tick(frame_idx, clock_time))
+                outputs[i] = []
                 if not quite:
                     LOGGER.info('No detections')
 
+            # json out
+            # draw boxes for visualization
+            if outputs[i] is not None and len(outputs[i]) > 0:
+                persons = []
+
+                for j, output in enumerate(outputs[i]):
+
+                    bboxes = output[0:4]
+                    id = output[4]
+                    cls = output[5]
+                    conf = output[6]
+
+                    if save_txt or output_file_handle:
+                        # to MOT format
+                        bbox_left = output[0]
+                        bbox_top = output[1]
+                        bbox_w = output[2] - output[0]
+                        bbox_h = output[3] - output[1]
+                        if output_file_handle:
+                            person = {
+                                "confidence": float(conf),
+                                "identity": int(id),
+                                "bbox": {"x": bbox_left, "y": bbox_top, "w": bbox_w, "h": bbox_h},
+                            }
+                            persons.append(person)
+                        if save_txt:
+                            # Write MOT compliant results to file
+                            with open(txt_path + '.txt', 'a') as f:
+                                f.write(('%g ' * 10 + '\n') % (frame_idx + 1, id, bbox_left,  # MOT format
+                                                               bbox_top, bbox_w, bbox_h, -1, -1, -1, i))
+
+                    if save_vid or save_crop or show_vid:  # Add bbox to image
+                        c = int(cls)  # integer class
+                        id = int(id)  # integer id
+                        label = None if hide_labels else (f'{id} {names[c]}' if hide_conf else \
+                            (f'{id} {conf:.2f}' if hide_class else f'{id} {names[c]} {conf:.2f}'))
+                        annotator.box_label(bboxes, label, color=colors(c, True))
+                        if save_crop:
+                            txt_file_name = txt_file_name if (isinstance(path, list) and len(path) > 1) else ''
+                            save_one_box(bboxes, imc, file=save_dir / 'crops' / txt_file_name / names[c] / f'{id}' / f'{p.stem}.jpg', BGR=True)
+
+                if output_file_handle:
+                    out = {
+                        # capture time of the frame, see capture_time, or its processing start for images
+                        "timestamp": timestamp if timestamp is not None else t_frame,
+                        "frame_id": frame_idx,
+                        "predicted": not detect,
+                        "predictions": {
+                            "persons": persons
+                        }
+                    }
+
+                    line = json.dumps(out)
+                    output_file_handle.write(f'{line}\n')
+
             # Stream results
             im0 = annotator.result()
             if show_vid and (frame_idx % frame_mod) == 0:
@@ -442,21 +611,41 @@ def run(
                     vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
                 vid_writer[i].write(im0)
 
-            prev_frames[i] = curr_frames[i]
-
         if output_file_handle:
             output_file_handle.flush()
 
 
     if output_file_handle:
         output_file_handle.close()
+    if cmc_worker:
+        cmc_worker.close()
+        for i, strongsort in enumerate(strongsort_list):
+            cmc = strongsort.tracker.cmc
+            LOGGER.info('Camera motion source %d: %d frames estimated, %d static frames skipped', i, cmc.computed, cmc.skipped)
+
+    if detect_interval > 1:
+        for i in range(nr_sources):
+            LOGGER.info('Detector source %d: ran on %d frames, %d frames predicted', i, detector_frames[i], coasted_frames[i])
+    if motion_gates:
+        for i, gate in enumerate(motion_gates):
+            LOGGER.info('Motion gate source %d: detector skipped on %d of %d frames (%.1f%%)', i, gate.skipped,
+                        gate.frames, 100 * gate.skipped / max(gate.frames, 1))
+    if roi_detector:
+        LOGGER.info('Detector passes: %d full-frame, %d around the tracks with %d regions',
+                    detector_passes - roi_detector.passes, roi_detector.passes, roi_detector.tiles)
+    if tiled_detector:
+        LOGGER.info('Tiled detection: %d tiles of %d pixels on %d frames', tiled_detector.tiles, tile_size,
+                    tiled_detector.frames)
 
     # Print results
     t = tuple(x / seen * 1E3 for x in dt)  # speeds per image
-    LOGGER.info(f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS, %.1fms strong sort update per image at shape {(1, 3, *imgsz)}' % t)
+    LOGGER.info(f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS, %.1fms strong sort update, %.1fms camera motion compensation wait per image at shape {(1, 3, *imgsz)}' % t)
     if save_txt or save_vid:
         s = f"\n{len(list(save_dir.glob('tracks/*.txt')))} tracks saved to {save_dir / 'tracks'}" if save_txt else ''
         LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}{s}")
+    if record_costs:
+        recorder.save(record_costs)
+        LOGGER.info(f"{len(recorder.problems)} assignment problems saved to {colorstr('bold', record_costs)}")
     if update:
         strip_optimizer(yolo_weights)  # update model (to fix SourceChangeWarning)
 
@@ -500,6 +689,19 @@ def parse_opt():
     parser.add_argument('--frame_mod', type=int, default=1, help='show every n-th frame')
     parser.add_argument('--threads', type=int, default=1, help='number of inference threads')
     parser.add_argument('--scale', type=float, default=1.0, help='video display scale')
+    parser.add_argument('--reid-roi-align', action='store_true', help='crop ReID inputs with ROI-align from the detector input tensor')
+    parser.add_argument('--record-costs', type=str, default=None, help='save the assignment cost matrices to this .npz file for benchmark.py')
+    parser.add_argument('--detect-interval', type=int, default=1, help='run the detector on every n-th processed frame, Kalman prediction only in between')
+    parser.add_argument('--conf-decay', type=float, default=0.9, help='confidence factor per frame of boxes predicted between detector frames')
+    parser.add_argument('--kalman-timestamps', action='store_true', help='Kalman time steps from capture timestamps instead of frame indices')
+    parser.add_argument('--roi-detect', type=int, default=0, help='full-frame detector pass every n-th detector frame, only around the tracks in between')
+    parser.add_argument('--roi-imgsz', type=int, default=320, help='inference size of the regions around the tracks')
+    parser.add_argument('--roi-margin', type=float, default=0.5, help='margin around the predicted track boxes, relative to their larger side')
+    parser.add_argument('--tile-size', type=int, default=0, help='detect in overlapping tiles of this size in frame pixels, for high resolution sources')
+    parser.add_argument('--tile-overlap', type=int, default=128, help='minimum overlap of neighbouring tiles in frame pixels')
+    parser.add_argument('--tile-global', type=int, default=0, help='inference size of an additional pass over the whole tiled frame')
+    parser.add_argument('--motion-gate', type=int, default=0, help='skip the detector on unchanged frames of empty scenes (no track detected on the last detector frame), at most this many in a row')
+    parser.add_argument('--motion-min-changed', type=float, default=0.002, help='fraction of changed pixels of the downscaled frame that counts as a change')
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     print_args(vars(opt))